@@ -0,0 +1,15 @@
+"""
+Benchmarks of the request pipeline, from convert_request to the handlers end to end,
+against an in-memory storage backend.
+
+    python -m skyfi_modelship.bench --output results.json
+    python -m skyfi_modelship.bench --baseline results.json --threshold 0.2
+"""
+from .runner import Benchmark, BenchmarkResult, compare, run_benchmark
+
+__all__ = [
+    "Benchmark",
+    "BenchmarkResult",
+    "compare",
+    "run_benchmark",
+]
@@ -0,0 +1,71 @@
+import argparse
+import fnmatch
+import json
+import platform
+import sys
+from typing import List, Optional
+
+from loguru import logger
+from pydantic import RootModel
+
+from .runner import BenchmarkResult, compare, run_benchmark
+from .scenarios import BENCHMARKS
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m skyfi_modelship.bench", description="SkyFi ModelShip benchmarks"
+    )
+    parser.add_argument("-k", "--filter", default="*",
+                        help="glob of the benchmark names to run, e.g. 'handler.*'")
+    parser.add_argument("--duration", type=float, default=1.0,
+                        help="seconds to run each benchmark")
+    parser.add_argument("--iterations", type=int, help="iterations of each benchmark")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--baseline", help="compare with the results JSON of a previous run")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="allowed p50 slowdown relative to the baseline")
+    parser.add_argument("--log-level", default="WARNING", help="log level of the pipeline")
+    parser.add_argument("--list", action="store_true", help="list the benchmarks and exit")
+    args = parser.parse_args(argv)
+
+    benchmarks = [b for b in BENCHMARKS if fnmatch.fnmatch(b.name, args.filter)]
+    if args.list:
+        print("\n".join(b.name for b in benchmarks))
+        return 0
+
+    logger.remove()
+    logger.add(sys.stderr, level=args.log_level)
+
+    results: List[BenchmarkResult] = []
+    print(f"{'benchmark':<36} {'iterations':>10} {'ops/s':>10} {'p50 ms':>10} {'p99 ms':>10}")
+    for benchmark in benchmarks:
+        result = run_benchmark(benchmark, iterations=args.iterations, duration=args.duration)
+        results.append(result)
+        print(f"{result.name:<36} {result.iterations:>10} {result.ops_per_sec:>10.1f} "
+              f"{result.p50_ms:>10.3f} {result.p99_ms:>10.3f}")
+
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": {
+            result.name: RootModel[BenchmarkResult](result).model_dump() for result in results
+        },
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,107 @@
+from contextlib import contextmanager
+import inspect
+import statistics
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from pydantic.dataclasses import dataclass
+
+from skyfi_modelship.util.timing import percentile
+
+
+@dataclass
+class Benchmark:
+    """
+    A benchmark scenario.
+
+    name: unique name, e.g. convert_request.scalar
+    setup: prepares the scenario and returns the operation to measure, or yields it
+        to clean up the scenario once measured, like a pytest fixture
+    teardown: (Optional) called with the result of every operation, outside of the timing
+    """
+
+    name: str
+    setup: Callable[[], Callable[[], Any]]
+    teardown: Optional[Callable[[Any], None]] = None
+
+
+@dataclass
+class BenchmarkResult:
+    """ Latencies of a benchmark in milliseconds and its throughput in operations per second. """
+
+    name: str
+    iterations: int
+    ops_per_sec: float
+    mean_ms: float
+    p50_ms: float
+    p99_ms: float
+
+
+@contextmanager
+def prepared(benchmark: Benchmark) -> Iterator[Callable[[], Any]]:
+    """ Returns the operation of the benchmark, cleans up its scenario on exit. """
+
+    scenario = benchmark.setup()
+    if not inspect.isgenerator(scenario):
+        yield scenario
+        return
+    try:
+        yield next(scenario)
+    finally:
+        scenario.close()
+
+
+def run_benchmark(
+    benchmark: Benchmark, iterations: Optional[int] = None, duration: float = 1.0, warmup: int = 1
+) -> BenchmarkResult:
+    """
+    Runs the benchmark operation iterations times, or for about duration seconds,
+    after warmup runs.
+    """
+
+    teardown = benchmark.teardown or (lambda result: None)
+    latencies = []
+    with prepared(benchmark) as operation:
+        for _ in range(warmup):
+            teardown(operation())
+
+        deadline = time.perf_counter() + duration
+        while (len(latencies) < iterations) if iterations else \
+                (not latencies or time.perf_counter() < deadline):
+            start = time.perf_counter()
+            result = operation()
+            latencies.append(time.perf_counter() - start)
+            teardown(result)
+
+    latencies.sort()
+    total = sum(latencies)
+    return BenchmarkResult(
+        name=benchmark.name,
+        iterations=len(latencies),
+        ops_per_sec=len(latencies) / total if total else float("inf"),
+        mean_ms=statistics.fmean(latencies) * 1000,
+        p50_ms=percentile(latencies, 50) * 1000,
+        p99_ms=percentile(latencies, 99) * 1000,
+    )
+
+
+def compare(
+    results: List[BenchmarkResult], baseline: Dict[str, Dict[str, Any]], threshold: float
+) -> List[str]:
+    """
+    Compares the p50 latencies with the baseline results, keyed by benchmark name.
+    Returns a description of every benchmark slower than the baseline by more than threshold.
+    """
+
+    regressions = []
+    for result in results:
+        base = baseline.get(result.name)
+        if base is None:
+            continue
+        ratio = result.p50_ms / base["p50_ms"] if base["p50_ms"] else 1.0
+        if ratio > 1 + threshold:
+            regressions.append(
+                f"{result.name}: p50 {result.p50_ms:.3f} ms vs {base['p50_ms']:.3f} ms "
+                f"({ratio:.2f}x)"
+            )
+    return regressions
@@ -0,0 +1,258 @@
+import asyncio
+from contextlib import contextmanager
+import inspect
+import sys
+from typing import Any, Callable, Dict, Iterator, List
+from unittest.mock import patch
+import uuid
+
+import orjson
+from pydantic import create_model
+
+import skyfi_modelship as skyfi
+from skyfi_modelship.util.execution import InferenceResponse, cleanup, exec_func, to_jsonable
+from skyfi_modelship.util.inference_request import convert_request
+from skyfi_modelship.util.model_transformer import download_callable, walk_fields
+from skyfi_modelship.util.storage import MemoryBackend, register_backend
+
+from .runner import Benchmark
+
+OUTPUT_FOLDER = "memory://bench/output"
+LIST_SIZE = 100_000
+GEOJSON_FEATURES = 10_000
+OUTPUTS = 1_000
+FILES = 16
+FILE_SIZE = 256 * 1024
+
+
+def scalar_inference(num: skyfi.float, label: skyfi.str) -> skyfi.FloatOutput:
+    return skyfi.FloatOutput(value=num * 2, name="output_num")
+
+
+def list_inference(values: skyfi.list[skyfi.float]) -> skyfi.FloatOutput:
+    return skyfi.FloatOutput(value=sum(values), name="output_sum")
+
+
+def geojson_inference(aoi: skyfi.GeoJSON) -> skyfi.IntOutput:
+    return skyfi.IntOutput(value=len(aoi.features), name="output_features")
+
+
+def outputs_inference(count: skyfi.int) -> List[skyfi.FloatOutput]:
+    return [skyfi.FloatOutput(value=idx, name=f"output_{idx}") for idx in range(count)]
+
+
+def file_inference(images: skyfi.list[skyfi.GeoTIFF]) -> List[skyfi.GeoTIFFOutput]:
+    return [
+        skyfi.GeoTIFFOutput(value=image, name=f"output_{idx}", ref_name="images")
+        for idx, image in enumerate(images)
+    ]
+
+
+def feature(idx: int) -> Dict[str, Any]:
+    x, y = idx % 180, idx % 90
+    return {
+        "type": "Feature",
+        "geometry": {
+            "type": "Polygon",
+            "coordinates": [[[x, y], [x + 1, y], [x + 1, y + 1], [x, y + 1], [x, y]]],
+        },
+        "properties": {"id": idx, "class": "building"},
+    }
+
+
+GEOJSON = orjson.dumps({
+    "type": "FeatureCollection",
+    "features": [feature(idx) for idx in range(GEOJSON_FEATURES)],
+}).decode()
+
+PAYLOADS: Dict[str, Callable[[], Dict[str, Any]]] = {
+    "scalar": lambda: {"num": 21, "label": "scene"},
+    "list_float": lambda: {"values": [0.5] * LIST_SIZE},
+    "geojson": lambda: {"aoi": GEOJSON},
+    "outputs": lambda: {"count": OUTPUTS},
+    "files": lambda: {"images": [
+        {"path": f"memory://bench/input/image_{idx}.tif",
+         "metadata_xml_path": f"memory://bench/input/image_{idx}.xml"}
+        for idx in range(FILES)
+    ]},
+}
+
+FUNCTIONS: Dict[str, Callable] = {
+    "scalar": scalar_inference,
+    "list_float": list_inference,
+    "geojson": geojson_inference,
+    "outputs": outputs_inference,
+    "files": file_inference,
+}
+
+
+@contextmanager
+def memory_storage() -> Iterator[MemoryBackend]:
+    """
+    Serves the memory:// urls from a MemoryBackend holding the input files,
+    the previous backend is registered again on exit.
+    """
+
+    backend = MemoryBackend()
+    for idx in range(FILES):
+        backend.put(f"memory://bench/input/image_{idx}.tif", b"\0" * FILE_SIZE)
+        backend.put(f"memory://bench/input/image_{idx}.xml", b"<metadata/>")
+    previous = register_backend("memory", backend)
+    try:
+        yield backend
+    finally:
+        register_backend("memory", previous)
+
+
+def request(payload: str) -> Dict[str, Any]:
+    return {"request_id": str(uuid.uuid4()), "output_folder": OUTPUT_FOLDER} | \
+        PAYLOADS[payload]()
+
+
+def convert(payload: str) -> Callable[[], Iterator[Callable[[], Any]]]:
+    def setup():
+        with memory_storage():
+            func = FUNCTIONS[payload]
+            yield lambda: convert_request(request(payload), func)
+    return setup
+
+
+def convert_request_per_call(data: Dict[str, Any], func: Callable) -> Any:
+    # the conversion before RequestPlan: new model and full walk on every request
+    model_args = {
+        arg: (param.annotation, ...) for arg, param in inspect.signature(func).parameters.items()
+    }
+    FunctionArguments = create_model("FunctionArguments", **model_args)
+    kwargs = FunctionArguments.model_validate(data)
+    walk_fields("request", vars(kwargs), download_callable(data.get("request_id")))
+    return kwargs
+
+
+def convert_per_call(payload: str) -> Callable[[], Callable[[], Any]]:
+    def setup():
+        func = FUNCTIONS[payload]
+        return lambda: convert_request_per_call(request(payload), func)
+    return setup
+
+
+def execute(payload: str) -> Callable[[], Iterator[Callable[[], Any]]]:
+    def setup():
+        with memory_storage():
+            func = FUNCTIONS[payload]
+            yield lambda: exec_func(func, convert_request(request(payload), func))
+    return setup
+
+
+def walk_outputs() -> Callable[[], Any]:
+    response = outputs_inference(OUTPUTS)
+    return lambda: walk_fields("response", response, lambda field, obj: None)
+
+
+def serialize_outputs() -> Callable[[], Any]:
+    response = InferenceResponse(
+        request_id=uuid.uuid4(), output_folder=OUTPUT_FOLDER,
+        response=outputs_inference(OUTPUTS), timings={"inference": 0.1},
+    )
+    return lambda: orjson.dumps(to_jsonable(response))
+
+
+def args_handler(payload: str) -> Callable[[], Iterator[Callable[[], Any]]]:
+    def setup():
+        from skyfi_modelship.handler.args_handler import ArgsHandler
+
+        func = FUNCTIONS[payload]
+        argv = ["bench", "--request-id", str(uuid.uuid4()), "--output-folder", OUTPUT_FOLDER]
+        for name, value in PAYLOADS[payload]().items():
+            argv += [f"--{name}", str(value)]
+
+        def run():
+            with patch.object(sys, "argv", argv):
+                return ArgsHandler().handle(func)
+
+        with memory_storage():
+            yield run
+    return setup
+
+
+def fastapi_handler(payload: str) -> Callable[[], Iterator[Callable[[], Any]]]:
+    def setup():
+        from starlette.requests import Request
+
+        from skyfi_modelship.handler.fastapi_handler import FastApiHandler
+
+        handler = FastApiHandler()
+        post = handler.handle(FUNCTIONS[payload])
+        loop = asyncio.new_event_loop()
+
+        def run():
+            body = orjson.dumps(request(payload))
+
+            async def receive():
+                return {"type": "http.request", "body": body, "more_body": False}
+
+            scope = {"type": "http", "method": "POST", "path": "/", "headers": [],
+                     "query_string": b""}
+            return loop.run_until_complete(post(Request(scope, receive)))
+
+        try:
+            with memory_storage():
+                yield run
+        finally:
+            loop.close()
+            handler.executor.shutdown()
+            if handler.pipeline is not None:
+                handler.pipeline.shutdown()
+    return setup
+
+
+class NullChannel:
+    """ Channel discarding the publishes and acks of the RabbitMQHandler. """
+
+    def basic_publish(self, **kwargs):
+        pass
+
+    def basic_ack(self, **kwargs):
+        pass
+
+    def basic_reject(self, **kwargs):
+        raise RuntimeError(f"Message rejected: {kwargs}")
+
+
+def rabbitmq_handler(payload: str) -> Callable[[], Iterator[Callable[[], Any]]]:
+    def setup():
+        import pika
+        from pika.spec import Basic
+
+        from skyfi_modelship.handler.rabbitmq_handler import RabbitMQHandler
+
+        handler = RabbitMQHandler()
+        callback = handler.handle(FUNCTIONS[payload])
+        channel, method, properties = NullChannel(), Basic.Deliver(delivery_tag=1), \
+            pika.BasicProperties()
+        try:
+            with memory_storage():
+                yield lambda: callback(
+                    channel, method, properties, orjson.dumps(request(payload))
+                )
+        finally:
+            if handler.pipeline is not None:
+                handler.pipeline.shutdown()
+    return setup
+
+
+BENCHMARKS = [
+    *[Benchmark(name=f"convert_request.{payload}", setup=convert(payload), teardown=cleanup)
+      for payload in ("scalar", "list_float", "geojson", "files")],
+    # the baseline of the RequestPlan speedup
+    *[Benchmark(name=f"convert_request.{payload}.per_call", setup=convert_per_call(payload))
+      for payload in ("scalar", "list_float")],
+    Benchmark(name="walk_fields.outputs", setup=walk_outputs),
+    Benchmark(name="serialize.outputs", setup=serialize_outputs),
+    *[Benchmark(name=f"exec_func.{payload}", setup=execute(payload))
+      for payload in ("scalar", "outputs", "files")],
+    Benchmark(name="handler.args.scalar", setup=args_handler("scalar")),
+    *[Benchmark(name=f"handler.fastapi.{payload}", setup=fastapi_handler(payload))
+      for payload in ("scalar", "list_float", "files")],
+    *[Benchmark(name=f"handler.rabbitmq.{payload}", setup=rabbitmq_handler(payload))
+      for payload in ("scalar", "list_float", "files")],
+]
@@ -11,19 +11,98 @@ class SkyfiConfig(BaseSettings):
     for executing the model inference on SkyFi's infrastructure.
     """
 
+    # Pre-fork related, the handler runs in workers forked after the bootstrap
+    workers: int = 1
+    worker_restart_delay: float = 1.0
+
     # Rabbit MQ related
     is_rabbitmq_worker: bool = False
     rabbitmq_host: Optional[str] = None
     rabbitmq_exchange: Optional[str] = None
     rabbitmq_req_queue: Optional[str] = None
     rabbitmq_resp_queue: Optional[str] = None
+    # the dead-letter queue, or an exchange with the routing key, or queue, to publish to
     rabbitmq_dl_exchange: Optional[str] = None
     rabbitmq_dl_queue: Optional[str] = None
+    rabbitmq_dl_routing_key: Optional[str] = None
+    # messages are handled on rabbitmq_workers threads, off the connection I/O thread,
+    # the prefetch defaults to the number of workers
+    rabbitmq_workers: int = 1
+    rabbitmq_prefetch: Optional[int] = None
+    # messages failed with a transient error (e.g. storage) are retried with an exponential
+    # backoff through TTL retry queues; after rabbitmq_max_attempts, or right away for the
+    # model and validation errors, they go to rabbitmq_dl_exchange / rabbitmq_dl_queue
+    rabbitmq_max_attempts: int = 5
+    rabbitmq_retry_delay: float = 5.0
+    rabbitmq_retry_backoff: float = 2.0
+    rabbitmq_retry_max_delay: float = 600.0
+
+    # requests in flight per process for an async inference function, sharing the event loop.
+    # FastAPI awaits them on its event loop, not on the fastapi_executor workers
+    async_concurrency: int = 16
+
+    # Pipeline related, the download, inference and upload stages run concurrently
+    # for the RabbitMQ messages and the FastAPI jobs
+    pipeline_enabled: bool = False
+    pipeline_download_depth: int = 1
+    pipeline_inference_slots: int = 1
+    pipeline_upload_depth: int = 1
+    pipeline_max_disk_bytes: Optional[int] = None
 
     # FastAPI related
     is_fastapi_server: bool = False
     fastapi_host: Optional[str] = None
     fastapi_port: Optional[int] = None
+    # executor running the requests: thread or process
+    fastapi_executor: str = "thread"
+    fastapi_workers: int = 1
+    fastapi_queue_size: int = 16
+    fastapi_retry_after: int = 1
+    # jobs submitted to POST /jobs, finished jobs are kept for fastapi_jobs_ttl seconds
+    fastapi_jobs_max: int = 1024
+    fastapi_jobs_ttl: float = 3600.0
+
+    # Result cache related, reuses the result of a request seen before: memory, disk or storage.
+    # With the "request" scope only the redeliveries of a request_id hit the cache,
+    # with the "content" scope the identical requests of different callers do too
+    result_cache: Optional[str] = None
+    result_cache_scope: str = "request"
+    result_cache_max_entries: int = 1024
+    result_cache_dir: str = "~/.cache/skyfi_modelship/results"
+    result_cache_max_bytes: int = 1024 ** 3
+    result_cache_url: Optional[str] = None
+
+    # Inline requests, POST /inline: the file parts up to inline_spool_max_bytes are spooled
+    # to inline_spool_dir (tmpfs /dev/shm by default), the larger ones to the disk, and
+    # the output files up to inline_output_max_bytes are returned as response parts.
+    # A request larger than inline_max_request_bytes is answered 413
+    inline_spool_dir: Optional[str] = None
+    inline_max_request_bytes: int = 1024 ** 3
+    inline_spool_max_bytes: int = 32 * 1024 ** 2
+    inline_output_max_bytes: int = 32 * 1024 ** 2
+
+    # Metrics related, serves /metrics on a side port in RabbitMQ mode and in the pre-fork
+    # mode, where worker i serves its own metrics on metrics_port + i
+    metrics_host: str = "0.0.0.0"
+    metrics_port: Optional[int] = None
+
+    # Types related
+    geojson_lazy: bool = False
+
+    # Storage related
+    download_workers: int = 4
+    upload_workers: int = 4
+    input_cache_dir: Optional[str] = None
+    input_cache_max_bytes: int = 10 * 1024 ** 3
+    # persistent cache of the model artifacts, see SkyfiApp.artifact
+    artifact_cache_dir: str = "~/.cache/skyfi_modelship/artifacts"
+    download_slice_threshold: int = 256 * 1024 ** 2
+    download_slice_size: int = 64 * 1024 ** 2
+    download_slice_workers: int = 8
+    download_slice_attempts: int = 3
+    upload_chunk_threshold: int = 256 * 1024 ** 2
+    upload_chunk_size: int = 64 * 1024 ** 2
+    upload_chunk_workers: int = 8
 
     class Config:
         # Use only SKYFI_ prefixed env vars for settings
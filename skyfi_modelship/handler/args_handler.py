@@ -9,8 +9,8 @@ from simple_parsing import (
     DashVariant,
     NestedMode
 )
-from skyfi_modelship.util.execution import exec_func
-from skyfi_modelship.util.inference_request import convert_request
+from skyfi_modelship.util.execution import run_request
+from skyfi_modelship.util.metrics import track_request
 
 
 class ArgsHandler:
@@ -43,9 +43,5 @@ class ArgsHandler:
             logger.error("Error parsing arguments: {e}", e=e)
             raise e
         kwargs = args.func
-        req = convert_request(vars(kwargs), func)
-        logger.info(
-            "Calling inference function for request {request_id} => {func}({kwargs})",
-            request_id=req.request_id, func=func.__name__, kwargs=req.kwargs
-        )
-        return exec_func(func, req)
+        with track_request(func.__name__):
+            return run_request(func, vars(kwargs))
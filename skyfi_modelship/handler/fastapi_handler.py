@@ -1,44 +1,428 @@
+import asyncio
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+import multiprocessing
+import os
+import socket
+from typing import AsyncIterator, Callable, Optional
+import uuid
+
 from loguru import logger
+import orjson
 import uvicorn
 
 from starlette import status
+from starlette.background import BackgroundTask
 
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.exceptions import RequestValidationError
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
 from pydantic import ValidationError
 
 from skyfi_modelship.config import load_config
 
-from skyfi_modelship.util.inference_request import convert_request
-from skyfi_modelship.util.execution import exec_func
+from skyfi_modelship.util.aio import is_async
+from skyfi_modelship.util.batching import BatchFunction
+from skyfi_modelship.util.execution import execute_request, execute_request_async, \
+    run_request, to_jsonable
+from skyfi_modelship.util.inference_request import InferenceRequest, convert_request
+from skyfi_modelship.util.inline import InlineSpool, remove_spooled, run_inline
+from skyfi_modelship.util.jobs import Job, JobStatus, JobStore, JobStoreFull
+from skyfi_modelship.util.metrics import CONTENT_TYPE, REGISTRY, REQUESTS, \
+    start_metrics_server, track_request
+from skyfi_modelship.util.multipart import MultipartParser, Part, encode_multipart
+from skyfi_modelship.util.pipeline import create_pipeline
+from skyfi_modelship.util.result_cache import lookup_result
+from skyfi_modelship.util.streaming import DONE, OutputStream, is_streaming
+from skyfi_modelship.util.timing import timed
+
+# the bytes of an inline request body buffered before they are parsed and spooled
+INLINE_FEED_BYTES = 1024 ** 2
 
 
 class FastApiHandler:
+    """
+    Serves the inference function over HTTP.
+    The requests run on a bounded thread or process executor, off the event loop.
+    Requests beyond the executor workers wait in a bounded queue; when the queue is
+    full, the handler answers 429 with a Retry-After header.
+
+    POST /jobs validates and enqueues the request and answers 202 right away,
+    the job is polled with GET /jobs/{request_id}.
+
+    An async inference function is awaited on the server event loop instead,
+    see execute_request_async. The outputs of a generator inference function are
+    streamed as newline delimited JSON, see handle_stream.
+
+    POST /inline takes the request as multipart/form-data, with the file inputs as parts,
+    and returns the small output files as parts too, skipping the storage, see handle_inline.
+    """
+
+    def __init__(self, min_workers: int = 1, worker_index: Optional[int] = None):
+        config = load_config()
+        # set in the pre-fork mode: the workers share the socket, so each worker serves
+        # its metrics on SKYFI_METRICS_PORT + index instead of /metrics
+        self.worker_index = worker_index
+        # e.g. a batch inference function needs a batch of concurrent requests
+        workers = max(config.fastapi_workers, min_workers)
+        self.capacity = workers + config.fastapi_queue_size
+        self.retry_after = config.fastapi_retry_after
+        # requests admitted to the executor, only accessed from the event loop
+        self.pending = 0
+        self.executor = self.create_executor(config.fastapi_executor, workers)
+        self.jobs = JobStore(config.fastapi_jobs_max, config.fastapi_jobs_ttl)
+        # the jobs run on the pipeline stages if enabled, instead of the executor
+        self.pipeline = create_pipeline(config, min_workers)
+        # keeps a reference to the job completion tasks until they are done
+        self.job_tasks = set()
+
+    @staticmethod
+    def create_executor(kind: str, workers: int) -> Executor:
+        if kind == "process":
+            # forked workers inherit the bootstrapped model, metrics stay in the workers
+            executor = ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context("fork")
+            )
+            # fork all the workers now, before the server, the event loop and the handler
+            # threads start, instead of on the first request from the running server
+            for future in [executor.submit(os.getpid) for _ in range(workers)]:
+                future.result()
+            return executor
+        if kind == "thread":
+            return ThreadPoolExecutor(max_workers=workers, thread_name_prefix="skyfi-inference")
+        raise ValueError(f"Unknown executor: {kind}, expected thread or process")
+
+    def listen(self, func, sock: Optional[socket.socket] = None):
+        """ Serves func, on the socket bound by the parent in the pre-fork mode. """
 
-    def listen(self, func):
         logger.info("Starting fastapi for: {func}", func=func)
 
         config = load_config()
+        if self.worker_index is not None:
+            if config.metrics_port:
+                start_metrics_server(config.metrics_host, config.metrics_port + self.worker_index)
+            else:
+                logger.warning("Metrics not served, the pre-fork workers need SKYFI_METRICS_PORT")
 
+        fastapi = self.create_app(func)
+        if sock is None:
+            uvicorn.run(fastapi, host=config.fastapi_host, port=config.fastapi_port)
+        else:
+            uvicorn.Server(uvicorn.Config(fastapi)).run(sockets=[sock])
+
+    def create_app(self, func) -> FastAPI:
+        if isinstance(func, BatchFunction) and isinstance(self.executor, ProcessPoolExecutor):
+            # every process would batch its own requests only, one at a time
+            raise ValueError(
+                "Batch inference functions can't run on the process executor, "
+                "use SKYFI_WORKERS for multiple processes."
+            )
         fastapi = FastAPI()
         fastapi.post("/")(self.handle(func))
-        uvicorn.run(fastapi, host=config.fastapi_host, port=config.fastapi_port)
+        if self.worker_index is None:
+            # a pre-fork worker would answer with its own metrics only, see listen
+            fastapi.get("/metrics")(self.metrics)
+        fastapi.get("/health")(self.health)
+        fastapi.post("/jobs", status_code=status.HTTP_202_ACCEPTED)(self.submit_job(func))
+        fastapi.get("/jobs/{request_id}")(self.get_job)
+        if not is_streaming(func):
+            fastapi.post("/inline")(self.handle_inline(func))
+        return fastapi
+
+    async def metrics(self):
+        return PlainTextResponse(REGISTRY.render(), media_type=CONTENT_TYPE)
+
+    async def health(self):
+        return {"status": "ok", "pending": self.pending, "capacity": self.capacity}
+
+    def throttle(self, func, reason: str) -> HTTPException:
+        logger.warning("{reason}, throttling request for {func}", reason=reason, func=func.__name__)
+        return HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=f"Too many requests, {reason.lower()}",
+            headers={"Retry-After": str(self.retry_after)},
+        )
+
+    def submit(self, func, data: dict, request) -> Future:
+        """ Submits the validated request, forked workers get the raw data, see run_request. """
+
+        if self.pipeline is not None:
+            return self.pipeline.submit(func, request)
+        if is_async(func):
+            return self.submit_async(func, request)
+        if isinstance(self.executor, ProcessPoolExecutor):
+            return self.executor.submit(run_request, func, data)
+        return self.executor.submit(execute_request, func, request)
+
+    def submit_async(self, func, request) -> Future:
+        """ Runs the request of an async inference function as a task of the event loop. """
+
+        future: Future = Future()
+
+        def done(task: asyncio.Task):
+            if task.cancelled():
+                future.cancel()
+            elif task.exception() is not None:
+                future.set_exception(task.exception())
+            else:
+                future.set_result(task.result())
+
+        task = asyncio.ensure_future(execute_request_async(func, request))
+        task.add_done_callback(done)
+        return future
+
+    def submit_job(self, func):
+        async def job_handler(req: Request) -> JobStatus:
+            timings = {}
+            with timed(timings, "parse", func.__name__):
+                data = await req.json()
+            try:
+                request = convert_request(data, func, fetch_inputs=False)
+            except ValidationError as ve:
+                raise RequestValidationError(errors=ve.errors(), body=data)
+
+            if self.pending >= self.capacity:
+                REQUESTS.inc(function=func.__name__, status="throttled")
+                raise self.throttle(func, "Queue full")
+            try:
+                self.jobs.reserve(request.request_id)
+            except KeyError:
+                raise HTTPException(status_code=status.HTTP_409_CONFLICT,
+                                    detail=f"Job {request.request_id} already exists")
+            except JobStoreFull:
+                REQUESTS.inc(function=func.__name__, status="throttled")
+                raise self.throttle(func, "Job store full")
+
+            request.timings = timings | request.timings
+            job = Job(request.request_id, request.timings, self.submit(func, data, request))
+            self.jobs.add(job)
+            self.pending += 1
+            task = asyncio.ensure_future(self.complete_job(func, job))
+            self.job_tasks.add(task)
+            task.add_done_callback(self.job_tasks.discard)
+            logger.info("Submitted job {request_id} for {func}",
+                        request_id=job.request_id, func=func.__name__)
+            return job.to_status()
+        return job_handler
+
+    async def complete_job(self, func, job: Job) -> None:
+        try:
+            with track_request(func.__name__):
+                response = await asyncio.wrap_future(job.future)
+            response.timings = job.timings | response.timings
+            job.finish(response=response)
+        except asyncio.CancelledError:
+            job.finish(error="CancelledError: the request was cancelled")
+            if not job.future.cancelled():
+                # this task itself was cancelled, e.g. on shutdown
+                raise
+        except Exception as ex:
+            logger.error("Error executing job: {func}({request_id}) => {exception}",
+                         func=func.__name__, request_id=job.request_id, exception=ex)
+            job.finish(error=f"{type(ex).__name__}: {ex}")
+        finally:
+            self.pending -= 1
+
+    async def get_job(self, request_id: uuid.UUID) -> JobStatus:
+        job = self.jobs.get(request_id)
+        if job is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                                detail=f"Job {request_id} not found")
+        return job.to_status()
 
     def handle(self, func):
+        if is_streaming(func):
+            return self.handle_stream(func)
+
         async def post_handler(req: Request):
-            data = await req.json()
+            with track_request(func.__name__) as tracker:
+                if self.pending >= self.capacity:
+                    tracker.status = "throttled"
+                    raise self.throttle(func, "Queue full")
+                self.pending += 1
+                try:
+                    return await handle_request(req)
+                finally:
+                    self.pending -= 1
+
+        async def handle_request(req: Request):
+            timings = {}
+            with timed(timings, "parse", func.__name__):
+                data = await req.json()
+
+            loop = asyncio.get_running_loop()
             try:
-                r = convert_request(data, func)
+                if is_async(func):
+                    request = convert_request(data, func, fetch_inputs=False)
+                    response = await execute_request_async(func, request)
+                else:
+                    response = await loop.run_in_executor(self.executor, run_request, func, data)
             except ValidationError as ve:
                 raise RequestValidationError(errors=ve.errors(), body=data)
+            except Exception as ex:
+                logger.error("Error executing function: {func}({data}) => {exception}",
+                             func=func.__name__, data=data, exception=ex)
+                detail = f"{type(ex).__name__}: {ex}"
+                raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=detail)
 
-            logger.info("Calling inference function for request {request_id} => {func}({kwargs})",
-                        request_id=r.request_id, func=func.__name__, kwargs=r.kwargs)
+            response.timings = timings | response.timings
+            return response
+        return post_handler
+
+    def handle_stream(self, func):
+        """
+        Streams the response of a generator inference function as newline delimited JSON:
+        a {"output": ...} line per output once uploaded, then a line with the request_id,
+        output_folder and timings, or an {"error": ...} line if the request fails.
+        """
+
+        async def stream_handler(req: Request):
+            timings = {}
+            with timed(timings, "parse", func.__name__):
+                data = await req.json()
             try:
-                return exec_func(func, r)
+                request = convert_request(data, func, fetch_inputs=False)
+            except ValidationError as ve:
+                raise RequestValidationError(errors=ve.errors(), body=data)
+
+            if self.pending >= self.capacity:
+                REQUESTS.inc(function=func.__name__, status="throttled")
+                raise self.throttle(func, "Queue full")
+            self.pending += 1
+            released = False
+
+            def release():
+                nonlocal released
+                if not released:
+                    released = True
+                    self.pending -= 1
+
+            async def release_slot():
+                release()
+
+            request.timings = timings | request.timings
+            # the slot is released once the stream ends, or by the background task
+            # if the body was never iterated, e.g. the client went away before the first line
+            return StreamingResponse(
+                self.stream_lines(func, request, release), media_type="application/x-ndjson",
+                background=BackgroundTask(release_slot),
+            )
+        return stream_handler
+
+    async def stream_lines(
+        self, func, request: InferenceRequest, release: Callable[[], None]
+    ) -> AsyncIterator[bytes]:
+        stream = None
+        try:
+            with track_request(func.__name__) as tracker:
+                try:
+                    response = await asyncio.to_thread(lookup_result, func, request)
+                    if response is not None:
+                        for output in response.response:
+                            yield orjson.dumps({"output": to_jsonable(output)}) + b"\n"
+                    else:
+                        stream = OutputStream(func, request, download=True)
+                        outputs = []
+                        while True:
+                            output = await asyncio.to_thread(stream.next_output)
+                            if output is DONE:
+                                break
+                            outputs.append(output)
+                            yield orjson.dumps({"output": to_jsonable(output)}) + b"\n"
+                        response = await asyncio.to_thread(stream.response, outputs)
+                except Exception as ex:
+                    logger.error("Error streaming function: {func}({request_id}) => {exception}",
+                                 func=func.__name__, request_id=request.request_id, exception=ex)
+                    tracker.status = "error"
+                    yield orjson.dumps({"error": f"{type(ex).__name__}: {ex}"}) + b"\n"
+                    return
+                yield orjson.dumps(to_jsonable({
+                    "request_id": response.request_id,
+                    "output_folder": response.output_folder,
+                    "timings": response.timings,
+                })) + b"\n"
+        finally:
+            # e.g. the client went away mid-stream: stops the model and cleans up
+            if stream is not None:
+                stream.close()
+            release()
+
+    def handle_inline(self, func):
+        """
+        Handles a multipart/form-data request: a "request" part with the JSON request and
+        a part per input file, named after its parameter, see InlineSpool.
+        Answers multipart/mixed: a "response" part with the JSON response then, without
+        an output_folder, a part per output file, see inline_outputs.
+        """
+
+        async def inline_handler(req: Request):
+            with track_request(func.__name__) as tracker:
+                if self.pending >= self.capacity:
+                    tracker.status = "throttled"
+                    raise self.throttle(func, "Queue full")
+                self.pending += 1
+                spool_id = uuid.uuid4()
+                try:
+                    timings = {}
+                    with timed(timings, "parse", func.__name__):
+                        data = await self.spool_inline(func, req, spool_id)
+                    return await handle_inline_request(data, timings)
+                finally:
+                    self.pending -= 1
+                    await asyncio.to_thread(remove_spooled, spool_id)
+
+        async def handle_inline_request(data: dict, timings):
+            loop = asyncio.get_running_loop()
+            try:
+                response, output_parts = await loop.run_in_executor(
+                    self.executor, run_inline, func, data
+                )
+            except ValidationError as ve:
+                raise RequestValidationError(errors=ve.errors(), body=data)
             except Exception as ex:
-                logger.error("Error executing function: {func}({kwargs}) => {exception}",
-                             func=func.__name__, kwargs=r.kwargs, exception=ex)
+                logger.error("Error executing function: {func}({data}) => {exception}",
+                             func=func.__name__, data=data, exception=ex)
                 detail = f"{type(ex).__name__}: {ex}"
                 raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=detail)
-        return post_handler
+
+            response.timings = timings | response.timings
+            content, media_type = encode_multipart([Part(
+                name="response", data=orjson.dumps(to_jsonable(response)),
+                content_type="application/json",
+            )] + output_parts)
+            return Response(content=content, media_type=media_type)
+        return inline_handler
+
+    async def spool_inline(self, func, req: Request, spool_id: uuid.UUID) -> dict:
+        """
+        Parses the multipart body as it is received, the parts are spooled to files
+        by InlineSpool. Returns the request data with the file parts set.
+        Answers 413 once the body is larger than inline_max_request_bytes.
+        """
+
+        max_bytes = load_config().inline_max_request_bytes
+        too_large = HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                                  detail=f"Inline request larger than {max_bytes} bytes")
+        spool = InlineSpool(func, spool_id)
+        try:
+            if int(req.headers.get("content-length") or 0) > max_bytes:
+                raise too_large
+            parser = MultipartParser(req.headers.get("content-type", ""), spool.open_part)
+            size = fed = 0
+            # the chunks are written off the event loop, a few of them at a time
+            chunks = []
+            async for chunk in req.stream():
+                size += len(chunk)
+                if size > max_bytes:
+                    raise too_large
+                chunks.append(chunk)
+                if size - fed >= INLINE_FEED_BYTES:
+                    await asyncio.to_thread(parser.feed, b"".join(chunks))
+                    chunks, fed = [], size
+            await asyncio.to_thread(parser.feed, b"".join(chunks))
+            parser.close()
+            return await asyncio.to_thread(spool.request_data)
+        except ValueError as ex:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                detail=f"Invalid inline request: {ex}")
+        finally:
+            spool.close()
@@ -1,35 +1,225 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+import copy
+import threading
+from typing import Callable, Optional, Set, Tuple
+
 from loguru import logger
 import orjson
 import pika
 from pika.channel import Channel
 from pika.spec import Basic
 
-from fastapi.encoders import jsonable_encoder
+from skyfi_modelship.config import SkyfiConfig, load_config
+from skyfi_modelship.util.inference_request import convert_request, download_inputs
+from skyfi_modelship.util.execution import exec_func, to_jsonable
+from skyfi_modelship.util.metrics import start_metrics_server, track_request
+from skyfi_modelship.util.pipeline import create_pipeline
+from skyfi_modelship.util.result_cache import lookup_result
+from skyfi_modelship.util.retry import ATTEMPTS_HEADER, ERROR_HEADER, is_transient, \
+    retry_delay, retry_queue
+from skyfi_modelship.util.timing import timed
+
+
+def with_headers(properties: pika.BasicProperties, headers: dict) -> pika.BasicProperties:
+    """ Returns a copy of the message properties with the given headers. """
+
+    result = copy.copy(properties)
+    result.headers = headers
+    return result
+
+
+def dead_letter_target(config: SkyfiConfig) -> Optional[Tuple[str, str]]:
+    """
+    Returns the exchange and routing key of the dead-lettered messages, None without
+    a dead-letter queue: rabbitmq_dl_queue on the default exchange, or rabbitmq_dl_exchange
+    with rabbitmq_dl_routing_key, or rabbitmq_dl_queue. Raises ValueError for an exchange
+    without either, rather than routing them like the requests.
+    """
+
+    if config.rabbitmq_dl_exchange is None:
+        if config.rabbitmq_dl_queue is None:
+            return None
+        return "", config.rabbitmq_dl_queue
+    routing_key = config.rabbitmq_dl_routing_key or config.rabbitmq_dl_queue
+    if routing_key is None:
+        raise ValueError("SKYFI_RABBITMQ_DL_EXCHANGE needs SKYFI_RABBITMQ_DL_ROUTING_KEY "
+                         "or SKYFI_RABBITMQ_DL_QUEUE")
+    return config.rabbitmq_dl_exchange, routing_key
+
+
+class ThreadsafeChannel:
+    """
+    Channel used by the worker threads.
+    pika connections are not thread safe, so the calls are scheduled on the connection
+    I/O thread with add_callback_threadsafe. The worker waits for the call to run
+    and gets its result or exception, as if it called the channel directly.
+    """
+
+    def __init__(self, channel: Channel):
+        self.channel = channel
+        self._pending: Set[Future] = set()
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def _call(self, method: Callable, **kwargs):
+        future = Future()
+
+        def run():
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(method(**kwargs))
+                except Exception as ex:
+                    future.set_exception(ex)
+
+        with self._lock:
+            if self._closed:
+                raise ConnectionError("Channel closed")
+            self._pending.add(future)
+        try:
+            self.channel.connection.add_callback_threadsafe(run)
+            return future.result()
+        finally:
+            with self._lock:
+                self._pending.discard(future)
+
+    def basic_publish(self, **kwargs):
+        return self._call(self.channel.basic_publish, **kwargs)
 
-from skyfi_modelship.config import load_config
-from skyfi_modelship.util.inference_request import convert_request
-from skyfi_modelship.util.execution import exec_func
+    def basic_ack(self, **kwargs):
+        return self._call(self.channel.basic_ack, **kwargs)
+
+    def basic_reject(self, **kwargs):
+        return self._call(self.channel.basic_reject, **kwargs)
+
+    def close(self) -> None:
+        """ Fails the pending calls, the I/O thread won't run them anymore. """
+
+        with self._lock:
+            self._closed = True
+            for future in self._pending:
+                if future.cancel():
+                    continue
+                if not future.done():
+                    future.set_exception(ConnectionError("Channel closed"))
 
 
 class RabbitMQHandler:
+    """
+    Consumes the requests of the SKYFI_RABBITMQ_REQ_QUEUE and publishes the responses.
+    The messages are handled on SKYFI_RABBITMQ_WORKERS threads, so long inferences
+    don't block the connection heartbeats. Up to SKYFI_RABBITMQ_PREFETCH messages
+    are delivered ahead.
+
+    With SKYFI_PIPELINE_ENABLED the workers feed a Pipeline, so the inputs of the
+    next messages download and the outputs of the previous ones upload during the
+    inference.
+    """
+
+    def __init__(
+        self,
+        min_workers: int = 1,
+        worker_index: int = 0,
+        connection_factory: Optional[Callable[[], pika.BlockingConnection]] = None,
+    ):
+        # e.g. a batch inference function needs a batch of concurrent messages
+        self.min_workers = min_workers
+        # in the pre-fork mode, each worker serves its metrics on SKYFI_METRICS_PORT + index
+        self.worker_index = worker_index
+        # e.g. the LocalBroker of the load tests, connects to SKYFI_RABBITMQ_HOST by default
+        self.connection_factory = connection_factory or self.connect
+        self.pipeline = create_pipeline(load_config(), min_workers)
 
     def listen(self, func):
         config = load_config()
+        # fails right away on a dead-letter exchange without a routing key
+        dead_letter_target(config)
+        if config.metrics_port:
+            start_metrics_server(config.metrics_host, config.metrics_port + self.worker_index)
 
-        connection = pika.BlockingConnection(
-            pika.URLParameters(config.rabbitmq_host)
-        )
+        connection = self.connection_factory()
         channel = connection.channel()
 
-        channel.basic_qos(prefetch_count=1)  # process 1 message at a time
+        workers = max(config.rabbitmq_workers, self.min_workers)
+        if self.pipeline is not None:
+            # enough workers to keep all the pipeline stages busy
+            workers = max(workers, self.pipeline.capacity)
+        channel.basic_qos(prefetch_count=config.rabbitmq_prefetch or workers)
+        self.declare_retry_queues(channel)
+        executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="skyfi-consumer")
+        threadsafe_channel = ThreadsafeChannel(channel)
         channel.basic_consume(
-            queue=config.rabbitmq_req_queue, on_message_callback=self.handle(func)
+            queue=config.rabbitmq_req_queue,
+            on_message_callback=self.dispatch(func, executor, threadsafe_channel),
         )
-        logger.info("Waiting for messages...")
-        channel.start_consuming()
-        logger.info("Closing listener...")
+        logger.info("Waiting for messages with {workers} workers...", workers=workers)
+        try:
+            channel.start_consuming()
+        finally:
+            logger.info("Closing listener...")
+            # the unacked messages in flight are redelivered by the broker
+            threadsafe_channel.close()
+            executor.shutdown(wait=True, cancel_futures=True)
+            if self.pipeline is not None:
+                self.pipeline.shutdown()
         connection.close()
 
+    @staticmethod
+    def declare_retry_queues(channel: Channel) -> None:
+        """
+        Declares the TTL queues of the retried messages, one per backoff delay.
+        An expired message is dead-lettered back to the request queue.
+        """
+
+        config = load_config()
+        for attempt in range(1, config.rabbitmq_max_attempts):
+            channel.queue_declare(
+                queue=retry_queue(config, attempt),
+                durable=True,
+                arguments={
+                    "x-message-ttl": int(retry_delay(config, attempt) * 1000),
+                    "x-dead-letter-exchange": "",
+                    "x-dead-letter-routing-key": config.rabbitmq_req_queue,
+                },
+            )
+
+    @staticmethod
+    def connect() -> pika.BlockingConnection:
+        return pika.BlockingConnection(pika.URLParameters(load_config().rabbitmq_host))
+
+    def dispatch(self, func, executor: ThreadPoolExecutor, threadsafe_channel: ThreadsafeChannel):
+        """ Returns the consumer callback, handing the messages over to the executor. """
+
+        message_handler = self.handle(func)
+
+        def handle_or_reject(
+            method: Basic.Deliver, properties: pika.BasicProperties, payload: bytes
+        ):
+            try:
+                message_handler(threadsafe_channel, method, properties, payload)
+            except Exception as ex:
+                # the handler failed before it could ack or reject the message, e.g. its
+                # dead-lettering failed: frees the prefetch slot, requeued once.
+                # On the worker, the I/O thread can't wait for its own callbacks
+                logger.error("Error handling message {delivery_tag}: {ex}",
+                             delivery_tag=method.delivery_tag, ex=ex)
+                try:
+                    threadsafe_channel.basic_reject(
+                        delivery_tag=method.delivery_tag, requeue=not method.redelivered
+                    )
+                except Exception as reject_ex:
+                    logger.error("Error rejecting message {delivery_tag}: {ex}",
+                                 delivery_tag=method.delivery_tag, ex=reject_ex)
+
+        def on_message(
+            ch: Channel,
+            method: Basic.Deliver,
+            properties: pika.BasicProperties,
+            payload: bytes,
+        ):
+            executor.submit(handle_or_reject, method, properties, payload)
+
+        return on_message
+
     def handle(self, func):
         def message_handler(
             ch: Channel,
@@ -37,28 +227,49 @@ class RabbitMQHandler:
             properties: pika.BasicProperties,
             payload: bytes,
         ):
+            with track_request(func.__name__) as tracker:
+                tracker.status = handle_message(ch, method, properties, payload)
+
+        def handle_message(
+            ch: Channel,
+            method: Basic.Deliver,
+            properties: pika.BasicProperties,
+            payload: bytes,
+        ) -> str:
             logger.info(
                 "Got RabbitMQ message ({properties}): {payload}",
                 properties=properties,
                 payload=payload,
             )
-            data = orjson.loads(payload)
-
+            timings = {}
             try:
-                r = convert_request(data, func)
+                # a malformed message fails like an invalid request, it would fail again
+                with timed(timings, "parse", func.__name__):
+                    data = orjson.loads(payload)
+                r = convert_request(data, func, fetch_inputs=False)
+                response = None
+                if self.pipeline is None:
+                    # e.g. a redelivery of a handled message, see lookup_result
+                    response = lookup_result(func, r)
+                    if response is None:
+                        download_inputs(r, func)
             except Exception as ex:
-                logger.error("Rejecting request {data}: {exc_info}", data=data, exc_info=ex)
-                ch.basic_reject(delivery_tag=method.delivery_tag, requeue=False)
-                return
+                logger.error("Request {payload} failed: {exc_info}", payload=payload, exc_info=ex)
+                return self.fail(ch, method, properties, payload, ex)
 
             try:
-                logger.info(
-                    "Calling inference function for request {request_id} => {func}({kwargs})",
-                    request_id=r.request_id,
-                    func=func.__name__,
-                    kwargs=r.kwargs,
-                )
-                response = exec_func(func, r)
+                if response is None:
+                    logger.info(
+                        "Calling inference function for request {request_id} => {func}({kwargs})",
+                        request_id=r.request_id,
+                        func=func.__name__,
+                        kwargs=r.kwargs,
+                    )
+                    if self.pipeline is None:
+                        response = exec_func(func, r)
+                    else:
+                        response = self.pipeline.submit(func, r).result()
+                response.timings = timings | response.timings
                 config = load_config()
                 logger.info(
                     "Publishing {response} to {exchange}/{queue}",
@@ -66,29 +277,79 @@ class RabbitMQHandler:
                     exchange=config.rabbitmq_exchange,
                     queue=config.rabbitmq_resp_queue,
                 )
-                ch.basic_publish(
-                    exchange=config.rabbitmq_exchange,
-                    routing_key=config.rabbitmq_resp_queue,
-                    properties=pika.BasicProperties(
-                        correlation_id=properties.correlation_id,
-                        content_type="application/json",
-                    ),
-                    body=orjson.dumps(jsonable_encoder(response)),
-                )
+                with timed({}, "publish", func.__name__):
+                    ch.basic_publish(
+                        exchange=config.rabbitmq_exchange,
+                        routing_key=config.rabbitmq_resp_queue,
+                        properties=pika.BasicProperties(
+                            correlation_id=properties.correlation_id,
+                            content_type="application/json",
+                        ),
+                        body=orjson.dumps(to_jsonable(response)),
+                    )
                 logger.info(
                     "Acking request {request_id}: {delivery_tag}",
                     request_id=r.request_id,
                     delivery_tag=method.delivery_tag,
                 )
                 ch.basic_ack(delivery_tag=method.delivery_tag)
+                return "success"
             except Exception as ex:
                 logger.warning(
-                    "Requeing request {request_id}, {delivery_tag}: {ex}",
+                    "Request {request_id}, {delivery_tag} failed: {ex}",
                     request_id=r.request_id,
                     delivery_tag=method.delivery_tag,
                     ex=ex,
                     exc_info=ex
                 )
-                ch.basic_reject(delivery_tag=method.delivery_tag, requeue=True)
+                return self.fail(ch, method, properties, payload, ex)
 
         return message_handler
+
+    def fail(
+        self,
+        ch: Channel,
+        method: Basic.Deliver,
+        properties: pika.BasicProperties,
+        payload: bytes,
+        ex: Exception,
+    ) -> str:
+        """
+        Retries a message failed with a transient error after a backoff, through the TTL
+        retry queues, until rabbitmq_max_attempts. Then, or right away for the other errors,
+        the message goes to the dead-letter queue, or is rejected if there is none.
+        """
+
+        config = load_config()
+        headers = dict(properties.headers or {})
+        attempt = int(headers.get(ATTEMPTS_HEADER, 0)) + 1
+        headers[ATTEMPTS_HEADER] = attempt
+
+        if is_transient(ex) and attempt < config.rabbitmq_max_attempts:
+            queue = retry_queue(config, attempt)
+            logger.info("Retrying message {delivery_tag} through {queue}, attempt {attempt}",
+                        delivery_tag=method.delivery_tag, queue=queue, attempt=attempt)
+            ch.basic_publish(exchange="", routing_key=queue, body=payload,
+                             properties=with_headers(properties, headers))
+            ch.basic_ack(delivery_tag=method.delivery_tag)
+            return "retried"
+
+        dead_letter = dead_letter_target(config)
+        if dead_letter is None:
+            logger.error("Rejecting message {delivery_tag} after {attempt} attempts",
+                         delivery_tag=method.delivery_tag, attempt=attempt)
+            ch.basic_reject(delivery_tag=method.delivery_tag, requeue=False)
+            return "rejected"
+
+        headers[ERROR_HEADER] = f"{type(ex).__name__}: {ex}"[:1024]
+        logger.error("Dead-lettering message {delivery_tag} after {attempt} attempts",
+                     delivery_tag=method.delivery_tag, attempt=attempt)
+        exchange, routing_key = dead_letter
+        ch.basic_publish(
+            exchange=exchange,
+            routing_key=routing_key,
+            body=payload,
+            properties=with_headers(properties, headers),
+        )
+        ch.basic_ack(delivery_tag=method.delivery_tag)
+        return "dead_lettered"
@@ -0,0 +1,23 @@
+"""
+Load generator replaying JSONL request payloads against a FastAPI endpoint, a RabbitMQ
+request queue, or a model running on an in-process broker stand-in.
+
+    python -m skyfi_modelship.loadtest requests.jsonl --target fastapi --mode open --rate 20 \
+        --duration 60
+    python -m skyfi_modelship.loadtest requests.jsonl --target local --app main.py \
+        --concurrency 4 --requests 1000
+"""
+from .broker import LocalBroker
+from .clients import HttpClient, LoadClient, LocalBrokerClient, RabbitMQClient
+from .driver import LoadReport, run_closed_loop, run_open_loop
+
+__all__ = [
+    "LocalBroker",
+    "HttpClient",
+    "LoadClient",
+    "LocalBrokerClient",
+    "RabbitMQClient",
+    "LoadReport",
+    "run_closed_loop",
+    "run_open_loop",
+]
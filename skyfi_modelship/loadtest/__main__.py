@@ -0,0 +1,165 @@
+import argparse
+from contextlib import contextmanager, nullcontext
+import importlib
+import json
+import os
+import runpy
+import sys
+import threading
+from typing import Iterator, List, Optional
+from unittest.mock import patch
+
+from loguru import logger
+from pydantic import RootModel
+
+from skyfi_modelship.config import load_config
+from skyfi_modelship.skyfi_app import SkyfiApp
+
+from .broker import LocalBroker
+from .clients import HttpClient, LoadClient, LocalBrokerClient, RabbitMQClient
+from .driver import LoadReport, run_closed_loop, run_open_loop
+
+
+def load_payloads(path: str) -> List[dict]:
+    with open(path) as f:
+        payloads = [json.loads(line) for line in f if line.strip()]
+    if not payloads:
+        raise ValueError(f"No request payloads in {path}")
+    return payloads
+
+
+def load_app(target: str) -> SkyfiApp:
+    """ Imports the module or runs the script of the model, capturing its app.start(). """
+
+    apps = []
+    with patch.object(SkyfiApp, "start", lambda app, *args, **kwargs: apps.append(app)):
+        if target.endswith(".py"):
+            runpy.run_path(target, run_name="__main__")
+        else:
+            importlib.import_module(target)
+    if not apps:
+        raise ValueError(f"{target} doesn't start a SkyfiApp")
+    return apps[0]
+
+
+def start_local_model(target: str, broker: LocalBroker) -> None:
+    """ Runs the model of target with the RabbitMQHandler on the LocalBroker. """
+
+    from skyfi_modelship.handler.rabbitmq_handler import RabbitMQHandler
+    from skyfi_modelship.util.batching import min_concurrency
+
+    app = load_app(target)
+    if app.bootstrap_func:
+        app.bootstrap_func()
+    handler = RabbitMQHandler(
+        min_workers=min_concurrency(app.inference_func), connection_factory=broker.connect
+    )
+    threading.Thread(
+        target=handler.listen, args=(app.inference_func,), name="skyfi-loadtest-model",
+        daemon=True,
+    ).start()
+
+
+@contextmanager
+def local_queues() -> Iterator[None]:
+    """
+    The local broker needs no setup, defaults to queues of its own.
+    The environment and the config are restored on exit.
+    """
+
+    defaults = {
+        "SKYFI_RABBITMQ_REQ_QUEUE": "skyfi-loadtest-requests",
+        "SKYFI_RABBITMQ_RESP_QUEUE": "skyfi-loadtest-responses",
+    }
+    previous = {name: os.environ.get(name) for name in defaults}
+    for name, value in defaults.items():
+        os.environ.setdefault(name, value)
+    load_config.cache_clear()
+    try:
+        yield
+    finally:
+        for name, value in previous.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+        load_config.cache_clear()
+
+
+def run_load(args: argparse.Namespace) -> LoadReport:
+    """ Sends the payloads to the target of the arguments, returns the report. """
+
+    config = load_config()
+    payloads = load_payloads(args.payloads)
+    broker = None
+    client: LoadClient
+    if args.target == "fastapi":
+        client = HttpClient(args.url)
+    elif args.target == "rabbitmq":
+        client = RabbitMQClient(
+            config.rabbitmq_host, config.rabbitmq_req_queue, config.rabbitmq_resp_queue
+        )
+    else:
+        broker = LocalBroker()
+        start_local_model(args.app, broker)
+        client = LocalBrokerClient(broker, config.rabbitmq_req_queue, config.rabbitmq_resp_queue)
+
+    try:
+        if args.mode == "open":
+            return run_open_loop(
+                client, payloads, args.rate, args.requests, args.duration, args.timeout
+            )
+        return run_closed_loop(
+            client, payloads, args.concurrency, args.requests, args.duration, args.timeout
+        )
+    finally:
+        client.close()
+        if broker is not None:
+            broker.close()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m skyfi_modelship.loadtest",
+        description="Replays request payloads against a SkyFi ModelShip deployment",
+    )
+    parser.add_argument("payloads", help="JSONL file of request payloads")
+    parser.add_argument("--target", choices=["fastapi", "rabbitmq", "local"], default="fastapi")
+    parser.add_argument("--url", default="http://localhost:8000/", help="FastAPI endpoint")
+    parser.add_argument("--app", help="local target: the model module or script")
+    parser.add_argument("--mode", choices=["open", "closed"], default="closed")
+    parser.add_argument("--rate", type=float, default=10.0,
+                        help="open loop: requests per second")
+    parser.add_argument("--concurrency", type=int, default=1,
+                        help="closed loop: concurrent requests")
+    parser.add_argument("--requests", type=int, help="number of requests to send")
+    parser.add_argument("--duration", type=float, help="seconds to send requests")
+    parser.add_argument("--timeout", type=float, default=60.0, help="request timeout")
+    parser.add_argument("--output", help="write the report as JSON to this file")
+    parser.add_argument("--log-level", default="WARNING", help="log level of a local model")
+    args = parser.parse_args(argv)
+    if args.requests is None and args.duration is None:
+        parser.error("--requests or --duration is required")
+    if args.target == "local" and not args.app:
+        parser.error("--app is required with the local target")
+
+    logger.remove()
+    logger.add(sys.stderr, level=args.log_level)
+
+    with local_queues() if args.target == "local" else nullcontext():
+        config = load_config()
+        if args.target != "fastapi" and config.rabbitmq_req_queue == config.rabbitmq_resp_queue:
+            parser.error("SKYFI_RABBITMQ_REQ_QUEUE and SKYFI_RABBITMQ_RESP_QUEUE must differ")
+        report = run_load(args)
+
+    result = RootModel[LoadReport](report).model_dump()
+    for key, value in result.items():
+        print(f"{key:<16} {value:.3f}" if isinstance(value, float) else f"{key:<16} {value}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
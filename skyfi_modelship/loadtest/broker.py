@@ -0,0 +1,169 @@
+from collections import deque
+import itertools
+import queue
+import threading
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+import pika
+from pika.spec import Basic
+
+
+class LocalBroker:
+    """
+    In-process stand-in for a RabbitMQ broker, for offline load tests.
+    Implements the part of the pika BlockingConnection API used by the RabbitMQHandler:
+    the messages are routed to the queue named by the routing key, the exchanges are
+    ignored, and rejected messages are requeued at the front of their queue.
+    The messages of a queue declared with x-message-ttl are dead-lettered to its
+    x-dead-letter-routing-key once expired, like the retry queues.
+    """
+
+    def __init__(self):
+        self.queues: Dict[Optional[str], Deque[Tuple[bytes, pika.BasicProperties]]] = {}
+        self.ttl_queues: Dict[Optional[str], Tuple[float, Optional[str]]] = {}
+        self.connections: List[LocalConnection] = []
+        self.cond = threading.Condition()
+
+    def connect(self) -> "LocalConnection":
+        connection = LocalConnection(self)
+        self.connections.append(connection)
+        return connection
+
+    def close(self) -> None:
+        """ Closes the connections, their consumers stop. """
+
+        for connection in self.connections:
+            connection.close()
+
+    def declare(self, queue_name: Optional[str], arguments: Optional[dict] = None) -> None:
+        arguments = arguments or {}
+        if "x-message-ttl" in arguments:
+            self.ttl_queues[queue_name] = (
+                arguments["x-message-ttl"] / 1000, arguments.get("x-dead-letter-routing-key")
+            )
+
+    def publish(self, routing_key: Optional[str], body: bytes,
+                properties: Optional[pika.BasicProperties] = None, front: bool = False) -> None:
+        if routing_key in self.ttl_queues:
+            ttl, dead_letter_key = self.ttl_queues[routing_key]
+            timer = threading.Timer(ttl, self.publish, args=(dead_letter_key, body, properties))
+            timer.daemon = True
+            timer.start()
+            return
+        with self.cond:
+            messages = self.queues.setdefault(routing_key, deque())
+            message = (body, properties or pika.BasicProperties())
+            if front:
+                messages.appendleft(message)
+            else:
+                messages.append(message)
+            self.cond.notify_all()
+
+    def get(self, queue_name: Optional[str], timeout: Optional[float] = None) \
+            -> Tuple[bytes, pika.BasicProperties]:
+        """ Pops the next message of the queue, raises queue.Empty after timeout seconds. """
+
+        with self.cond:
+            if not self.cond.wait_for(lambda: self.queues.get(queue_name), timeout):
+                raise queue.Empty()
+            return self.queues[queue_name].popleft()
+
+
+class LocalConnection:
+    def __init__(self, broker: LocalBroker):
+        self.broker = broker
+        self.callbacks: Deque[Callable[[], None]] = deque()
+        self.is_open = True
+        self._channel: Optional[LocalChannel] = None
+
+    def channel(self) -> "LocalChannel":
+        self._channel = LocalChannel(self)
+        return self._channel
+
+    def add_callback_threadsafe(self, callback: Callable[[], None]) -> None:
+        with self.broker.cond:
+            if not self.is_open:
+                raise ConnectionError("Connection closed")
+            self.callbacks.append(callback)
+            self.broker.cond.notify_all()
+
+    def close(self) -> None:
+        with self.broker.cond:
+            self.is_open = False
+            self.broker.cond.notify_all()
+
+
+class LocalChannel:
+    """ Channel of a LocalConnection, start_consuming runs the callbacks like the pika I/O loop. """
+
+    def __init__(self, connection: LocalConnection):
+        self.connection = connection
+        self.broker = connection.broker
+        self.prefetch_count = 0
+        self.consumers: Dict[Optional[str], Callable] = {}
+        self.unacked: Dict[int, Tuple[Optional[str], bytes, pika.BasicProperties]] = {}
+        self.consuming = False
+        self._tags = itertools.count(1)
+
+    def basic_qos(self, prefetch_count: int = 0) -> None:
+        self.prefetch_count = prefetch_count
+
+    def queue_declare(self, queue: Optional[str], durable: bool = False,
+                      arguments: Optional[dict] = None) -> None:
+        self.broker.declare(queue, arguments)
+
+    def basic_consume(self, queue: Optional[str], on_message_callback: Callable) -> None:
+        self.consumers[queue] = on_message_callback
+
+    def basic_publish(self, exchange: Optional[str], routing_key: Optional[str], body: bytes,
+                      properties: Optional[pika.BasicProperties] = None) -> None:
+        self.broker.publish(routing_key, body, properties)
+
+    def basic_ack(self, delivery_tag: int) -> None:
+        with self.broker.cond:
+            self.unacked.pop(delivery_tag)
+            self.broker.cond.notify_all()
+
+    def basic_reject(self, delivery_tag: int, requeue: bool = True) -> None:
+        with self.broker.cond:
+            queue_name, body, properties = self.unacked.pop(delivery_tag)
+            self.broker.cond.notify_all()
+        if requeue:
+            self.broker.publish(queue_name, body, properties, front=True)
+
+    def stop_consuming(self) -> None:
+        with self.broker.cond:
+            self.consuming = False
+            self.broker.cond.notify_all()
+
+    def _next_event(self):
+        """ Returns the next threadsafe callback or delivery, None once stopped. """
+
+        def ready():
+            if not self.consuming or not self.connection.is_open or self.connection.callbacks:
+                return True
+            if self.prefetch_count and len(self.unacked) >= self.prefetch_count:
+                return False
+            return any(self.broker.queues.get(name) for name in self.consumers)
+
+        with self.broker.cond:
+            self.broker.cond.wait_for(ready)
+            if self.connection.callbacks:
+                return self.connection.callbacks.popleft()
+            if not self.consuming or not self.connection.is_open:
+                return None
+            for name, callback in self.consumers.items():
+                if self.broker.queues.get(name):
+                    body, properties = self.broker.queues[name].popleft()
+                    tag = next(self._tags)
+                    self.unacked[tag] = (name, body, properties)
+                    method = Basic.Deliver(delivery_tag=tag, routing_key=name)
+                    return lambda: callback(self, method, properties, body)
+
+    def start_consuming(self) -> None:
+        self.consuming = True
+        while True:
+            event = self._next_event()
+            if event is None:
+                return
+            event()
@@ -0,0 +1,148 @@
+from concurrent.futures import Future
+import queue
+import threading
+from typing import Dict, Optional
+import urllib.error
+import urllib.request
+
+import orjson
+import pika
+
+from .broker import LocalBroker
+
+
+class LoadClient:
+    """ Sends a request payload to the model and waits for its response. """
+
+    def call(self, payload: dict, timeout: float) -> None:
+        """ Sends the payload, raises if the request fails or times out. """
+
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class HttpClient(LoadClient):
+    """ Posts the payloads to a FastAPI endpoint. """
+
+    def __init__(self, url: str):
+        self.url = url
+
+    def call(self, payload: dict, timeout: float) -> None:
+        request = urllib.request.Request(
+            self.url, data=orjson.dumps(payload), method="POST",
+            headers={"Content-Type": "application/json"},
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                response.read()
+        except urllib.error.HTTPError as ex:
+            raise RuntimeError(f"HTTP {ex.code}") from ex
+
+
+class QueueClient(LoadClient):
+    """
+    Publishes the payloads to the request queue and matches the responses of the
+    response queue by correlation_id, the request_id of the payload.
+    """
+
+    def __init__(self):
+        self.pending: Dict[str, Future] = {}
+        self.lock = threading.Lock()
+        self.closed = threading.Event()
+
+    def publish(self, body: bytes, properties: pika.BasicProperties) -> None:
+        raise NotImplementedError
+
+    def on_response(self, properties: pika.BasicProperties, body: bytes) -> None:
+        with self.lock:
+            future = self.pending.pop(properties.correlation_id, None)
+        if future is not None:
+            future.set_result(body)
+
+    def call(self, payload: dict, timeout: float) -> None:
+        correlation_id = str(payload["request_id"])
+        future = Future()
+        with self.lock:
+            self.pending[correlation_id] = future
+        try:
+            self.publish(orjson.dumps(payload), pika.BasicProperties(
+                correlation_id=correlation_id, content_type="application/json",
+            ))
+            future.result(timeout=timeout)
+        finally:
+            with self.lock:
+                self.pending.pop(correlation_id, None)
+
+
+class RabbitMQClient(QueueClient):
+    """ QueueClient of a RabbitMQ broker, the responses are consumed on a separate connection. """
+
+    def __init__(self, host: str, req_queue: str, resp_queue: str, exchange: str = ""):
+        super().__init__()
+        self.host = host
+        self.req_queue = req_queue
+        self.exchange = exchange
+        self.connection = pika.BlockingConnection(pika.URLParameters(host))
+        self.channel = self.connection.channel()
+        self.publish_lock = threading.Lock()
+        self.consumer = threading.Thread(
+            target=self.consume, args=(resp_queue,), name="skyfi-loadtest-responses", daemon=True
+        )
+        self.consumer.start()
+
+    def publish(self, body: bytes, properties: pika.BasicProperties) -> None:
+        # pika connections are not thread safe
+        with self.publish_lock:
+            self.channel.basic_publish(
+                exchange=self.exchange, routing_key=self.req_queue, body=body,
+                properties=properties,
+            )
+            self.connection.process_data_events(time_limit=0)
+
+    def consume(self, resp_queue: str) -> None:
+        connection = pika.BlockingConnection(pika.URLParameters(self.host))
+        channel = connection.channel()
+        channel.basic_consume(
+            queue=resp_queue, auto_ack=True,
+            on_message_callback=lambda ch, method, properties, body:
+                self.on_response(properties, body),
+        )
+        while not self.closed.is_set():
+            connection.process_data_events(time_limit=0.1)
+        connection.close()
+
+    def close(self) -> None:
+        self.closed.set()
+        self.consumer.join()
+        with self.publish_lock:
+            self.connection.close()
+
+
+class LocalBrokerClient(QueueClient):
+    """ QueueClient of a LocalBroker. """
+
+    def __init__(self, broker: LocalBroker, req_queue: Optional[str], resp_queue: Optional[str]):
+        super().__init__()
+        self.broker = broker
+        self.req_queue = req_queue
+        self.consumer = threading.Thread(
+            target=self.consume, args=(resp_queue,), name="skyfi-loadtest-responses", daemon=True
+        )
+        self.consumer.start()
+
+    def publish(self, body: bytes, properties: pika.BasicProperties) -> None:
+        self.broker.publish(self.req_queue, body, properties)
+
+    def consume(self, resp_queue: Optional[str]) -> None:
+        while not self.closed.is_set():
+            try:
+                body, properties = self.broker.get(resp_queue, timeout=0.1)
+            except queue.Empty:
+                continue
+            self.on_response(properties, body)
+
+    def close(self) -> None:
+        self.closed.set()
+        self.consumer.join()
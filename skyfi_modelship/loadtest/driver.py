@@ -0,0 +1,153 @@
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import itertools
+import threading
+import time
+from typing import Dict, Iterator, List, Optional
+import uuid
+
+from pydantic.dataclasses import dataclass
+
+from skyfi_modelship.util.timing import percentile
+
+from .clients import LoadClient
+
+
+@dataclass
+class LoadReport:
+    """
+    Outcome of a load test run, latencies in milliseconds.
+    In the open loop mode, the latency is measured from the scheduled send time,
+    so the queueing in the load generator itself is accounted for.
+    """
+
+    mode: str
+    sent: int
+    completed: int
+    errors: int
+    error_rate: float
+    duration_s: float
+    throughput_rps: float
+    p50_ms: float
+    p90_ms: float
+    p99_ms: float
+    max_ms: float
+    error_types: Dict[str, int]
+
+
+class Recorder:
+    """ Collects the latencies and errors of the requests, from many threads. """
+
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.errors: Counter = Counter()
+        self.lock = threading.Lock()
+
+    def call(self, client: LoadClient, payload: dict, timeout: float, start: float) -> None:
+        try:
+            client.call(payload, timeout)
+        except Exception as ex:
+            with self.lock:
+                self.errors[str(ex) if isinstance(ex, RuntimeError) else type(ex).__name__] += 1
+            return
+        latency = time.perf_counter() - start
+        with self.lock:
+            self.latencies.append(latency)
+
+    def report(self, mode: str, duration: float) -> LoadReport:
+        latencies = sorted(self.latencies)
+        errors = sum(self.errors.values())
+        sent = len(latencies) + errors
+
+        def pct(value: float) -> float:
+            return percentile(latencies, value) * 1000 if latencies else 0.0
+
+        return LoadReport(
+            mode=mode,
+            sent=sent,
+            completed=len(latencies),
+            errors=errors,
+            error_rate=errors / sent if sent else 0.0,
+            duration_s=duration,
+            throughput_rps=len(latencies) / duration if duration else 0.0,
+            p50_ms=pct(50),
+            p90_ms=pct(90),
+            p99_ms=pct(99),
+            max_ms=latencies[-1] * 1000 if latencies else 0.0,
+            error_types=dict(self.errors),
+        )
+
+
+def replay(payloads: List[dict]) -> Iterator[dict]:
+    """ Cycles through the payloads, each request gets a fresh request_id. """
+
+    for payload in itertools.cycle(payloads):
+        yield payload | {"request_id": str(uuid.uuid4())}
+
+
+def run_closed_loop(
+    client: LoadClient,
+    payloads: List[dict],
+    concurrency: int,
+    requests: Optional[int] = None,
+    duration: Optional[float] = None,
+    timeout: float = 60.0,
+) -> LoadReport:
+    """
+    Runs concurrency clients, each sending its next request once the previous one
+    completed, until requests were sent or duration seconds passed.
+    """
+
+    recorder = Recorder()
+    source = replay(payloads)
+    sent = itertools.count()
+    lock = threading.Lock()
+    start = time.perf_counter()
+
+    def worker():
+        while True:
+            with lock:
+                if requests is not None and next(sent) >= requests:
+                    return
+                payload = next(source)
+            if duration is not None and time.perf_counter() - start >= duration:
+                return
+            recorder.call(client, payload, timeout, time.perf_counter())
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return recorder.report("closed", time.perf_counter() - start)
+
+
+def run_open_loop(
+    client: LoadClient,
+    payloads: List[dict],
+    rate: float,
+    requests: Optional[int] = None,
+    duration: Optional[float] = None,
+    timeout: float = 60.0,
+    max_inflight: int = 1000,
+) -> LoadReport:
+    """
+    Sends rate requests per second, whether or not the previous ones completed,
+    until requests were sent or duration seconds passed.
+    """
+
+    recorder = Recorder()
+    source = replay(payloads)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_inflight) as executor:
+        for idx in itertools.count():
+            if requests is not None and idx >= requests:
+                break
+            scheduled = start + idx / rate
+            if duration is not None and scheduled - start >= duration:
+                break
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            executor.submit(recorder.call, client, next(source), timeout, scheduled)
+    return recorder.report("open", time.perf_counter() - start)
@@ -1,8 +1,14 @@
+from typing import TYPE_CHECKING, Callable, Optional, Union
+
 from loguru import logger
 import orjson
-from fastapi.encoders import jsonable_encoder
 
 from .config import load_config
+from .util.batching import BatchFunction, min_concurrency
+from .util.request_plan import get_plan
+
+if TYPE_CHECKING:
+    from mmap import mmap as MemoryMap
 
 
 class SkyfiApp:
@@ -15,10 +21,14 @@ class SkyfiApp:
     bootstrap_func = None
     inference_func = None
 
-    def start(self):
+    def start(self, workers: Optional[int] = None):
         """
         Start the Skyfi application.
         Execute this once all the decorators have been applied.
+
+        With workers > 1 (or SKYFI_WORKERS), the RabbitMQ consumer or the FastAPI
+        server runs in that many forked workers. The bootstrap function runs once,
+        before forking, and the loaded state is shared by the workers.
         """
 
         if self.inference_func is None:
@@ -29,29 +39,59 @@ class SkyfiApp:
             self.bootstrap_func()
 
         config = load_config()
+        workers = workers or config.workers
 
         # if rabbitmq is enabled, import and call the handler
         if config.is_rabbitmq_worker:
             from .handler.rabbitmq_handler import RabbitMQHandler
-            handler = RabbitMQHandler()
-            handler.listen(self.inference_func)
+
+            def listen(index: int = 0):
+                handler = RabbitMQHandler(
+                    min_workers=min_concurrency(self.inference_func), worker_index=index
+                )
+                handler.listen(self.inference_func)
+
+            self.run_workers(listen, workers)
 
         # if fastapi is enabled, import and call the handler
         elif config.is_fastapi_server:
             from .handler.fastapi_handler import FastApiHandler
-            handler = FastApiHandler()
-            handler.listen(self.inference_func)
+            sock = None
+            if workers > 1:
+                from .util.prefork import bind_socket
+                sock = bind_socket(config.fastapi_host or "127.0.0.1", config.fastapi_port or 8000)
+
+            def listen(index: int = 0):
+                handler = FastApiHandler(
+                    min_workers=min_concurrency(self.inference_func),
+                    worker_index=index if sock is not None else None,
+                )
+                handler.listen(self.inference_func, sock)
+
+            self.run_workers(listen, workers)
 
         # use args
         else:
             from .handler.args_handler import ArgsHandler
+            from .util.execution import to_jsonable
             handler = ArgsHandler()
             result = handler.handle(self.inference_func)
             logger.info("Printing inference to stdout")
 
-            print(orjson.dumps(jsonable_encoder(result)))
+            print(orjson.dumps(to_jsonable(result)))
             return result
 
+    @staticmethod
+    def run_workers(listen: Callable[[int], None], workers: int):
+        """ Runs listen in this process, or in supervised forked workers. """
+
+        if workers <= 1:
+            listen(0)
+            return
+
+        from .util.prefork import Supervisor
+        Supervisor(listen, workers, load_config().worker_restart_delay).run()
+
     def bootstrap(self, func):
         """
         Decorator to be used on a function that handles bootstrap tasks.
@@ -64,6 +104,21 @@ class SkyfiApp:
         self.bootstrap_func = func
         return func
 
+    def artifact(
+        self, url: str, sha256: Optional[str] = None, mmap: bool = False
+    ) -> Union[str, "MemoryMap"]:
+        """
+        Returns a model artifact, e.g. weights, to be used in the bootstrap function.
+        The artifact is downloaded once into the persistent SKYFI_ARTIFACT_CACHE_DIR and
+        verified against its sha256, if given. Returns the local path of the cached file,
+        or a read only memory map of it with mmap=True, shared by the processes of the node.
+        """
+
+        from .util.artifacts import get_artifact_cache, open_mmap
+
+        path = get_artifact_cache().fetch(url, sha256)
+        return open_mmap(path) if mmap else path
+
     def inference(self, func):
         """
         Decorator to be used on a function that will do the model inference.
@@ -75,5 +130,26 @@ class SkyfiApp:
         if self.inference_func is not None:
             raise ValueError("Single inference function allowed.")
 
+        # compile the request validation once, instead of on every request
+        get_plan(func)
         self.inference_func = func
         return func
+
+    def batch_inference(self, max_batch_size: int = 8, max_wait: float = 0.01):
+        """
+        Decorator to be used on a function that will do the model inference in batches.
+        The function takes a single List[SomeTypedDict] parameter, where the TypedDict
+        declares the request parameters, and returns a list with an output per item.
+        Concurrent requests are gathered into batches of up to max_batch_size, waiting
+        at most max_wait seconds after the first request of the batch.
+        """
+
+        def decorator(func):
+            if self.inference_func is not None:
+                raise ValueError("Single inference function allowed.")
+
+            batch_func = BatchFunction(func, max_batch_size, max_wait)
+            get_plan(batch_func)
+            self.inference_func = batch_func
+            return func
+        return decorator
@@ -1,45 +1,210 @@
 from functools import cached_property
 import os
+import re
 import typing
-from typing import Any, Dict, Generic, Optional, TypeVar
+from typing import Any, Dict, Generic, Optional, TypeVar, Union
 from loguru import logger
 import orjson
 
-import shapely.wkt
-from pydantic import BaseModel, computed_field, field_validator
+from pydantic import (
+    BaseModel,
+    ModelWrapValidatorHandler,
+    PrivateAttr,
+    SerializationInfo,
+    SerializerFunctionWrapHandler,
+    ValidationInfo,
+    computed_field,
+    field_validator,
+    model_serializer,
+    model_validator,
+)
 from pydantic.dataclasses import dataclass
+from pydantic_core import to_jsonable_python
 from geojson_pydantic import FeatureCollection
 
+from .config import load_config
 
-@dataclass
+if typing.TYPE_CHECKING:
+    from shapely.geometry.base import BaseGeometry
+    from shapely.prepared import PreparedGeometry
+
+
+_HEX_RE = re.compile(r"^[0-9a-fA-F]+$")
+
+
+def abbreviate(text: str, limit: int = 100) -> str:
+    """ Shortens long values (AOIs, documents) for logging. """
+
+    if len(text) <= limit:
+        return text
+    return f"{text[:limit]}... ({len(text)} chars)"
+
+
+@dataclass(repr=False)
 class Polygon:
+    """
+    Store a polygon as a wkt string.
+
+    wkt: the polygon as WKT, hex encoded WKB or WKB bytes (stored hex encoded)
+    geometry: the parsed shapely geometry, parsed once during validation
+    prepared: the prepared geometry, for fast contains / intersects tests
+    """
+
     wkt: str
 
-    @field_validator("wkt")
+    @field_validator("wkt", mode="before")
     @classmethod
-    def valid_wkt(cls, wkt: str):
-        logger.info("Validating wkt ... {wkt}", wkt=wkt)
+    def wkb_to_hex(cls, wkt: Union[str, bytes]):
+        if isinstance(wkt, (bytes, bytearray)):
+            return bytes(wkt).hex()
+        return wkt
+
+    def __post_init__(self):
+        logger.info("Validating wkt ... {wkt}", wkt=abbreviate(self.wkt))
         try:
-            shapely.wkt.loads(wkt)
+            # keep the parsed geometry, see the geometry property
+            self.__dict__["geometry"] = self._parse()
         except Exception:
-            raise ValueError('must be a valid wkt')
-        return wkt
+            raise ValueError('must be a valid wkt or wkb')
+
+    def _parse(self) -> "BaseGeometry":
+        # shapely (and numpy) are imported on first use, they're slow to import
+        import shapely
+
+        if _HEX_RE.match(self.wkt):
+            return shapely.from_wkb(self.wkt)
+        return shapely.from_wkt(self.wkt)
+
+    @cached_property
+    def geometry(self) -> "BaseGeometry":
+        return self._parse()
+
+    @cached_property
+    def prepared(self) -> "PreparedGeometry":
+        from shapely.prepared import prep
+
+        return prep(self.geometry)
+
+    def __repr__(self) -> str:
+        return f"Polygon(wkt={abbreviate(self.wkt)!r})"
+
+
+# the validation context key of the GeoJSON validated up front, see GeoJSON.__init__
+GEOJSON_EAGER = "skyfi_geojson_eager"
 
 
 class GeoJSON(FeatureCollection):
-    """ Store a GeoJSON Feature Object. """
+    """
+    Store a GeoJSON Feature Object.
+
+    Accepts a FeatureCollection dict or its JSON document as str/bytes.
+    With SKYFI_GEOJSON_LAZY enabled, only the envelope of a JSON document is validated
+    up front: the features are validated on first access, and a collection that was never
+    accessed nor modified is written back with its original bytes, see dump_json.
+    A collection built from keyword arguments or Feature objects is always validated.
+    """
+
+    _raw: Optional[bytes] = PrivateAttr(default=None)
+    _data: Optional[Dict[str, Any]] = PrivateAttr(default=None)
 
     def __init__(self, geo_str: Optional[object] = None, **kwargs):
         if geo_str:
-            logger.info("Validating geo_json ... {geo_str}", geo_str=geo_str)
-            geo_json = str(geo_str)
-            geo_dict = orjson.loads(geo_json)
-            super().__init__(**geo_dict)
+            value = geo_str if isinstance(geo_str, (str, bytes)) else str(geo_str)
         elif len(kwargs):
-            super().__init__(**kwargs)
+            value = kwargs
         else:
             raise ValueError('must be a valid geo_json')
 
+        if isinstance(value, (str, bytes)) and load_config().geojson_lazy:
+            # validators can't replace self, take over the state of the lazy instance
+            self.__setstate__(type(self).model_validate(value).__getstate__())
+            return
+        if isinstance(value, (str, bytes)):
+            value = orjson.loads(value)
+        # e.g. a collection of Feature objects built by a model, always validated up front
+        self.__pydantic_validator__.validate_python(
+            value, self_instance=self, context={GEOJSON_EAGER: True}
+        )
+
+    @model_validator(mode="wrap")
+    @classmethod
+    def lazy_validate(
+        cls, value: Any, handler: ModelWrapValidatorHandler["GeoJSON"], info: ValidationInfo
+    ):
+        if isinstance(value, cls) or (info.context or {}).get(GEOJSON_EAGER):
+            return handler(value)
+
+        raw = None
+        if isinstance(value, (str, bytes)):
+            raw = value.encode() if isinstance(value, str) else value
+            logger.info("Validating geo_json ... {size} bytes", size=len(raw))
+            value = orjson.loads(raw)
+
+        if not load_config().geojson_lazy:
+            return handler(value)
+        # e.g. GeoJSON(type="FeatureCollection", features=[Feature(...)]) built by a model,
+        # only plain JSON documents are kept as they are
+        if isinstance(value, dict) and isinstance(value.get("features"), list) \
+                and not all(isinstance(feature, dict) for feature in value["features"]):
+            return handler(value)
+
+        # validate the envelope only, the features are validated on first access
+        if not isinstance(value, dict) or value.get("type") != "FeatureCollection" \
+                or not isinstance(value.get("features"), list):
+            raise ValueError('must be a valid geo_json FeatureCollection')
+        geo = cls.model_construct(type=value["type"], bbox=value.get("bbox"))
+        geo._raw = raw
+        geo._data = value
+        return geo
+
+    @property
+    def is_lazy(self) -> bool:
+        """ True until the features have been validated. """
+
+        return "features" not in self.__dict__
+
+    def __getattr__(self, name: str) -> Any:
+        if name == "features" and self._data is not None:
+            self.validate_features()
+            return self.__dict__["features"]
+        return super().__getattr__(name)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        if not name.startswith("_"):
+            # modified, the original bytes are stale
+            self.validate_features()
+        super().__setattr__(name, value)
+
+    def validate_features(self) -> None:
+        """ Fully validates a lazy collection. Its original bytes are dropped. """
+
+        if not self.is_lazy:
+            return
+        validated = FeatureCollection.model_validate(self._data)
+        self.__dict__["features"] = validated.features
+        self.__pydantic_fields_set__.add("features")
+        self._data = None
+        self._raw = None
+
+    @model_serializer(mode="wrap")
+    def clean_model(
+        self, serializer: SerializerFunctionWrapHandler, info: SerializationInfo
+    ) -> Dict[str, Any]:
+        # a lazy collection serializes its unvalidated document
+        if self.is_lazy:
+            return self._data
+        return super().clean_model(serializer, info)
+
+    def dump_json(self) -> bytes:
+        """ Serializes the collection, returns the original bytes of an untouched lazy one. """
+
+        if self._raw is not None:
+            return self._raw
+        if self.is_lazy:
+            # e.g. a geometry model within a feature dict
+            return orjson.dumps(self._data, default=to_jsonable_python)
+        return self.model_dump_json().encode()
+
 
 def make_ext_validator(extensions: typing.List[str]):
     def validate_extension(path: Optional[str]):
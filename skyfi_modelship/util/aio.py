@@ -0,0 +1,38 @@
+import asyncio
+import inspect
+import os
+import threading
+from typing import Any, Callable, Coroutine, Optional
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_pid: Optional[int] = None
+_loop_lock = threading.Lock()
+
+
+def is_async(func: Callable) -> bool:
+    """ Returns True if func is an async def inference function, or an async callable object. """
+
+    return inspect.iscoroutinefunction(func) or \
+        inspect.iscoroutinefunction(type(func).__call__)
+
+
+def event_loop() -> asyncio.AbstractEventLoop:
+    """
+    Returns the event loop of the process, running on a daemon thread.
+    The worker threads run the async inference functions on it, so the I/O of the
+    requests in flight overlaps. Started lazily and again in forked workers.
+    """
+
+    global _loop, _loop_pid
+    with _loop_lock:
+        if _loop is None or _loop_pid != os.getpid():
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="skyfi-event-loop", daemon=True).start()
+            _loop, _loop_pid = loop, os.getpid()
+        return _loop
+
+
+def run_coroutine(coro: Coroutine) -> Any:
+    """ Runs the coroutine on the event loop of the process, blocking the calling thread. """
+
+    return asyncio.run_coroutine_threadsafe(coro, event_loop()).result()
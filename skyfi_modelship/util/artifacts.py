@@ -0,0 +1,102 @@
+from functools import lru_cache
+import hashlib
+import mmap
+import os
+import stat
+from typing import Optional
+import uuid
+
+from loguru import logger
+
+from skyfi_modelship.config import load_config
+
+from .cache import file_lock
+from .storage import CHUNK_SIZE, download_object, get_backend, is_remote
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ArtifactCache:
+    """
+    Persistent cache of the model artifacts, e.g. weights, shared by the processes
+    and the restarts on the node.
+
+    Artifacts with a sha256 are keyed by it, so a valid cached copy is used without
+    contacting the storage. Other artifacts are keyed by the url and the object
+    generation. The cached files are verified before they're moved into the cache,
+    they're read only and never evicted.
+
+    directory: the cache directory
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.objects_dir = os.path.join(directory, "objects")
+        self.locks_dir = os.path.join(directory, "locks")
+        self.tmp_dir = os.path.join(directory, "tmp")
+        for folder in (self.objects_dir, self.locks_dir, self.tmp_dir):
+            os.makedirs(folder, exist_ok=True)
+
+    def fetch(self, url: str, sha256: Optional[str] = None) -> str:
+        """ Returns the local path of the artifact at url, downloading it if not cached. """
+
+        if not is_remote(url):
+            if sha256 is not None:
+                self.verify(url, url, sha256)
+            return url
+
+        backend = get_backend(url)
+        info = None
+        if sha256 is not None:
+            key = sha256.lower()
+        else:
+            info = backend.stat(url)
+            key = hashlib.sha256(f"{url}#{info.generation}".encode()).hexdigest()
+        entry = os.path.join(self.objects_dir, f"{key}_{os.path.basename(url)}")
+        if os.path.exists(entry):
+            return entry
+
+        with file_lock(os.path.join(self.locks_dir, f"{key[:2]}.lock")):
+            if os.path.exists(entry):
+                return entry
+
+            logger.info("Downloading artifact... {url} to {entry}", url=url, entry=entry)
+            tmp_path = os.path.join(self.tmp_dir, f"{key}.{uuid.uuid4().hex}")
+            try:
+                if info is None:
+                    info = backend.stat(url)
+                download_object(backend, url, info, tmp_path)
+                if sha256 is not None:
+                    self.verify(url, tmp_path, sha256)
+                os.chmod(tmp_path, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+                os.replace(tmp_path, entry)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+        return entry
+
+    @staticmethod
+    def verify(url: str, path: str, sha256: str) -> None:
+        actual = file_sha256(path)
+        if actual != sha256.lower():
+            raise ValueError(f"Checksum mismatch for {url}: expected {sha256}, got {actual}")
+
+
+def open_mmap(path: str) -> mmap.mmap:
+    """ Returns a read only memory map of the file, shared through the page cache. """
+
+    with open(path, "rb") as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+@lru_cache
+def get_artifact_cache() -> ArtifactCache:
+    """ Returns the artifact cache in SKYFI_ARTIFACT_CACHE_DIR. """
+
+    return ArtifactCache(os.path.expanduser(load_config().artifact_cache_dir))
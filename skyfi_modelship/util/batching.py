@@ -0,0 +1,172 @@
+from concurrent.futures import Future
+import inspect
+import os
+import queue
+import threading
+import time
+import typing
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from loguru import logger
+
+from skyfi_modelship.config import load_config
+
+from .aio import is_async, run_coroutine
+from .metrics import BATCH_SIZE
+
+
+def batch_signature(func: Callable) -> inspect.Signature:
+    """
+    Returns the per request signature of a batch inference function.
+    The function takes a single List[SomeTypedDict] parameter, the TypedDict fields
+    are the request parameters. A List[Output] return type is unwrapped to Output.
+    """
+
+    hints = typing.get_type_hints(func)
+    params = list(inspect.signature(func).parameters)
+    item_type = None
+    if len(params) == 1:
+        args = typing.get_args(hints.get(params[0]))
+        if typing.get_origin(hints.get(params[0])) in (list, List) and len(args) == 1:
+            item_type = args[0]
+    # typing.is_typeddict needs python 3.10
+    is_typeddict = isinstance(item_type, type) and issubclass(item_type, dict) \
+        and hasattr(item_type, "__total__")
+    if not is_typeddict:
+        raise ValueError(
+            f"Batch inference function {func.__name__} must take a single "
+            "List[TypedDict] parameter."
+        )
+
+    return_type = hints.get("return", inspect.Signature.empty)
+    if typing.get_origin(return_type) in (list, List):
+        return_type = typing.get_args(return_type)[0]
+
+    return inspect.Signature(
+        [
+            inspect.Parameter(name, inspect.Parameter.POSITIONAL_OR_KEYWORD, annotation=annotation)
+            for name, annotation in typing.get_type_hints(item_type).items()
+        ],
+        return_annotation=return_type,
+    )
+
+
+class Batcher:
+    """
+    Gathers the submitted requests into batches, up to max_batch_size requests or
+    max_wait seconds after the first one, and runs them on a daemon thread.
+    If a batch fails, its requests are run one by one, so a bad request only fails itself.
+    """
+
+    def __init__(self, func: Callable, max_batch_size: int, max_wait: float):
+        self.func = func
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.queue: "queue.Queue[Tuple[Dict[str, Any], Future]]" = queue.Queue()
+        self.thread = threading.Thread(
+            target=self.run, name=f"skyfi-batcher-{func.__name__}", daemon=True
+        )
+        self.thread.start()
+
+    def submit(self, kwargs: Dict[str, Any]) -> Future:
+        future = Future()
+        self.queue.put((kwargs, future))
+        return future
+
+    def next_batch(self) -> List[Tuple[Dict[str, Any], Future]]:
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            try:
+                batch.append(self.queue.get(timeout=timeout) if timeout > 0
+                             else self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def call(self, items: List[Dict[str, Any]]) -> List[Any]:
+        outputs = self.func(items)
+        if inspect.isawaitable(outputs):
+            outputs = run_coroutine(outputs)
+        if not isinstance(outputs, (list, tuple)) or len(outputs) != len(items):
+            raise ValueError(
+                f"Batch inference function {self.func.__name__} must return a list "
+                f"of {len(items)} outputs."
+            )
+        return list(outputs)
+
+    def run(self) -> None:
+        while True:
+            batch = self.next_batch()
+            BATCH_SIZE.observe(len(batch), function=self.func.__name__)
+            try:
+                outputs = self.call([kwargs for kwargs, _ in batch])
+            except Exception as ex:
+                if len(batch) == 1:
+                    batch[0][1].set_exception(ex)
+                    continue
+                logger.warning("Batch of {size} failed, running the requests one by one: {ex}",
+                               size=len(batch), ex=ex)
+                for kwargs, future in batch:
+                    try:
+                        future.set_result(self.call([kwargs])[0])
+                    except Exception as item_ex:
+                        future.set_exception(item_ex)
+                continue
+            for (_, future), output in zip(batch, outputs):
+                future.set_result(output)
+
+
+class BatchFunction:
+    """
+    Per request view of a batch inference function, registered as the inference function.
+    It has the signature of a single request, so it's validated and called like any
+    inference function, and the calls are batched by a Batcher.
+    The handlers should run at least max_batch_size requests concurrently.
+    """
+
+    def __init__(self, func: Callable, max_batch_size: int, max_wait: float):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1.")
+        self.func = func
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.__name__ = func.__name__
+        self.__doc__ = func.__doc__
+        self.__signature__ = batch_signature(func)
+        self._batcher: Optional[Batcher] = None
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+
+    @property
+    def batcher(self) -> Batcher:
+        # started lazily and again in forked workers, threads don't survive a fork
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._batcher = Batcher(self.func, self.max_batch_size, self.max_wait)
+                    self._pid = os.getpid()
+        return self._batcher
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # the batcher thread and the lock stay in this process
+        state = dict(self.__dict__)
+        state.update(_batcher=None, _pid=None, _lock=None)
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def __call__(self, **kwargs):
+        return self.batcher.submit(kwargs).result()
+
+
+def min_concurrency(func: Callable) -> int:
+    """ Returns the number of requests the handlers should run concurrently for func. """
+
+    if is_async(func):
+        # the requests overlap their I/O on the event loop
+        return load_config().async_concurrency
+    return getattr(func, "max_batch_size", 1)
@@ -0,0 +1,169 @@
+from contextlib import contextmanager
+import hashlib
+import os
+import shutil
+import stat
+import threading
+from typing import Callable, Dict, Iterator, List, Tuple
+import uuid
+
+from loguru import logger
+
+from .storage import ObjectInfo
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not available on Windows
+    fcntl = None
+
+
+_thread_locks: Dict[str, threading.Lock] = {}
+_thread_locks_guard = threading.Lock()
+
+
+@contextmanager
+def file_lock(path: str) -> Iterator[None]:
+    """
+    Exclusive lock shared by the threads and the processes using the same path.
+    Falls back to a lock shared by the threads only where flock is not available.
+    """
+
+    if fcntl is None:
+        with _thread_locks_guard:
+            thread_lock = _thread_locks.setdefault(path, threading.Lock())
+        with thread_lock:
+            yield
+        return
+
+    with open(path, "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+# ioctl cloning a file on copy-on-write filesystems (btrfs, xfs, overlayfs on those)
+FICLONE = 0x40049409
+
+
+def clone_or_copy(src: str, dst: str) -> None:
+    """
+    Reflinks src to dst where the filesystem supports it, copies it otherwise.
+    dst never shares its data with src: writing to it leaves src untouched.
+    """
+
+    if os.path.lexists(dst):
+        os.remove(dst)
+    if fcntl is not None:
+        with open(src, "rb") as src_file, open(dst, "wb") as dst_file:
+            try:
+                fcntl.ioctl(dst_file.fileno(), FICLONE, src_file.fileno())
+                return
+            except OSError:
+                pass
+    # copyfile uses sendfile on Linux, the data isn't copied through user space
+    shutil.copyfile(src, dst)
+
+
+class InputCache:
+    """
+    Content addressed cache of downloaded input files, shared by the requests
+    and the processes of the node.
+
+    Entries are keyed by the object url and generation, so an overwritten object is
+    downloaded again. Cached files are reflinked, or copied, into the request folders,
+    so an inference function writing to its inputs can't corrupt the cache.
+    The least recently used entries are evicted to stay within max_bytes.
+
+    directory: the cache directory
+    max_bytes: the byte budget of the cache
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.objects_dir = os.path.join(directory, "objects")
+        self.locks_dir = os.path.join(directory, "locks")
+        self.tmp_dir = os.path.join(directory, "tmp")
+        for folder in (self.objects_dir, self.locks_dir, self.tmp_dir):
+            os.makedirs(folder, exist_ok=True)
+
+    @staticmethod
+    def key(url: str, generation: str) -> str:
+        return hashlib.sha256(f"{url}#{generation}".encode()).hexdigest()
+
+    def entry_path(self, key: str) -> str:
+        return os.path.join(self.objects_dir, key)
+
+    def lock_path(self, key: str) -> str:
+        # the entries share 256 striped lock files, so they don't pile up
+        return os.path.join(self.locks_dir, f"{key[:2]}.lock")
+
+    def fetch(
+        self, url: str, info: ObjectInfo, destination: str, download: Callable[[str], None]
+    ) -> None:
+        """
+        Places the object at url in destination, from the cache if possible.
+        On a miss, the object is downloaded with download(path) into the cache first.
+        """
+
+        if info.size > self.max_bytes:
+            logger.info("File larger than the input cache, downloading... {url}", url=url)
+            download(destination)
+            return
+
+        key = self.key(url, info.generation)
+        entry = self.entry_path(key)
+        with file_lock(self.lock_path(key)):
+            if os.path.exists(entry):
+                logger.info("Input cache hit... {url} to {destination}",
+                            url=url, destination=destination)
+                os.utime(entry)
+                clone_or_copy(entry, destination)
+                return
+
+            logger.info("Input cache miss, downloading file... {url} to {destination}",
+                        url=url, destination=destination)
+            tmp_path = os.path.join(self.tmp_dir, f"{key}.{uuid.uuid4().hex}")
+            try:
+                download(tmp_path)
+                os.chmod(tmp_path, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+                os.replace(tmp_path, entry)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            clone_or_copy(entry, destination)
+
+        self.evict(keep=key)
+
+    def entries(self) -> List[Tuple[float, int, str]]:
+        """ Returns the (last access time, size, key) of the cache entries. """
+
+        result = []
+        for key in os.listdir(self.objects_dir):
+            try:
+                entry_stat = os.stat(self.entry_path(key))
+            except FileNotFoundError:
+                continue
+            result.append((entry_stat.st_mtime, entry_stat.st_size, key))
+        return result
+
+    def evict(self, keep: str = "") -> None:
+        """ Removes the least recently used entries until the cache fits in max_bytes. """
+
+        with file_lock(os.path.join(self.locks_dir, "evict.lock")):
+            entries = sorted(self.entries())
+            total = sum(size for _, size, _ in entries)
+            for _, size, key in entries:
+                if total <= self.max_bytes:
+                    break
+                if key == keep:
+                    continue
+                with file_lock(self.lock_path(key)):
+                    logger.info("Evicting input cache entry... {key}", key=key)
+                    try:
+                        os.remove(self.entry_path(key))
+                    except FileNotFoundError:
+                        pass
+                total -= size
@@ -1,26 +1,82 @@
+import asyncio
+from collections import deque
+import dataclasses
+from decimal import Decimal
 import shutil
-from typing import Any, Optional
+from types import GeneratorType
+from typing import Any, Dict, Optional
 import uuid
 
+from loguru import logger
+from pydantic import BaseModel
+from pydantic_core import to_jsonable_python
 from pydantic.dataclasses import dataclass
 
+from skyfi_modelship.config import load_config
+
+from .aio import is_async, run_coroutine
 from .storage import local_folder
 
-from .model_transformer import walk_fields, upload_callable
+from .model_transformer import upload_assets
+
+from .inference_request import InferenceRequest, convert_request, download_inputs
 
-from .inference_request import InferenceRequest
+from .timing import timed
 
 
 @dataclass
 class InferenceResponse:
     """
     Contains the result of the inference. request_id and output_folder are the service parameters,
-    the response is the output of the inference function
+    the response is the output of the inference function,
+    timings are the durations of the request stages in seconds
     """
 
     request_id: uuid.UUID
     output_folder: Optional[str]
     response: Any
+    timings: Optional[Dict[str, float]] = None
+
+
+def to_jsonable(value: Any) -> Any:
+    """
+    Encodes the response like fastapi's jsonable_encoder, without importing fastapi.
+    The pydantic models and the leaf values are encoded by pydantic, the containers
+    are walked here, so that e.g. a Decimal is a number, as with jsonable_encoder.
+    """
+
+    if isinstance(value, BaseModel):
+        return _to_jsonable_python(value)
+    if dataclasses.is_dataclass(value) and not isinstance(value, type):
+        return {
+            field.name: to_jsonable(getattr(value, field.name))
+            for field in dataclasses.fields(value)
+        }
+    if isinstance(value, dict):
+        return {to_jsonable(key): to_jsonable(item) for key, item in value.items()}
+    if isinstance(value, (list, set, frozenset, GeneratorType, tuple, deque)):
+        return [to_jsonable(item) for item in value]
+    if isinstance(value, Decimal):
+        return int(value) if value.as_tuple().exponent >= 0 else float(value)
+    return _to_jsonable_python(value)
+
+
+def _to_jsonable_python(value: Any) -> Any:
+    return to_jsonable_python(
+        value, by_alias=True, timedelta_mode="float", fallback=_jsonable_fallback
+    )
+
+
+def _jsonable_fallback(value: Any) -> Any:
+    # the types unknown to pydantic, encoded as dicts like jsonable_encoder does
+    try:
+        data = dict(value)
+    except Exception as dict_ex:
+        try:
+            data = vars(value)
+        except Exception as vars_ex:
+            raise ValueError(f"Can't encode {type(value).__name__}: {[dict_ex, vars_ex]}")
+    return to_jsonable(data)
 
 
 def exec_func(func, r: InferenceRequest) -> InferenceResponse:
@@ -28,14 +84,105 @@ def exec_func(func, r: InferenceRequest) -> InferenceResponse:
     Executes the inference function.
     Will post process the response, e.g. upload any output files to the output_folder.
     Will cleanup the local folder.
+    The outputs of a generator inference function are uploaded as they are yielded,
+    the response is the list of the outputs, see OutputStream.
     """
 
-    # call the function
-    response = func(**vars(r.kwargs))
-    # post process the response
-    walk_fields("", response, upload_callable(r.output_folder, func.__name__, r.request_id))
-    request_folder = local_folder(r.request_id)
-    shutil.rmtree(request_folder, ignore_errors=True)
-    return InferenceResponse(
-        request_id=r.request_id, output_folder=r.output_folder, response=response
+    from .streaming import OutputStream, is_streaming
+
+    if is_streaming(func):
+        stream = OutputStream(func, r)
+        return stream.response(list(stream))
+
+    timings = dict(r.timings)
+    response = run_inference(func, r, timings)
+    return upload_response(func, r, response, timings)
+
+
+def run_inference(func, r: InferenceRequest, timings: Dict[str, float]) -> Any:
+    """
+    Calls the inference function with the request parameters.
+    An async inference function runs on the event loop of the process, see run_coroutine.
+    """
+
+    with timed(timings, "inference", func.__name__):
+        if is_async(func):
+            return run_coroutine(func(**vars(r.kwargs)))
+        return func(**vars(r.kwargs))
+
+
+def upload_response(
+    func, r: InferenceRequest, response: Any, timings: Dict[str, float]
+) -> InferenceResponse:
+    """
+    Uploads the output files of the response and cleans up the local folder.
+    Stores the response in the result cache, if the request was looked up there.
+    """
+
+    from .result_cache import save_result
+
+    with timed(timings, "upload", func.__name__):
+        upload_assets(
+            response, r.output_folder, func.__name__, r.request_id, load_config().upload_workers
+        )
+    with timed(timings, "cleanup", func.__name__):
+        cleanup(r)
+    result = InferenceResponse(
+        request_id=r.request_id, output_folder=r.output_folder, response=response,
+        timings=timings,
     )
+    save_result(r, result)
+    return result
+
+
+def cleanup(r: InferenceRequest) -> None:
+    """ Removes the local folder of the request. """
+
+    shutil.rmtree(local_folder(r.request_id), ignore_errors=True)
+
+
+def run_request(func, data: dict) -> InferenceResponse:
+    """
+    Converts the request dict, downloading the inputs, and executes the inference function.
+    Module level, so that it can be submitted to thread and process executors.
+    """
+
+    return execute_request(func, convert_request(data, func, fetch_inputs=False))
+
+
+def execute_request(func, r: InferenceRequest) -> InferenceResponse:
+    """
+    Downloads the inputs of a request validated with fetch_inputs=False and executes it,
+    unless its response is in the result cache.
+    """
+
+    from .result_cache import lookup_result
+
+    response = lookup_result(func, r)
+    if response is not None:
+        return response
+    download_inputs(r, func)
+    logger.info("Calling inference function for request {request_id} => {func}({kwargs})",
+                request_id=r.request_id, func=func.__name__, kwargs=r.kwargs)
+    return exec_func(func, r)
+
+
+async def execute_request_async(func, r: InferenceRequest) -> InferenceResponse:
+    """
+    Counterpart of execute_request for the async inference functions, run on the caller's
+    event loop: the inference is awaited there, while the blocking storage I/O of the
+    downloads and uploads runs on threads, so many requests can be in flight at once.
+    """
+
+    from .result_cache import lookup_result
+
+    response = await asyncio.to_thread(lookup_result, func, r)
+    if response is not None:
+        return response
+    await asyncio.to_thread(download_inputs, r, func)
+    logger.info("Calling inference function for request {request_id} => {func}({kwargs})",
+                request_id=r.request_id, func=func.__name__, kwargs=r.kwargs)
+    timings = dict(r.timings)
+    with timed(timings, "inference", func.__name__):
+        result = await func(**vars(r.kwargs))
+    return await asyncio.to_thread(upload_response, func, r, result, timings)
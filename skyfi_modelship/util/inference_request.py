@@ -1,10 +1,12 @@
-import inspect
-from typing import Optional
+from typing import Dict, Optional
 import uuid
 
-from pydantic import BaseModel, create_model
+from pydantic import BaseModel, PrivateAttr
 
-from .model_transformer import download_callable, walk_fields
+from skyfi_modelship.config import load_config
+from .model_transformer import download_assets
+from .request_plan import get_plan
+from .timing import timed
 
 
 class InferenceRequest(BaseModel):
@@ -14,27 +16,39 @@ class InferenceRequest(BaseModel):
     request_id: internal id of the request
     output_folder: upload destination for the output files
     kwargs: the inference function parameters
+    timings: durations of the stages run so far, in seconds
     """
     request_id: uuid.UUID
     output_folder: Optional[str] = None
     kwargs: BaseModel
+    timings: Dict[str, float] = {}
+    # the key of the request in the result cache, set by lookup_result, never by the caller
+    _result_key: Optional[str] = PrivateAttr(default=None)
 
 
-def convert_request(data: dict, func) -> InferenceRequest:
+def convert_request(data: dict, func, fetch_inputs: bool = True) -> InferenceRequest:
     """
     Converts a request dict to InferenceRequest.
     Maps all inference function parameters to skyfi.* types.
+    Only the parameters that can hold files are walked for downloads, see RequestPlan.
+    With fetch_inputs=False the request is only validated, see download_inputs.
     """
 
-    model_args = {}
-    for arg, param in inspect.signature(func).parameters.items():
-        model_args[arg] = (param.annotation, ...)
-
-    FunctionArguments = create_model(
-        'FunctionArguments',
-        **model_args
-    )
-    kwargs = FunctionArguments.model_validate(data)
-    walk_fields("request", vars(kwargs), download_callable(data.get("request_id")))
-    request = InferenceRequest.model_validate(data | {"kwargs": kwargs})
+    plan = get_plan(func)
+    timings: Dict[str, float] = {}
+    with timed(timings, "validation", func.__name__):
+        kwargs = plan.validate(data)
+    request = InferenceRequest.model_validate(data | {"kwargs": kwargs, "timings": timings})
+    if fetch_inputs:
+        download_inputs(request, func)
     return request
+
+
+def download_inputs(request: InferenceRequest, func) -> None:
+    """ Downloads the input files of a validated request into its local folder. """
+
+    with timed(request.timings, "download", func.__name__):
+        download_assets(
+            "request", get_plan(func).file_values(request.kwargs), request.request_id,
+            load_config().download_workers,
+        )
@@ -0,0 +1,195 @@
+import mimetypes
+import os
+import shutil
+import tempfile
+from typing import Any, Dict, List, Optional, Tuple
+import uuid
+
+import orjson
+
+from skyfi_modelship import skyfi_types as st
+from skyfi_modelship.config import load_config
+
+from .execution import InferenceResponse, run_inference, upload_response
+from .inference_request import convert_request, download_inputs
+from .model_transformer import aux_fields, walk_fields
+from .multipart import Part
+from .request_plan import get_plan
+from .storage import local_folder
+
+# the file paths of the outputs returned inline are replaced with part:<part name>
+PART_SCHEME = "part:"
+
+
+def spool_dir() -> str:
+    """ The folder of the spooled inline inputs, tmpfs /dev/shm by default if available. """
+
+    config = load_config()
+    if config.inline_spool_dir:
+        return config.inline_spool_dir
+    return "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+
+
+def spool_folder(spool_id: uuid.UUID) -> str:
+    return os.path.join(spool_dir(), "skyfi_modelship", str(spool_id))
+
+
+class SpooledPart:
+    """
+    The writer of a part of an inline request, see InlineSpool. Written to the spool folder,
+    in memory on tmpfs, and moved to disk_path once larger than max_bytes. The file is
+    only open while a chunk is written, the body is fed to the parser a MiB at a time.
+    """
+
+    def __init__(self, name: str, path: str, disk_path: str, max_bytes: int):
+        self.name = name
+        self.path = path
+        self.disk_path = disk_path
+        self.max_bytes = max_bytes
+        self.size = 0
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb"):
+            pass
+
+    def write(self, data: bytes) -> int:
+        self.size += len(data)
+        if self.size > self.max_bytes and self.path != self.disk_path:
+            os.makedirs(os.path.dirname(self.disk_path), exist_ok=True)
+            shutil.move(self.path, self.disk_path)
+            self.path = self.disk_path
+        with open(self.path, "ab") as f:
+            return f.write(data)
+
+    def close(self) -> None:
+        pass
+
+
+class InlineSpool:
+    """
+    Spools the parts of an inline request as they are parsed, see MultipartParser.
+    A "request" part holds the JSON request. A part named after an st.File parameter sets
+    its path, repeated parts make a list; a part named <parameter>.<attr> sets an aux file,
+    e.g. image.metadata_xml_path. The n-th aux part of a parameter goes with its n-th
+    part, whichever of them comes first.
+    The parts up to inline_spool_max_bytes stay in the spool folder, which is in memory
+    on tmpfs, larger ones are moved to the local folder of the spool on disk.
+    """
+
+    def __init__(self, func, spool_id: uuid.UUID):
+        self.file_fields = get_plan(func).file_fields
+        self.spool_id = spool_id
+        self.max_bytes = load_config().inline_spool_max_bytes
+        self.parts: List[SpooledPart] = []
+
+    def open_part(self, name: str, filename: Optional[str], content_type: str) -> SpooledPart:
+        param = name.partition(".")[0]
+        if name != "request" and param not in self.file_fields:
+            raise ValueError(f"Unknown file parameter: {name}")
+        basename = param if filename is None else os.path.basename(filename)
+        if basename in ("", ".", ".."):
+            raise ValueError(f"Invalid file name of part {name}: {filename!r}")
+        idx = str(len(self.parts))
+        part = SpooledPart(
+            name, os.path.join(spool_folder(self.spool_id), idx, basename),
+            os.path.join(local_folder(self.spool_id, "inline"), idx, basename), self.max_bytes,
+        )
+        self.parts.append(part)
+        return part
+
+    def close(self) -> None:
+        for part in self.parts:
+            part.close()
+
+    def request_data(self) -> Dict[str, Any]:
+        """
+        Returns the data of the request part with the paths of the file parts set,
+        raises ValueError if there isn't a single request part.
+        """
+
+        request_parts = [part for part in self.parts if part.name == "request"]
+        if len(request_parts) != 1:
+            raise ValueError("Expected a single request part")
+        with open(request_parts[0].path, "rb") as f:
+            data = orjson.loads(f.read())
+        if not isinstance(data, dict):
+            raise ValueError("Expected a JSON object request part")
+        # raises ValueError without a valid request_id
+        uuid.UUID(str(data.get("request_id")))
+
+        # the paths of each parameter by attr, path for the main parts
+        files: Dict[str, Dict[str, List[str]]] = {}
+        for part in self.parts:
+            if part.name == "request":
+                continue
+            param, _, attr = part.name.partition(".")
+            files.setdefault(param, {}).setdefault(attr or "path", []).append(part.path)
+
+        for param, attrs in files.items():
+            entries = [
+                {attr: paths[idx] for attr, paths in attrs.items() if idx < len(paths)}
+                for idx in range(max(len(paths) for paths in attrs.values()))
+            ]
+            value = data.get(param)
+            if isinstance(value, list):
+                data[param] = [
+                    (item if isinstance(item, dict) else {}) | entry
+                    for item, entry in zip(value + [None] * len(entries), entries)
+                ]
+            elif len(entries) > 1:
+                data[param] = entries
+            else:
+                data[param] = (value if isinstance(value, dict) else {}) | entries[0]
+        return data
+
+
+def inline_outputs(response: Any, max_bytes: int) -> List[Part]:
+    """
+    Returns the files of the st.Output values up to max_bytes as parts, their paths
+    in the response are replaced with part:<part name>.
+    """
+
+    parts = []
+
+    def collect(field: str, output: Any, **kwargs):
+        if not isinstance(output, st.Output) or not isinstance(output.value, st.File):
+            return
+        for attr in ["path"] + aux_fields(output.value):
+            path = getattr(output.value, attr)
+            if not path or not os.path.isfile(path) or os.path.getsize(path) > max_bytes:
+                continue
+            with open(path, "rb") as f:
+                data = f.read()
+            name = f"{field}.{attr}"
+            parts.append(Part(
+                name=name, data=data, filename=os.path.basename(path),
+                content_type=mimetypes.guess_type(path)[0] or "application/octet-stream",
+            ))
+            setattr(output.value, attr, f"{PART_SCHEME}{name}")
+
+    walk_fields("response", response, collect)
+    return parts
+
+
+def run_inline(func, data: Dict[str, Any]) -> Tuple[InferenceResponse, List[Part]]:
+    """
+    Executes an inline request, its file inputs already spooled by InlineSpool.
+    Without an output_folder, the output files are returned as parts instead of
+    being uploaded. Module level, so that it can be submitted to process executors.
+    """
+
+    r = convert_request(data, func, fetch_inputs=False)
+    # the inputs that are not inline still come from the storage
+    download_inputs(r, func)
+    timings = dict(r.timings)
+    response = run_inference(func, r, timings)
+    parts: List[Part] = []
+    if r.output_folder is None:
+        parts = inline_outputs(response, load_config().inline_output_max_bytes)
+    return upload_response(func, r, response, timings), parts
+
+
+def remove_spooled(spool_id: uuid.UUID) -> None:
+    """ Removes the spooled parts of an inline request, in memory and on disk. """
+
+    shutil.rmtree(spool_folder(spool_id), ignore_errors=True)
+    shutil.rmtree(local_folder(spool_id), ignore_errors=True)
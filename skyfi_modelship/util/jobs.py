@@ -0,0 +1,116 @@
+from collections import OrderedDict
+from concurrent.futures import Future
+import threading
+import time
+from typing import Any, Dict, Optional
+import uuid
+
+from pydantic.dataclasses import dataclass
+
+
+class JobStoreFull(Exception):
+    """ Raised when the job store holds max_jobs unfinished jobs. """
+
+
+@dataclass
+class JobStatus:
+    """
+    State of a submitted job, as returned by GET /jobs/{request_id}.
+    status is one of queued, running, succeeded or failed,
+    response is the InferenceResponse once the job succeeded.
+    """
+
+    request_id: uuid.UUID
+    status: str
+    timings: Dict[str, float]
+    response: Optional[Any] = None
+    error: Optional[str] = None
+
+
+class Job:
+    """ A request submitted to the executor, tracked by the JobStore. """
+
+    def __init__(self, request_id: uuid.UUID, timings: Dict[str, float], future: Future):
+        self.request_id = request_id
+        self.timings = timings
+        self.future = future
+        self.response: Optional[Any] = None
+        self.error: Optional[str] = None
+        self.finished_at: Optional[float] = None
+
+    @property
+    def status(self) -> str:
+        if self.finished_at is not None:
+            return "failed" if self.error is not None else "succeeded"
+        return "running" if self.future.running() else "queued"
+
+    def finish(self, response: Any = None, error: Optional[str] = None) -> None:
+        self.response = response
+        self.error = error
+        if response is not None and response.timings:
+            self.timings = response.timings
+        self.finished_at = time.monotonic()
+
+    def to_status(self) -> JobStatus:
+        return JobStatus(
+            request_id=self.request_id, status=self.status, timings=self.timings,
+            response=self.response, error=self.error,
+        )
+
+
+class JobStore:
+    """
+    Bounded in-process store of the submitted jobs.
+    Finished jobs are evicted ttl seconds after they finish, or earlier, oldest
+    first, to make room for new jobs. Unfinished jobs are never evicted.
+
+    max_jobs: maximum number of jobs held
+    ttl: seconds a finished job is kept
+    """
+
+    def __init__(self, max_jobs: int, ttl: float):
+        self.max_jobs = max_jobs
+        self.ttl = ttl
+        self._jobs: "OrderedDict[uuid.UUID, Job]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._jobs)
+
+    def _evict_expired(self) -> None:
+        now = time.monotonic()
+        expired = [
+            request_id for request_id, job in self._jobs.items()
+            if job.finished_at is not None and now - job.finished_at >= self.ttl
+        ]
+        for request_id in expired:
+            del self._jobs[request_id]
+
+    def _evict_finished(self) -> bool:
+        for request_id, job in self._jobs.items():
+            if job.finished_at is not None:
+                del self._jobs[request_id]
+                return True
+        return False
+
+    def reserve(self, request_id: uuid.UUID) -> None:
+        """
+        Checks that a job for request_id can be added, evicting finished jobs if needed.
+        Raises KeyError if the job exists and JobStoreFull if there is no room left.
+        """
+
+        with self._lock:
+            self._evict_expired()
+            if request_id in self._jobs:
+                raise KeyError(request_id)
+            if len(self._jobs) >= self.max_jobs and not self._evict_finished():
+                raise JobStoreFull(f"{len(self._jobs)} jobs are pending")
+
+    def add(self, job: Job) -> None:
+        with self._lock:
+            self._jobs[job.request_id] = job
+
+    def get(self, request_id: uuid.UUID) -> Optional[Job]:
+        with self._lock:
+            self._evict_expired()
+            return self._jobs.get(request_id)
@@ -0,0 +1,246 @@
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+from typing import Dict, Iterator, List, Sequence, Tuple, TypeVar
+
+from loguru import logger
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+DEFAULT_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0,
+)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Metric:
+    """
+    Base class of the metrics, a family of series keyed by the label values.
+    Metrics are thread safe and rendered in the Prometheus text format.
+    """
+
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labels):
+            raise ValueError(f"{self.name} expects labels {self.labels}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        with self._lock:
+            lines.extend(self._render_samples())
+        return lines
+
+    def _render_samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def _render_samples(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"
+            for key, value in self._values.items()
+        ]
+
+
+class Gauge(Counter):
+    type_name = "gauge"
+
+    def dec(self, amount: float = 1.0, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(Metric):
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        # per series: bucket counts (the last one is +Inf), sum
+        self._series: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._series.setdefault(
+                key, ([0] * (len(self.buckets) + 1), [0.0])
+            )
+            counts[bisect_left(self.buckets, value)] += 1
+            total[0] += value
+
+    def count(self, **labels: str) -> int:
+        with self._lock:
+            series = self._series.get(self._key(labels))
+            return sum(series[0]) if series else 0
+
+    def _render_samples(self) -> List[str]:
+        lines = []
+        for key, (counts, total) in self._series.items():
+            cumulative = 0
+            bounds = [_format_value(bound) for bound in self.buckets] + ["+Inf"]
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                labels = _format_labels(self.labels, key, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labels, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total[0])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+M = TypeVar("M", bound=Metric)
+
+
+class Registry:
+    """ Collection of the metrics exposed on /metrics. """
+
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: M) -> M:
+        self.metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_DURATION = REGISTRY.register(Histogram(
+    "skyfi_stage_duration_seconds", "Duration of the request stages.", ("stage", "function"),
+))
+STAGE_ERRORS = REGISTRY.register(Counter(
+    "skyfi_stage_errors_total", "Errors raised by the request stages.", ("stage", "function"),
+))
+REQUESTS = REGISTRY.register(Counter(
+    "skyfi_requests_total", "Handled requests by status.", ("function", "status"),
+))
+IN_FLIGHT = REGISTRY.register(Gauge(
+    "skyfi_requests_in_flight", "Requests being handled.", ("function",),
+))
+STORAGE_BYTES = REGISTRY.register(Counter(
+    "skyfi_storage_bytes_total", "Bytes transferred from and to the storage.", ("direction",),
+))
+INFERENCE_SLOTS = REGISTRY.register(Gauge(
+    "skyfi_inference_slots", "Inference slots of the pipeline.", ("function",),
+))
+INFERENCE_SLOTS_BUSY = REGISTRY.register(Gauge(
+    "skyfi_inference_slots_busy", "Inference slots running an inference.", ("function",),
+))
+INFERENCE_BUSY_SECONDS = REGISTRY.register(Counter(
+    "skyfi_inference_busy_seconds_total",
+    "Time spent in inference by the pipeline slots, divide its rate by the slots "
+    "for the utilization.",
+    ("function",),
+))
+BATCH_SIZE = REGISTRY.register(Histogram(
+    "skyfi_batch_size", "Requests per batch of the batch inference functions.", ("function",),
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128),
+))
+RESULT_CACHE = REGISTRY.register(Counter(
+    "skyfi_result_cache_total", "Result cache lookups by result, hit or miss.",
+    ("function", "result"),
+))
+
+
+class RequestTracker:
+    """ Outcome of a tracked request, handlers can override the status, e.g. "rejected". """
+
+    def __init__(self):
+        self.status = "success"
+
+
+@contextmanager
+def track_request(func_name: str) -> Iterator[RequestTracker]:
+    """ Tracks a request of the inference function in the in-flight and request metrics. """
+
+    tracker = RequestTracker()
+    IN_FLIGHT.inc(function=func_name)
+    try:
+        yield tracker
+    except BaseException:
+        # keep a status set by the handler before raising, e.g. "throttled"
+        if tracker.status == "success":
+            tracker.status = "error"
+        raise
+    finally:
+        IN_FLIGHT.dec(function=func_name)
+        REQUESTS.inc(function=func_name, status=tracker.status)
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(host: str, port: int) -> ThreadingHTTPServer:
+    """ Serves /metrics on a side HTTP port from a daemon thread. """
+
+    logger.info("Serving metrics on {host}:{port}/metrics", host=host, port=port)
+    server = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+    thread = threading.Thread(target=server.serve_forever, name="skyfi-metrics", daemon=True)
+    thread.start()
+    return server
@@ -1,10 +1,12 @@
-from typing import Any, Callable, Optional
+from functools import partial
+from typing import Any, Callable, List, Optional, Tuple
 import uuid
 
 from loguru import logger
 
 from skyfi_modelship import skyfi_types as st
-from .storage import download, local_folder, save_local_file, upload
+from .parallel import run_parallel
+from .storage import download, is_remote, local_folder, save_local_file, upload
 
 
 def walk_fields(field_key: str, obj: Any, fn: Callable, **kwargs) -> Any:
@@ -17,7 +19,30 @@ def walk_fields(field_key: str, obj: Any, fn: Callable, **kwargs) -> Any:
         fn(f"{field_key}", obj, **kwargs)
 
 
-def download_callable(request_id: Optional[uuid.UUID] = None) -> Callable:
+def aux_fields(asset: st.File) -> List[str]:
+    """ Returns the names of the aux file fields (metadata xml, header) of the asset. """
+
+    if isinstance(asset, st.PNG):
+        return ["metadata_path"]
+    if isinstance(asset, st.GeoTIFF):
+        return ["metadata_xml_path"]
+    if isinstance(asset, st.ENVI):
+        return ["header_path"]
+    return []
+
+
+def download_callable(
+    request_id: Optional[uuid.UUID] = None,
+    transfers: Optional[List[Tuple[str, Callable]]] = None,
+) -> Callable:
+    """
+    Returns a walk_fields callable that downloads the st.File assets.
+    If a transfers list is provided, the downloads are collected there instead of
+    being executed, so that they can be run concurrently with run_parallel.
+    """
+
+    def download_field(asset: st.File, attr: str, folder: str):
+        setattr(asset, attr, download(getattr(asset, attr), folder))
 
     def download_asset(field: str, asset: Any, **kwargs):
         if not isinstance(asset, st.File):
@@ -27,27 +52,66 @@ def download_callable(request_id: Optional[uuid.UUID] = None) -> Callable:
             logger.warning("No request_id provided, skipping download: {item}", item=asset)
             return
 
-        if not asset.path.startswith("gs://"):
+        if not is_remote(asset.path):
             logger.warning("Image is local, skipping download: {item}", item=asset)
             return
 
         folder = local_folder(request_id, field)
-        asset.path = download(asset.path, folder)
 
-        # download aux files
-        if isinstance(asset, (st.PNG, st.GeoTIFF)) and asset.metadata_xml_path:
-            asset.metadata_xml_path = download(asset.metadata_xml_path, folder)
-        elif isinstance(asset, st.ENVI) and asset.header_path:
-            asset.header_path = download(asset.header_path, folder)
+        # download the main file and the aux files
+        attrs = ["path"] + [attr for attr in aux_fields(asset) if getattr(asset, attr)]
+        for attr in attrs:
+            task = partial(download_field, asset, attr, folder)
+            if transfers is None:
+                task()
+            else:
+                transfers.append((f"{field}.{attr}", task))
 
     return download_asset
 
 
+def download_assets(
+    field_key: str, obj: Any, request_id: Optional[uuid.UUID], max_workers: int = 1
+) -> None:
+    """
+    Downloads all st.File assets found in obj, including their aux files.
+    The assets are collected first and then fetched concurrently on a pool of
+    max_workers threads. Stops at the first failure, see run_parallel.
+    """
+
+    transfers: List[Tuple[str, Callable]] = []
+    walk_fields(field_key, obj, download_callable(request_id, transfers))
+    run_parallel(transfers, max_workers)
+
+
 def upload_callable(
     output_folder: Optional[str] = None,
     func_name: Optional[str] = None,
     request_id: Optional[uuid.UUID] = None,
+    transfers: Optional[List[Tuple[str, Callable]]] = None,
 ) -> Callable:
+    """
+    Returns a walk_fields callable that uploads the st.Output files to the output_folder.
+    If a transfers list is provided, the uploads are collected there instead of
+    being executed, so that they can be run concurrently with run_parallel.
+    A collected upload returns a (target, attr, path) rewrite instead of applying it,
+    see upload_assets.
+    """
+
+    def upload_field(asset: st.Output, target: Any, attr: str, path: str):
+        dst = upload(
+            path, output_folder,
+            func_name, name=asset.name, ref_name=asset.ref_name,
+        )
+        return target, attr, dst
+
+    def upload_geojson(field: str, asset: st.GeoJSONOutput):
+        # dump the geojson to a local file
+        geojson_value: st.GeoJSON = asset.value
+        path = save_local_file(
+            request_id, field, asset.name, geojson_value.dump_json()
+        )
+        return upload_field(asset, asset, "path", path)
 
     def upload_asset(field, asset, **kwargs):
         if not isinstance(asset, st.Output):
@@ -55,37 +119,47 @@ def upload_callable(
         if not output_folder:
             logger.warning("No output_folder provided, skipping upload: {item}", item=asset)
             return
-        if not output_folder.startswith("gs://"):
-            logger.warning("Output folder is not gs://, skipping upload: {item}", item=asset)
+        if not is_remote(output_folder):
+            logger.warning("Output folder is not remote, skipping upload: {item}", item=asset)
             return
 
         value = asset.value
+        tasks = []
         if isinstance(value, st.File):
-            # upload main file
-            value.path = upload(
-                value.path, output_folder,
-                func_name, name=asset.name, ref_name=asset.ref_name,
-            )
-            # upload aux files
-            if isinstance(value, (st.PNG, st.GeoTIFF)) and value.metadata_xml_path:
-                value.metadata_xml_path = upload(
-                    value.metadata_xml_path, output_folder,
-                    func_name, name=asset.name, ref_name=asset.ref_name,
-                )
-            elif isinstance(value, st.ENVI) and value.header_path:
-                value.header_path = upload(
-                    value.header_path, output_folder,
-                    func_name, name=asset.name, ref_name=asset.ref_name,
-                )
+            # upload the main file and the aux files
+            attrs = ["path"] + [attr for attr in aux_fields(value) if getattr(value, attr)]
+            tasks = [
+                (f"{field}.{attr}", partial(upload_field, asset, value, attr, getattr(value, attr)))
+                for attr in attrs
+            ]
         elif isinstance(asset, st.GeoJSONOutput):
-            # dump the geojson to a local file
-            geojson_value: st.GeoJSON = asset.value
-            asset.path = save_local_file(
-                request_id, field, asset.name, geojson_value.model_dump_json()
-            )
-            asset.path = upload(
-                    asset.path, output_folder,
-                    func_name, name=asset.name, ref_name=asset.ref_name,
-                )
+            tasks = [(f"{field}.path", partial(upload_geojson, field, asset))]
+
+        for transfer in tasks:
+            if transfers is None:
+                setattr(*transfer[1]())
+            else:
+                transfers.append(transfer)
 
     return upload_asset
+
+
+def upload_assets(
+    obj: Any,
+    output_folder: Optional[str],
+    func_name: Optional[str],
+    request_id: Optional[uuid.UUID],
+    max_workers: int = 1,
+) -> None:
+    """
+    Uploads all st.Output files found in obj, including their aux files and
+    GeoJSON dumps, concurrently on a pool of max_workers threads.
+    The source paths are read before any upload starts and the uploaded paths are
+    written back in field order once all uploads succeed, so the rewrites are
+    deterministic. Stops at the first failure, see run_parallel.
+    """
+
+    transfers: List[Tuple[str, Callable]] = []
+    walk_fields("", obj, upload_callable(output_folder, func_name, request_id, transfers))
+    for rewrite in run_parallel(transfers, max_workers):
+        setattr(*rewrite)
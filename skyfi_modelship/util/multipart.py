@@ -0,0 +1,169 @@
+from email.message import Message
+from email.parser import BytesHeaderParser
+import io
+from typing import BinaryIO, Callable, List, Optional, Tuple
+import uuid
+
+from pydantic.dataclasses import dataclass
+
+
+@dataclass
+class Part:
+    """
+    A part of a multipart body.
+
+    name: the form field name
+    data: the content of the part
+    filename: (Optional) the file name, set for the file parts
+    content_type: the media type of the content
+    """
+
+    name: str
+    data: bytes
+    filename: Optional[str] = None
+    content_type: str = "application/octet-stream"
+
+
+def header_param(value: str, param: str) -> Optional[str]:
+    """ Returns a parameter of a header value, e.g. the boundary of a Content-Type. """
+
+    message = Message()
+    message["content-type"] = value
+    return message.get_param(param)
+
+
+class MultipartParser:
+    """
+    Parses a multipart body incrementally, as its chunks are fed, so that the body
+    is never held in memory. open_part is called with the name, filename and content type
+    of every part and returns the writer of its content, e.g. a file, closed once the part
+    ends. Raises ValueError if malformed.
+    """
+
+    # the most bytes of the headers of a part
+    MAX_HEADERS = 16 * 1024
+
+    def __init__(
+        self, content_type: str, open_part: Callable[[str, Optional[str], str], BinaryIO]
+    ):
+        boundary = header_param(content_type, "boundary")
+        if not content_type.startswith("multipart/") or not boundary:
+            raise ValueError(f"Expected a multipart body with a boundary, got: {content_type}")
+        self.delimiter = b"\r\n--" + boundary.encode()
+        self.open_part = open_part
+        # the delimiters are preceded by a CRLF, except the first one
+        self.buffer = bytearray(b"\r\n")
+        self.state = "preamble"
+        self.writer: Optional[BinaryIO] = None
+
+    def feed(self, data: bytes) -> None:
+        self.buffer += data
+        while self.step():
+            pass
+
+    def close(self) -> None:
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+        if self.state != "end":
+            raise ValueError("Multipart body is not terminated")
+
+    def step(self) -> bool:
+        """ Consumes the buffer up to the next state, returns False if more data is needed. """
+
+        if self.state == "preamble":
+            idx = self.buffer.find(self.delimiter)
+            if idx < 0:
+                del self.buffer[:-len(self.delimiter)]
+                return False
+            del self.buffer[:idx + len(self.delimiter)]
+            self.state = "delimiter"
+        elif self.state == "delimiter":
+            if len(self.buffer) < 2:
+                return False
+            self.state = "end" if self.buffer.startswith(b"--") else "headers"
+        elif self.state == "headers":
+            idx = self.buffer.find(b"\r\n\r\n")
+            if idx < 0:
+                if len(self.buffer) > self.MAX_HEADERS:
+                    raise ValueError("Multipart part headers too large")
+                return False
+            self.start_part(bytes(self.buffer[:idx]))
+            del self.buffer[:idx + 4]
+            self.state = "body"
+        elif self.state == "body":
+            idx = self.buffer.find(self.delimiter)
+            if idx < 0:
+                # the end of the buffer may be the start of a delimiter
+                keep = len(self.delimiter) - 1
+                if len(self.buffer) > keep:
+                    self.writer.write(bytes(self.buffer[:-keep]))
+                    del self.buffer[:-keep]
+                return False
+            if idx:
+                self.writer.write(bytes(self.buffer[:idx]))
+            self.writer.close()
+            self.writer = None
+            del self.buffer[:idx + len(self.delimiter)]
+            self.state = "delimiter"
+        else:
+            # the epilogue is ignored
+            self.buffer.clear()
+            return False
+        return True
+
+    def start_part(self, head: bytes) -> None:
+        headers = BytesHeaderParser().parsebytes(head.lstrip(b" \t").removeprefix(b"\r\n"))
+        disposition = headers.get("content-disposition", "")
+        name = header_param(disposition, "name")
+        if name is None:
+            raise ValueError("Multipart part without a name")
+        self.writer = self.open_part(
+            name, header_param(disposition, "filename"),
+            headers.get("content-type", "application/octet-stream"),
+        )
+
+
+class _PartBuffer(io.BytesIO):
+    def __init__(self, parts: List[Part], name: str, filename: Optional[str], content_type: str):
+        super().__init__()
+        self.parts = parts
+        self.part = (name, filename, content_type)
+
+    def close(self) -> None:
+        name, filename, content_type = self.part
+        self.parts.append(
+            Part(name=name, data=self.getvalue(), filename=filename, content_type=content_type)
+        )
+        super().close()
+
+
+def parse_multipart(body: bytes, content_type: str) -> List[Part]:
+    """ Splits a multipart body into its parts in memory, raises ValueError if malformed. """
+
+    parts: List[Part] = []
+    parser = MultipartParser(content_type, lambda *part: _PartBuffer(parts, *part))
+    parser.feed(body)
+    parser.close()
+    return parts
+
+
+def encode_multipart(parts: List[Part]) -> Tuple[bytes, str]:
+    """ Returns a multipart/mixed body of the parts and its Content-Type. """
+
+    boundary = uuid.uuid4().hex
+    chunks = []
+    for part in parts:
+        # form-data is only valid in multipart/form-data, the files are attachments
+        kind = "inline" if part.filename is None else "attachment"
+        disposition = f'{kind}; name="{part.name}"'
+        if part.filename is not None:
+            disposition += f'; filename="{part.filename}"'
+        chunks += [
+            f"--{boundary}\r\nContent-Disposition: {disposition}\r\n"
+            f"Content-Type: {part.content_type}\r\n\r\n".encode(),
+            part.data,
+            b"\r\n",
+        ]
+    chunks.append(f"--{boundary}--\r\n".encode())
+    return b"".join(chunks), f"multipart/mixed; boundary={boundary}"
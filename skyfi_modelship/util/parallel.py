@@ -0,0 +1,55 @@
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, List, Tuple
+
+
+class TransferError(ValueError):
+    """
+    Raised when one or more file transfers fail.
+
+    errors: the failed fields mapped to their exceptions
+    """
+
+    def __init__(self, errors: Dict[str, Exception]):
+        self.errors = errors
+        details = "; ".join(f"{field}: {ex}" for field, ex in errors.items())
+        super().__init__(f"Transfer failed for {details}")
+
+
+def run_parallel(tasks: List[Tuple[str, Callable[[], Any]]], max_workers: int) -> List[Any]:
+    """
+    Runs the (field, callable) tasks on a bounded thread pool and returns the results
+    in task order. Stops at the first failure: the tasks that haven't started are
+    cancelled and a TransferError is raised for the fields that failed.
+    """
+
+    if not tasks:
+        return []
+
+    if max_workers <= 1 or len(tasks) == 1:
+        results = []
+        for field, task in tasks:
+            try:
+                results.append(task())
+            except Exception as ex:
+                raise TransferError({field: ex}) from ex
+        return results
+
+    executor = ThreadPoolExecutor(
+        max_workers=min(max_workers, len(tasks)), thread_name_prefix="skyfi-transfer"
+    )
+    try:
+        futures = [executor.submit(task) for _, task in tasks]
+        _, pending = wait(futures, return_when=FIRST_EXCEPTION)
+        for future in pending:
+            future.cancel()
+    finally:
+        executor.shutdown(wait=True)
+
+    errors = {
+        field: future.exception()
+        for (field, _), future in zip(tasks, futures)
+        if not future.cancelled() and future.exception() is not None
+    }
+    if errors:
+        raise TransferError(errors) from next(iter(errors.values()))
+    return [future.result() for future in futures]
@@ -0,0 +1,182 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+import os
+import threading
+import time
+from typing import Optional
+
+from loguru import logger
+
+from skyfi_modelship.config import SkyfiConfig
+
+from .execution import InferenceResponse, cleanup, exec_func, run_inference, upload_response
+from .inference_request import InferenceRequest, download_inputs
+from .metrics import INFERENCE_BUSY_SECONDS, INFERENCE_SLOTS, INFERENCE_SLOTS_BUSY
+from .result_cache import lookup_result
+from .storage import local_folder
+from .streaming import is_streaming
+
+
+class InputError(Exception):
+    """ Raised by the pipeline when the inputs of a request can't be downloaded. """
+
+
+def folder_size(folder: str) -> int:
+    """ Returns the size in bytes of the files under folder. """
+
+    total = 0
+    for root, _, files in os.walk(folder):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except FileNotFoundError:
+                pass
+    return total
+
+
+class Pipeline:
+    """
+    Runs the requests through the download, inference and upload stages on separate
+    thread pools, so the inputs of the next requests download and the outputs of the
+    previous requests upload while a request is in inference.
+
+    download_depth: requests downloading or downloaded ahead of the inference
+    inference_slots: requests in inference at the same time
+    upload_depth: requests uploading behind the inference, the inference waits when full
+    max_disk_bytes: the downloads wait while the local request folders hold more bytes
+    """
+
+    def __init__(
+        self,
+        download_depth: int,
+        inference_slots: int,
+        upload_depth: int,
+        max_disk_bytes: Optional[int] = None,
+    ):
+        self.download_depth = download_depth
+        self.inference_slots = inference_slots
+        self.upload_depth = upload_depth
+        self.max_disk_bytes = max_disk_bytes
+        self.download_pool = ThreadPoolExecutor(download_depth, "skyfi-download")
+        self.inference_pool = ThreadPoolExecutor(inference_slots, "skyfi-inference")
+        self.upload_pool = ThreadPoolExecutor(upload_depth, "skyfi-upload")
+        self.ahead = threading.BoundedSemaphore(download_depth)
+        self.behind = threading.BoundedSemaphore(upload_depth)
+        self.disk_bytes = 0
+        self._disk = threading.Condition()
+
+    @property
+    def capacity(self) -> int:
+        """ Number of requests the pipeline works on at the same time. """
+
+        return self.download_depth + self.inference_slots + self.upload_depth
+
+    def submit(self, func, r: InferenceRequest) -> "Future[InferenceResponse]":
+        """
+        Submits a request validated with fetch_inputs=False to the pipeline,
+        a response found in the result cache skips all the stages.
+        The future is running once the download starts, download failures are
+        raised as InputError, caused by the download error.
+        """
+
+        INFERENCE_SLOTS.set(self.inference_slots, function=func.__name__)
+        future: "Future[InferenceResponse]" = Future()
+        self.download_pool.submit(self._download, func, r, future)
+        return future
+
+    def shutdown(self) -> None:
+        for pool in (self.download_pool, self.inference_pool, self.upload_pool):
+            pool.shutdown(wait=True)
+
+    def _fail(self, r: InferenceRequest, future: Future, ex: BaseException, size: int) -> None:
+        cleanup(r)
+        self._release_disk(size)
+        future.set_exception(ex)
+
+    def _acquire_disk(self) -> None:
+        if self.max_disk_bytes is None:
+            return
+        with self._disk:
+            # a single request always proceeds, even when larger than the limit
+            self._disk.wait_for(lambda: self.disk_bytes < max(self.max_disk_bytes, 1))
+
+    def _release_disk(self, size: int) -> None:
+        if not size:
+            return
+        with self._disk:
+            self.disk_bytes -= size
+            self._disk.notify_all()
+
+    def _download(self, func, r: InferenceRequest, future: Future) -> None:
+        if not future.set_running_or_notify_cancel():
+            return
+        response = lookup_result(func, r)
+        if response is not None:
+            future.set_result(response)
+            return
+        self.ahead.acquire()
+        size = 0
+        try:
+            self._acquire_disk()
+            download_inputs(r, func)
+            size = folder_size(local_folder(r.request_id))
+            with self._disk:
+                self.disk_bytes += size
+        except Exception as ex:
+            self.ahead.release()
+            logger.error("Error downloading inputs of {request_id}: {ex}",
+                         request_id=r.request_id, ex=ex)
+            error = InputError(f"{type(ex).__name__}: {ex}")
+            # keeps the cause, e.g. a storage connection error is retried, see is_transient
+            error.__cause__ = ex
+            self._fail(r, future, error, size)
+            return
+        self.inference_pool.submit(self._infer, func, r, future, size)
+
+    def _infer(self, func, r: InferenceRequest, future: Future, size: int) -> None:
+        self.ahead.release()
+        timings = dict(r.timings)
+        INFERENCE_SLOTS_BUSY.inc(function=func.__name__)
+        start = time.perf_counter()
+        try:
+            if is_streaming(func):
+                # the outputs upload while the generator runs, no upload stage needed
+                result = exec_func(func, r)
+            else:
+                response = run_inference(func, r, timings)
+        except Exception as ex:
+            self._fail(r, future, ex, size)
+            return
+        finally:
+            INFERENCE_SLOTS_BUSY.dec(function=func.__name__)
+            INFERENCE_BUSY_SECONDS.inc(time.perf_counter() - start, function=func.__name__)
+        if is_streaming(func):
+            self._release_disk(size)
+            future.set_result(result)
+            return
+        # waits for an upload slot, so the outputs don't pile up
+        self.behind.acquire()
+        self.upload_pool.submit(self._upload, func, r, future, size, response, timings)
+
+    def _upload(self, func, r: InferenceRequest, future: Future, size: int, response, timings):
+        try:
+            result = upload_response(func, r, response, timings)
+        except Exception as ex:
+            self._fail(r, future, ex, size)
+            return
+        finally:
+            self.behind.release()
+        self._release_disk(size)
+        future.set_result(result)
+
+
+def create_pipeline(config: SkyfiConfig, min_slots: int = 1) -> Optional[Pipeline]:
+    """ Returns the configured Pipeline, None if the pipelined mode is disabled. """
+
+    if not config.pipeline_enabled:
+        return None
+    return Pipeline(
+        config.pipeline_download_depth,
+        max(config.pipeline_inference_slots, min_slots),
+        config.pipeline_upload_depth,
+        config.pipeline_max_disk_bytes,
+    )
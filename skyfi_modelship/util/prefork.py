@@ -0,0 +1,100 @@
+import gc
+import os
+import signal
+import socket
+import threading
+import time
+from typing import Callable, Dict
+
+from loguru import logger
+
+
+def bind_socket(host: str, port: int) -> socket.socket:
+    """ Binds the listening socket in the parent, so all the workers accept on it. """
+
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+class Supervisor:
+    """
+    Forks the workers and restarts them when they exit, until stopped.
+    The state loaded before run() (e.g. the bootstrapped model) is shared copy-on-write
+    with the workers, it's frozen so the garbage collector doesn't touch its pages.
+
+    target: called with the worker index in the forked worker
+    workers: number of workers
+    restart_delay: seconds to wait before restarting an exited worker
+    """
+
+    def __init__(self, target: Callable[[int], None], workers: int, restart_delay: float = 1.0):
+        self.target = target
+        self.workers = workers
+        self.restart_delay = restart_delay
+        self.children: Dict[int, int] = {}
+        self.stopping = False
+        self.restarts = 0
+
+    def spawn(self, index: int) -> None:
+        pid = os.fork()
+        if pid:
+            logger.info("Started worker {index}: {pid}", index=index, pid=pid)
+            self.children[pid] = index
+            return
+
+        # in the worker
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        code = 0
+        try:
+            self.target(index)
+        except BaseException as ex:
+            logger.exception("Worker {index} failed: {ex}", index=index, ex=ex)
+            code = 1
+        finally:
+            os._exit(code)
+
+    def stop(self, *args) -> None:
+        """ Stops the workers, run() returns once all of them exited. """
+
+        self.stopping = True
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def run(self) -> None:
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, self.stop)
+            signal.signal(signal.SIGINT, self.stop)
+
+        gc.collect()
+        gc.freeze()
+        logger.info("Starting {workers} workers...", workers=self.workers)
+        for index in range(self.workers):
+            self.spawn(index)
+
+        while self.children:
+            try:
+                pid, status = os.waitpid(-1, 0)
+            except ChildProcessError:
+                break
+            index = self.children.pop(pid, None)
+            if index is None:
+                continue
+            if self.stopping:
+                logger.info("Worker {index} stopped", index=index)
+                continue
+            logger.warning("Worker {index} exited with {code}, restarting...",
+                           index=index, code=os.waitstatus_to_exitcode(status))
+            time.sleep(self.restart_delay)
+            if not self.stopping:
+                self.restarts += 1
+                self.spawn(index)
+        logger.info("All workers stopped")
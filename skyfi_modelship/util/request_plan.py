@@ -0,0 +1,82 @@
+import inspect
+import typing
+from typing import Any, Callable, Dict, List, Type
+import weakref
+
+from pydantic import BaseModel, create_model
+
+from skyfi_modelship import skyfi_types as st
+
+# types that never hold an st.File, the download walk skips them
+_FILE_FREE_TYPES = (int, float, str, bool, bytes, type(None), st.Polygon, st.GeoJSON)
+
+
+def can_contain_file(annotation: Any) -> bool:
+    """
+    Returns True if a value of the annotated type can contain an st.File.
+    Unknown types are assumed to contain files.
+    """
+
+    if annotation is inspect.Parameter.empty or annotation is Any:
+        return True
+
+    args = typing.get_args(annotation)
+    if args:
+        return any(can_contain_file(arg) for arg in args if arg is not Ellipsis)
+
+    if isinstance(annotation, type):
+        if issubclass(annotation, st.File):
+            return True
+        # bare list, dict, tuple... may contain anything
+        return not issubclass(annotation, _FILE_FREE_TYPES)
+    return True
+
+
+class RequestPlan:
+    """
+    Everything convert_request needs for an inference function, computed once.
+
+    model: pydantic model validating the function parameters
+    file_fields: names of the parameters that can contain st.File values
+    """
+
+    def __init__(self, model: Type[BaseModel], file_fields: List[str]):
+        self.model = model
+        self.file_fields = file_fields
+
+    def validate(self, data: dict) -> BaseModel:
+        return self.model.model_validate(data)
+
+    def file_values(self, kwargs: BaseModel) -> Dict[str, Any]:
+        """ Returns the parameters of the validated kwargs that can hold files. """
+
+        return {field: getattr(kwargs, field) for field in self.file_fields}
+
+
+def compile_plan(func: Callable) -> RequestPlan:
+    """ Builds the RequestPlan of the inference function. """
+
+    model_args = {}
+    file_fields = []
+    for arg, param in inspect.signature(func).parameters.items():
+        model_args[arg] = (param.annotation, ...)
+        if can_contain_file(param.annotation):
+            file_fields.append(arg)
+
+    FunctionArguments = create_model(
+        'FunctionArguments',
+        **model_args
+    )
+    return RequestPlan(FunctionArguments, file_fields)
+
+
+_plans: "weakref.WeakKeyDictionary[Callable, RequestPlan]" = weakref.WeakKeyDictionary()
+
+
+def get_plan(func: Callable) -> RequestPlan:
+    """ Returns the cached RequestPlan of the inference function, compiling it if needed. """
+
+    plan = _plans.get(func)
+    if plan is None:
+        plan = _plans[func] = compile_plan(func)
+    return plan
@@ -0,0 +1,331 @@
+from collections import OrderedDict
+import collections.abc
+from functools import lru_cache
+import hashlib
+import inspect
+import os
+import re
+import tempfile
+import threading
+import time
+import typing
+from typing import Any, Dict, List, Optional
+import uuid
+
+from loguru import logger
+import orjson
+from pydantic import TypeAdapter
+
+from skyfi_modelship import skyfi_types as st
+from skyfi_modelship.config import load_config
+
+from .cache import file_lock
+from .execution import InferenceResponse, to_jsonable
+from .inference_request import InferenceRequest
+from .metrics import RESULT_CACHE
+from .model_transformer import aux_fields, walk_fields
+from .request_plan import get_plan
+from .storage import get_backend, is_remote
+
+
+# the return annotations of the generator inference functions, see is_streaming
+STREAM_TYPES = (
+    collections.abc.Iterator, collections.abc.Iterable, collections.abc.Generator,
+    collections.abc.AsyncIterator, collections.abc.AsyncIterable, collections.abc.AsyncGenerator,
+)
+
+
+@lru_cache
+def response_adapter(func) -> Optional[TypeAdapter]:
+    """
+    Returns the adapter validating the stored responses of func into its return type,
+    None if func has no return annotation. The response of a generator function is
+    the list of its outputs.
+    """
+
+    from .streaming import is_streaming
+
+    annotation = inspect.signature(func).return_annotation
+    if annotation is inspect.Signature.empty:
+        return None
+    if is_streaming(func) and typing.get_origin(annotation) in STREAM_TYPES:
+        annotation = List[typing.get_args(annotation)[0]]
+    return TypeAdapter(annotation)
+
+
+def load_response(func, value: bytes) -> Any:
+    """ Returns the stored response, of the type returned by the inference function. """
+
+    response = orjson.loads(value)
+    adapter = response_adapter(func)
+    return adapter.validate_python(response) if adapter is not None else response
+
+
+# the cache keys are sha256 hex digests, see ResultCache.key
+KEY_PATTERN = re.compile(r"[0-9a-f]{64}")
+
+
+def check_key(key: str) -> str:
+    """ Returns the key, raises ValueError if it's not a cache key, e.g. a path. """
+
+    if not isinstance(key, str) or not KEY_PATTERN.fullmatch(key):
+        raise ValueError(f"Invalid result cache key: {key!r}")
+    return key
+
+
+class ResultStore:
+    """ Stores the serialized results of the requests by their cache key. """
+
+    def get(self, key: str) -> Optional[bytes]:
+        """ Returns the stored result, None if there is none. """
+        raise NotImplementedError
+
+    def put(self, key: str, value: bytes) -> None:
+        raise NotImplementedError
+
+
+class MemoryResultStore(ResultStore):
+    """ Least recently used results of this process. """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[str, bytes]" = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+            return value
+
+    def put(self, key: str, value: bytes) -> None:
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+
+class DiskResultStore(ResultStore):
+    """
+    Results shared by the processes of the node, one file per key.
+    The least recently used results are evicted to stay within max_bytes.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{check_key(key)}.json")
+
+    def get(self, key: str) -> Optional[bytes]:
+        try:
+            with open(self.path(key), "rb") as f:
+                value = f.read()
+        except FileNotFoundError:
+            return None
+        os.utime(self.path(key))
+        return value
+
+    def put(self, key: str, value: bytes) -> None:
+        tmp_path = os.path.join(self.directory, f".{check_key(key)}.{uuid.uuid4().hex}")
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(value)
+            os.replace(tmp_path, self.path(key))
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self.evict(keep=key)
+
+    def evict(self, keep: str) -> None:
+        with file_lock(os.path.join(self.directory, ".evict.lock")):
+            entries = []
+            for name in os.listdir(self.directory):
+                if not name.endswith(".json"):
+                    continue
+                try:
+                    entry_stat = os.stat(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    continue
+                entries.append((entry_stat.st_mtime, entry_stat.st_size, name))
+            total = sum(size for _, size, _ in entries)
+            for _, size, name in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                if name == f"{keep}.json":
+                    continue
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+
+class StorageResultStore(ResultStore):
+    """
+    Results shared by all the nodes, stored under url with a storage backend,
+    e.g. gs://bucket/results.
+    """
+
+    def __init__(self, url: str):
+        self.url = url.rstrip("/")
+        self.backend = get_backend(url)
+
+    def key_url(self, key: str) -> str:
+        return f"{self.url}/{check_key(key)}.json"
+
+    def get(self, key: str) -> Optional[bytes]:
+        url = self.key_url(key)
+        try:
+            self.backend.stat(url)
+        except Exception:
+            return None
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, "result.json")
+            self.backend.download(url, path)
+            with open(path, "rb") as f:
+                return f.read()
+
+    def put(self, key: str, value: bytes) -> None:
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, "result.json")
+            with open(path, "wb") as f:
+                f.write(value)
+            self.backend.upload(path, self.key_url(key))
+
+
+def input_generations(func, r: InferenceRequest) -> Dict[str, str]:
+    """
+    Returns the generation of every input file of a request not downloaded yet,
+    so a result computed from an overwritten input is not reused.
+    """
+
+    generations: Dict[str, str] = {}
+
+    def collect(field: str, asset, **kwargs):
+        if not isinstance(asset, st.File):
+            return
+        for attr in ["path"] + aux_fields(asset):
+            path = getattr(asset, attr)
+            if not path:
+                continue
+            if is_remote(path):
+                generations[path] = get_backend(path).stat(path).generation
+            else:
+                path_stat = os.stat(path)
+                generations[path] = f"{path_stat.st_mtime_ns}-{path_stat.st_size}"
+
+    walk_fields("request", get_plan(func).file_values(r.kwargs), collect)
+    return generations
+
+
+class ResultCache:
+    """
+    Reuses the results of the requests seen before, without downloading the inputs
+    or calling the inference function.
+
+    The key is a hash of the function, the validated kwargs, the generations of the
+    input files and the output_folder, so the output paths of a result are valid for
+    the request. With the "request" scope, the request_id is part of the key too and
+    only the redeliveries of a request are de-duplicated; with the "content" scope,
+    identical requests of different callers share their result.
+
+    store: where the results are stored
+    scope: "request" or "content"
+    """
+
+    def __init__(self, store: ResultStore, scope: str = "request"):
+        if scope not in ("request", "content"):
+            raise ValueError(f"Unknown result cache scope: {scope}")
+        self.store = store
+        self.scope = scope
+
+    def key(self, func, r: InferenceRequest) -> str:
+        content = {
+            "function": f"{func.__module__}.{func.__qualname__}",
+            "output_folder": r.output_folder,
+            "kwargs": to_jsonable(r.kwargs),
+            "inputs": input_generations(func, r),
+        }
+        if self.scope == "request":
+            content["request_id"] = str(r.request_id)
+        return hashlib.sha256(orjson.dumps(content, option=orjson.OPT_SORT_KEYS)).hexdigest()
+
+    def lookup(self, func, r: InferenceRequest) -> Optional[InferenceResponse]:
+        """
+        Returns the stored response of the request, None on a miss.
+        Must be called before the inputs are downloaded, it sets the result key of the request.
+        """
+
+        start = time.perf_counter()
+        r._result_key = None
+        try:
+            key = self.key(func, r)
+            value = self.store.get(key)
+            r._result_key = key
+            response = load_response(func, value) if value is not None else None
+        except Exception as ex:
+            logger.warning("Result cache lookup failed for {request_id}: {ex}",
+                           request_id=r.request_id, ex=ex)
+            return None
+        if value is None:
+            RESULT_CACHE.inc(function=func.__name__, result="miss")
+            return None
+
+        RESULT_CACHE.inc(function=func.__name__, result="hit")
+        logger.info("Result cache hit for request {request_id}", request_id=r.request_id)
+        return InferenceResponse(
+            request_id=r.request_id, output_folder=r.output_folder,
+            response=response,
+            timings=r.timings | {"result_cache": time.perf_counter() - start},
+        )
+
+    def save(self, r: InferenceRequest, response: InferenceResponse) -> None:
+        if r._result_key is None:
+            return
+        try:
+            self.store.put(r._result_key, orjson.dumps(to_jsonable(response.response)))
+        except Exception as ex:
+            logger.warning("Result cache store failed for {request_id}: {ex}",
+                           request_id=r.request_id, ex=ex)
+
+
+@lru_cache
+def get_result_cache() -> Optional[ResultCache]:
+    """ Returns the result cache, if enabled with SKYFI_RESULT_CACHE: memory, disk or storage. """
+
+    config = load_config()
+    if not config.result_cache:
+        return None
+    if config.result_cache == "memory":
+        store: ResultStore = MemoryResultStore(config.result_cache_max_entries)
+    elif config.result_cache == "disk":
+        store = DiskResultStore(
+            os.path.expanduser(config.result_cache_dir), config.result_cache_max_bytes
+        )
+    elif config.result_cache == "storage":
+        if not config.result_cache_url:
+            raise ValueError("SKYFI_RESULT_CACHE_URL is required by the storage result cache")
+        store = StorageResultStore(config.result_cache_url)
+    else:
+        raise ValueError(f"Unknown result cache: {config.result_cache}")
+    return ResultCache(store, config.result_cache_scope)
+
+
+def lookup_result(func, r: InferenceRequest) -> Optional[InferenceResponse]:
+    """ Returns the cached response of a request not downloaded yet, if any. """
+
+    cache = get_result_cache()
+    return cache.lookup(func, r) if cache is not None else None
+
+
+def save_result(r: InferenceRequest, response: InferenceResponse) -> None:
+    """ Stores the response of a request looked up with lookup_result. """
+
+    cache = get_result_cache()
+    if cache is not None:
+        cache.save(r, response)
@@ -0,0 +1,58 @@
+import concurrent.futures
+import socket
+from typing import Optional
+
+from skyfi_modelship.config import SkyfiConfig
+
+ATTEMPTS_HEADER = "x-skyfi-attempts"
+ERROR_HEADER = "x-skyfi-error"
+
+# transient errors of the storage clients, matched by name so the clients aren't imported
+_TRANSIENT_ERRORS = {
+    "google.api_core.exceptions": {
+        "DeadlineExceeded", "GatewayTimeout", "InternalServerError", "ServiceUnavailable",
+        "TooManyRequests", "RetryError",
+    },
+    "google.auth.exceptions": {"TransportError"},
+    "requests.exceptions": {
+        "ConnectionError", "ConnectTimeout", "ReadTimeout", "Timeout", "ChunkedEncodingError",
+    },
+    "urllib3.exceptions": {"ProtocolError", "ReadTimeoutError", "NewConnectionError"},
+}
+
+
+class TransientError(Exception):
+    """ Raised by an inference function for a failure worth retrying, e.g. a busy service. """
+
+
+def is_transient(ex: BaseException) -> bool:
+    """
+    Returns True if the error, or one of the errors that caused it, is transient:
+    a connection or timeout error, e.g. of the storage. A retry may succeed, unlike
+    a model or a validation error which fails the same way every time.
+    """
+
+    seen = set()
+    error: Optional[BaseException] = ex
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        if isinstance(error, (TransientError, ConnectionError, TimeoutError, socket.timeout,
+                              concurrent.futures.TimeoutError)):
+            return True
+        if type(error).__name__ in _TRANSIENT_ERRORS.get(type(error).__module__, ()):
+            return True
+        error = error.__cause__ or error.__context__
+    return False
+
+
+def retry_delay(config: SkyfiConfig, attempt: int) -> float:
+    """ Returns the delay in seconds before the retry of the given failed attempt, from 1. """
+
+    delay = config.rabbitmq_retry_delay * config.rabbitmq_retry_backoff ** (attempt - 1)
+    return min(delay, config.rabbitmq_retry_max_delay)
+
+
+def retry_queue(config: SkyfiConfig, attempt: int) -> str:
+    """ Name of the TTL queue holding the messages until their retry is due. """
+
+    return f"{config.rabbitmq_req_queue}.retry.{int(retry_delay(config, attempt) * 1000)}ms"
@@ -1,36 +1,515 @@
-import tempfile
-from typing import Optional
-from uuid import UUID
-from google.cloud import storage
+import base64
+from functools import lru_cache, partial
+import hashlib
 import os
+import shutil
+import tempfile
+import threading
+import time
 from pathlib import Path
+from typing import TYPE_CHECKING, BinaryIO, Dict, List, Optional, Union
+from urllib.parse import urlparse
+from uuid import UUID
 
 from loguru import logger
+from pydantic.dataclasses import dataclass
+
+from skyfi_modelship.config import load_config
+
+from .metrics import STORAGE_BYTES
+
+if TYPE_CHECKING:
+    from google.cloud import storage
+
+    from .cache import InputCache
+
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def checksums(data: bytes) -> Dict[str, str]:
+    """ Returns the crc32c and md5_hash of data, encoded like the GCS object metadata. """
+
+    from .transfer import crc32c_hasher
+
+    result = {"md5_hash": base64.b64encode(hashlib.md5(data).digest()).decode()}
+    crc32c = crc32c_hasher()
+    if crc32c is not None:
+        crc32c.update(data)
+        result["crc32c"] = base64.b64encode(crc32c.digest()).decode()
+    return result
+
+
+@dataclass
+class ObjectInfo:
+    """
+    Metadata of a stored object.
+
+    size: size of the object in bytes
+    generation: version of the object, changes whenever the object is overwritten
+    crc32c: (Optional) base64 encoded big-endian crc32c of the object
+    md5_hash: (Optional) base64 encoded md5 of the object
+    """
+
+    size: int
+    generation: str
+    crc32c: Optional[str] = None
+    md5_hash: Optional[str] = None
+
+
+class CountingWriter:
+    """ File-like object counting the bytes written to file_obj. """
+
+    def __init__(self, file_obj: BinaryIO):
+        self.file_obj = file_obj
+        self.written = 0
+
+    def write(self, data: bytes) -> int:
+        self.file_obj.write(data)
+        self.written += len(data)
+        return len(data)
+
+
+class StorageBackend:
+    """
+    Base class for the storage backends.
+    A backend handles all urls of a scheme (gs://, file://, ...), see register_backend.
+    Backends are shared by all the requests of the process and must be thread safe.
+    """
+
+    # set by the backends implementing download_range and download_head
+    supports_ranges = False
+    # set by the backends implementing upload_part, compose and delete
+    supports_compose = False
+
+    def stat(self, url: str) -> ObjectInfo:
+        """ Returns the metadata of the object at url. """
+        raise NotImplementedError
+
+    def download(self, url: str, destination: str) -> None:
+        """ Download the object at url to the local destination file. """
+        raise NotImplementedError
+
+    def download_range(
+        self, url: str, start: int, end: int, file_obj: BinaryIO, generation: Optional[str] = None
+    ) -> None:
+        """
+        Stream the bytes [start, end) of the object at url to file_obj.write.
+        If given, the download fails when the object is not at the generation anymore.
+        """
+        raise NotImplementedError
+
+    def download_head(self, url: str, end: int, file_obj: BinaryIO) -> ObjectInfo:
+        """
+        Stream the bytes [0, end) of the object at url to file_obj.write, the whole object
+        if it's smaller, in a single request. Returns the metadata of the object learned
+        from that request, its size is only reliable when smaller than end.
+        """
+        raise NotImplementedError
+
+    def upload(self, path: str, url: str) -> None:
+        """ Upload the local file at path to url. """
+        raise NotImplementedError
+
+    def upload_part(self, path: str, start: int, end: int, url: str) -> None:
+        """ Upload the bytes [start, end) of the local file at path to url. """
+        raise NotImplementedError
+
+    def compose(self, part_urls: List[str], url: str) -> None:
+        """ Concatenate the objects at part_urls, in order, into the object at url. """
+        raise NotImplementedError
+
+    def delete(self, url: str) -> None:
+        """ Delete the object at url. """
+        raise NotImplementedError
+
+
+class GCSBackend(StorageBackend):
+    """
+    Google Cloud Storage backend for gs:// urls.
+    Holds a single long-lived client per process, so the credential discovery and the
+    HTTP connection pool are reused by all the transfers.
+    google-cloud-storage is imported with the first client, it's slow to import.
+    """
+
+    supports_ranges = True
+    supports_compose = True
+
+    def __init__(self):
+        self._client: Optional["storage.Client"] = None
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self) -> "storage.Client":
+        # clients can't be shared with forked processes, create one per process
+        if self._client is None or self._pid != os.getpid():
+            with self._lock:
+                if self._client is None or self._pid != os.getpid():
+                    self._client = self._create_client()
+                    self._pid = os.getpid()
+        return self._client
+
+    def _create_client(self) -> "storage.Client":
+        from google.cloud import storage
+        from requests.adapters import HTTPAdapter
+
+        config = load_config()
+        pool_size = max(config.download_workers, config.upload_workers, 10)
+        client = storage.Client()
+        # size the connection pool for the concurrent transfers
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        client._http.mount("https://", adapter)
+        return client
+
+    def blob(self, url: str) -> "storage.Blob":
+        from google.cloud import storage
+
+        return storage.Blob.from_string(url, client=self.client)
+
+    def stat(self, url: str) -> ObjectInfo:
+        blob = self.blob(url)
+        blob.reload()
+        return ObjectInfo(
+            size=blob.size, generation=str(blob.generation),
+            crc32c=blob.crc32c, md5_hash=blob.md5_hash,
+        )
+
+    def download(self, url: str, destination: str) -> None:
+        blob = self.blob(url)
+        blob.download_to_filename(destination)
+
+    def download_range(
+        self, url: str, start: int, end: int, file_obj: BinaryIO, generation: Optional[str] = None
+    ) -> None:
+        blob = self.blob(url)
+        blob.download_to_file(
+            file_obj, start=start, end=end - 1, raw_download=True, checksum=None,
+            if_generation_match=int(generation) if generation else None,
+        )
+
+    def download_head(self, url: str, end: int, file_obj: BinaryIO) -> ObjectInfo:
+        from google.api_core.exceptions import RequestRangeNotSatisfiable
+
+        blob = self.blob(url)
+        counter = CountingWriter(file_obj)
+        try:
+            blob.download_to_file(counter, start=0, end=end - 1, raw_download=True, checksum=None)
+        except RequestRangeNotSatisfiable:
+            # empty objects have no byte range
+            return self.stat(url)
+        # the generation and the hashes of the object come with the response headers
+        return ObjectInfo(
+            size=counter.written, generation=str(blob.generation),
+            crc32c=blob.crc32c, md5_hash=blob.md5_hash,
+        )
+
+    def upload(self, path: str, url: str) -> None:
+        blob = self.blob(url)
+        blob.upload_from_filename(path)
+
+    def upload_part(self, path: str, start: int, end: int, url: str) -> None:
+        blob = self.blob(url)
+        with open(path, "rb") as src_file:
+            src_file.seek(start)
+            blob.upload_from_file(src_file, size=end - start)
+
+    def compose(self, part_urls: List[str], url: str) -> None:
+        blob = self.blob(url)
+        blob.compose([self.blob(part) for part in part_urls])
+
+    def delete(self, url: str) -> None:
+        self.blob(url).delete()
+
+
+class LocalBackend(StorageBackend):
+    """ Local filesystem backend for file:// urls. """
+
+    supports_ranges = True
+    supports_compose = True
+
+    @staticmethod
+    def local_path(url: str) -> str:
+        parsed = urlparse(url)
+        return f"{parsed.netloc}{parsed.path}"
+
+    def stat(self, url: str) -> ObjectInfo:
+        stat = os.stat(self.local_path(url))
+        return ObjectInfo(size=stat.st_size, generation=f"{stat.st_mtime_ns}-{stat.st_ino}")
+
+    def download(self, url: str, destination: str) -> None:
+        shutil.copyfile(self.local_path(url), destination)
+
+    def download_range(
+        self, url: str, start: int, end: int, file_obj: BinaryIO, generation: Optional[str] = None
+    ) -> None:
+        with open(self.local_path(url), "rb") as src_file:
+            src_file.seek(start)
+            while start < end:
+                chunk = src_file.read(min(CHUNK_SIZE, end - start))
+                if not chunk:
+                    raise EOFError(f"Unexpected end of file: {url}")
+                file_obj.write(chunk)
+                start += len(chunk)
+
+    def download_head(self, url: str, end: int, file_obj: BinaryIO) -> ObjectInfo:
+        with open(self.local_path(url), "rb") as src_file:
+            stat = os.fstat(src_file.fileno())
+            remaining = min(end, stat.st_size)
+            while remaining:
+                chunk = src_file.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    raise EOFError(f"Unexpected end of file: {url}")
+                file_obj.write(chunk)
+                remaining -= len(chunk)
+        return ObjectInfo(size=stat.st_size, generation=f"{stat.st_mtime_ns}-{stat.st_ino}")
+
+    def upload(self, path: str, url: str) -> None:
+        dst = self.local_path(url)
+        Path(dst).parent.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(path, dst)
+
+    def upload_part(self, path: str, start: int, end: int, url: str) -> None:
+        dst = self.local_path(url)
+        Path(dst).parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "rb") as src_file, open(dst, "wb") as dst_file:
+            src_file.seek(start)
+            while start < end:
+                chunk = src_file.read(min(CHUNK_SIZE, end - start))
+                if not chunk:
+                    raise EOFError(f"Unexpected end of file: {path}")
+                dst_file.write(chunk)
+                start += len(chunk)
+
+    def compose(self, part_urls: List[str], url: str) -> None:
+        dst = self.local_path(url)
+        tmp_dst = f"{dst}.compose"
+        with open(tmp_dst, "wb") as dst_file:
+            for part in part_urls:
+                with open(self.local_path(part), "rb") as part_file:
+                    shutil.copyfileobj(part_file, dst_file, CHUNK_SIZE)
+        os.replace(tmp_dst, dst)
+
+    def delete(self, url: str) -> None:
+        os.remove(self.local_path(url))
+
+
+class MemoryBackend(StorageBackend):
+    """
+    In-memory backend for memory:// urls, used by tests and benchmarks to run
+    the pipeline offline.
+
+    latency: seconds added to every transfer
+    bandwidth: (Optional) bytes per second, adds the transfer time of the object
+    """
+
+    supports_ranges = True
+    supports_compose = True
+
+    def __init__(self, latency: float = 0.0, bandwidth: Optional[float] = None):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.objects: Dict[str, bytes] = {}
+        self.generations: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def put(self, url: str, data: bytes) -> None:
+        with self._lock:
+            self.objects[url] = data
+            self.generations[url] = self.generations.get(url, 0) + 1
+
+    def get(self, url: str) -> bytes:
+        with self._lock:
+            if url not in self.objects:
+                raise FileNotFoundError(f"No such object: {url}")
+            return self.objects[url]
+
+    def _simulate_transfer(self, size: int) -> None:
+        delay = self.latency
+        if self.bandwidth:
+            delay += size / self.bandwidth
+        if delay > 0:
+            time.sleep(delay)
+
+    def stat(self, url: str) -> ObjectInfo:
+        data = self.get(url)
+        self._simulate_transfer(0)
+        return ObjectInfo(
+            size=len(data), generation=str(self.generations[url]), **checksums(data)
+        )
+
+    def download(self, url: str, destination: str) -> None:
+        data = self.get(url)
+        self._simulate_transfer(len(data))
+        with open(destination, "wb") as dst_file:
+            dst_file.write(data)
+
+    def download_range(
+        self, url: str, start: int, end: int, file_obj: BinaryIO, generation: Optional[str] = None
+    ) -> None:
+        with self._lock:
+            if generation and str(self.generations.get(url)) != generation:
+                raise ValueError(f"Object generation changed: {url}")
+        data = self.get(url)
+        self._simulate_transfer(end - start)
+        for offset in range(start, end, CHUNK_SIZE):
+            file_obj.write(data[offset:min(offset + CHUNK_SIZE, end)])
+
+    def download_head(self, url: str, end: int, file_obj: BinaryIO) -> ObjectInfo:
+        with self._lock:
+            if url not in self.objects:
+                raise FileNotFoundError(f"No such object: {url}")
+            data, generation = self.objects[url], self.generations[url]
+        end = min(end, len(data))
+        self._simulate_transfer(end)
+        for offset in range(0, end, CHUNK_SIZE):
+            file_obj.write(data[offset:min(offset + CHUNK_SIZE, end)])
+        return ObjectInfo(size=len(data), generation=str(generation), **checksums(data))
+
+    def upload(self, path: str, url: str) -> None:
+        with open(path, "rb") as src_file:
+            data = src_file.read()
+        self._simulate_transfer(len(data))
+        self.put(url, data)
+
+    def upload_part(self, path: str, start: int, end: int, url: str) -> None:
+        with open(path, "rb") as src_file:
+            src_file.seek(start)
+            data = src_file.read(end - start)
+        self._simulate_transfer(len(data))
+        self.put(url, data)
+
+    def compose(self, part_urls: List[str], url: str) -> None:
+        self._simulate_transfer(0)
+        self.put(url, b"".join(self.get(part) for part in part_urls))
+
+    def delete(self, url: str) -> None:
+        with self._lock:
+            self.objects.pop(url, None)
+            self.generations.pop(url, None)
+
+
+# only gs:// by default: the file:// and memory:// backends would let a caller write its
+# outputs to any local folder or to the memory of the process, they are registered
+# explicitly, e.g. by the tests and benchmarks
+_backends: Dict[str, StorageBackend] = {
+    "gs": GCSBackend(),
+}
+
+
+def register_backend(
+    scheme: str, backend: Optional[StorageBackend]
+) -> Optional[StorageBackend]:
+    """
+    Register the backend for the urls with the given scheme, e.g. "file", or unregister
+    the scheme with None. Returns the backend registered before, if any, to restore it.
+    """
+
+    previous = _backends.pop(scheme, None)
+    if backend is not None:
+        _backends[scheme] = backend
+    return previous
+
+
+def get_backend(url: str) -> StorageBackend:
+    """ Returns the backend registered for the scheme of the url. """
+
+    scheme = urlparse(url).scheme
+    if scheme not in _backends:
+        raise ValueError(f"No storage backend registered for: {url}")
+    return _backends[scheme]
+
+
+def is_remote(path: str) -> bool:
+    """ Returns True if the path is an url handled by one of the storage backends. """
+
+    return urlparse(path).scheme in _backends
+
+
+@lru_cache
+def get_input_cache() -> Optional["InputCache"]:
+    """ Returns the local input cache, if enabled with SKYFI_INPUT_CACHE_DIR. """
+
+    from .cache import InputCache
+
+    config = load_config()
+    if not config.input_cache_dir:
+        return None
+    return InputCache(config.input_cache_dir, config.input_cache_max_bytes)
+
+
+def download_object(
+    backend: StorageBackend, url: str, info: Optional[ObjectInfo], destination: str
+) -> None:
+    """
+    Download the object at url to destination, objects larger than the
+    SKYFI_DOWNLOAD_SLICE_THRESHOLD are downloaded in parallel slices.
+    Without the info of the object, its size is learned from the first slice, see
+    probed_download, so that small objects take a single request.
+    """
+
+    config = load_config()
+    if not backend.supports_ranges or not config.download_slice_threshold:
+        backend.download(url, destination)
+    elif info is None:
+        from .transfer import probed_download
+
+        probed_download(backend, url, destination)
+    elif info.size >= config.download_slice_threshold:
+        from .transfer import sliced_download
+
+        sliced_download(backend, url, info, destination)
+    else:
+        backend.download(url, destination)
+    STORAGE_BYTES.inc(os.path.getsize(destination), direction="download")
 
 
 def download(path: str, folder: str) -> str:
-    """ Download a file from a GCS bucket to a local folder. """
+    """ Download a file from the storage backend to a local folder. """
 
-    storage_client = storage.Client()
     try:
+        backend = get_backend(path)
         Path(folder).mkdir(parents=True, exist_ok=True)
         filename = os.path.basename(path)
         destination = f"{folder}/{filename}"
-        blob = storage.Blob.from_string(path, client=storage_client)
+        cache = get_input_cache()
+        if cache is not None:
+            # the generation of the object is part of the cache key
+            info = backend.stat(path)
+            cache.fetch(path, info, destination, partial(download_object, backend, path, info))
+            return destination
+
         logger.info("Downloading file... {path} to {destination}",
                     path=path, destination=destination)
-        blob.download_to_filename(destination)
+        download_object(backend, path, None, destination)
         return destination
     except Exception as ex:
         raise ValueError(f"Error downloading file: {path}: {ex}")
 
 
+def upload_object(backend: StorageBackend, path: str, url: str) -> None:
+    """
+    Upload the local file at path to url, files larger than the
+    SKYFI_UPLOAD_CHUNK_THRESHOLD are uploaded in parallel parts composed by the backend.
+    """
+
+    config = load_config()
+    if backend.supports_compose and config.upload_chunk_threshold and \
+            os.path.getsize(path) >= config.upload_chunk_threshold:
+        from .transfer import chunked_upload
+
+        chunked_upload(backend, path, url)
+    else:
+        backend.upload(path, url)
+    STORAGE_BYTES.inc(os.path.getsize(path), direction="upload")
+
+
 def upload(path: str, folder: str,
            func_name: str, name: Optional[str], ref_name: Optional[str]) -> str:
-    """ Upload a file from a local folder to a GCS bucket. """
+    """ Upload a file from a local folder to the storage backend. """
 
-    storage_client = storage.Client()
     try:
+        backend = get_backend(folder)
         dst_path = Path(path)
 
         # Add function name to the file name
@@ -45,8 +524,7 @@ def upload(path: str, folder: str,
         # upload the file
         logger.info("Uploading file... {path} to {dst}",
                     path=path, dst=dst)
-        blob = storage.Blob.from_string(dst, client=storage_client)
-        blob.upload_from_filename(path)
+        upload_object(backend, path, dst)
         return dst
     except Exception as ex:
         raise ValueError(f"Error uploading file: {path}: {ex}")
@@ -60,11 +538,11 @@ def local_folder(*args) -> str:
     return f"{tempdir}/{folder}"
 
 
-def save_local_file(request_id: UUID, field, name: str, content: str) -> str:
+def save_local_file(request_id: UUID, field, name: str, content: Union[str, bytes]) -> str:
     folder = local_folder(request_id, field)
     asset_path = f"{folder}/{name}.json"
     os.makedirs(folder, exist_ok=True)
-    with open(asset_path, "w") as geojson_file:
+    with open(asset_path, "wb" if isinstance(content, bytes) else "w") as geojson_file:
         geojson_file.write(content)
 
     return asset_path
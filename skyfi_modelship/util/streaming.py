@@ -0,0 +1,156 @@
+from concurrent.futures import ThreadPoolExecutor, wait
+import inspect
+import queue
+import threading
+from typing import Any, Callable, Iterator, List
+
+from skyfi_modelship.config import load_config
+
+from .aio import run_coroutine
+from .execution import InferenceResponse, cleanup
+from .inference_request import InferenceRequest, download_inputs
+from .model_transformer import upload_assets
+from .timing import timed
+
+# returned by OutputStream.next_output once all the outputs were returned
+DONE = object()
+
+
+def is_streaming(func: Callable) -> bool:
+    """ Returns True if the inference function is a generator yielding its outputs. """
+
+    return inspect.isgeneratorfunction(func) or inspect.isasyncgenfunction(func)
+
+
+class OutputStream:
+    """
+    Runs a generator inference function on a thread. Every yielded output is uploaded
+    right away by a background uploader, while the generator goes on with the next one.
+    At most 2 x upload_workers outputs wait for their upload, then the generator waits.
+
+    Iterating the stream returns the uploaded outputs in the order they were yielded,
+    and raises the error of the inference function or of an upload.
+
+    With download, the thread downloads the inputs of the request first,
+    so that close stops the whole request.
+    """
+
+    def __init__(self, func: Callable, r: InferenceRequest, download: bool = False):
+        self.func = func
+        self.r = r
+        self.download = download
+        self.closed = False
+        self.timings = dict(r.timings)
+        workers = load_config().upload_workers
+        self.uploader = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="skyfi-stream-upload"
+        )
+        self.slots = threading.BoundedSemaphore(2 * workers)
+        self.failed = threading.Event()
+        self.items: "queue.Queue[Any]" = queue.Queue()
+        self.thread = threading.Thread(
+            target=self.produce, name=f"skyfi-stream-{func.__name__}", daemon=True
+        )
+        self.thread.start()
+
+    def outputs(self) -> Iterator[Any]:
+        if inspect.isasyncgenfunction(self.func):
+            generator = self.func(**vars(self.r.kwargs))
+            try:
+                while True:
+                    try:
+                        yield run_coroutine(generator.__anext__())
+                    except StopAsyncIteration:
+                        return
+            finally:
+                run_coroutine(generator.aclose())
+        else:
+            yield from self.func(**vars(self.r.kwargs))
+
+    def upload(self, output: Any) -> Any:
+        try:
+            upload_assets(output, self.r.output_folder, self.func.__name__, self.r.request_id)
+            return output
+        except BaseException:
+            self.failed.set()
+            raise
+        finally:
+            self.slots.release()
+
+    def produce(self) -> None:
+        futures = []
+        outputs = self.outputs()
+        try:
+            if self.download:
+                download_inputs(self.r, self.func)
+                self.timings.update(self.r.timings)
+            with timed(self.timings, "inference", self.func.__name__):
+                for output in outputs:
+                    self.slots.acquire()
+                    if self.failed.is_set():
+                        self.slots.release()
+                        break
+                    future = self.uploader.submit(self.upload, output)
+                    futures.append(future)
+                    self.items.put(future)
+            # the uploads still running once the generator is done
+            with timed(self.timings, "upload", self.func.__name__):
+                wait(futures)
+        except Exception as ex:
+            self.items.put(ex)
+        finally:
+            outputs.close()
+            self.uploader.shutdown(wait=False)
+            self.items.put(DONE)
+
+    def next_output(self) -> Any:
+        """ Returns the next uploaded output, waiting for it, or DONE. """
+
+        item = self.items.get()
+        if item is DONE:
+            self.items.put(DONE)
+            return item
+        if isinstance(item, BaseException):
+            raise item
+        return item.result()
+
+    def __iter__(self) -> Iterator[Any]:
+        while True:
+            output = self.next_output()
+            if output is DONE:
+                return
+            yield output
+
+    def close(self) -> None:
+        """
+        Stops the generator after its current output, e.g. once the client went away,
+        and cleans up the local folder once the thread stopped. No-op after response.
+        """
+
+        if self.closed:
+            return
+        self.closed = True
+        self.failed.set()
+
+        def cleanup_stopped():
+            self.thread.join()
+            cleanup(self.r)
+
+        threading.Thread(
+            target=cleanup_stopped, name=f"skyfi-stream-close-{self.func.__name__}", daemon=True
+        ).start()
+
+    def response(self, outputs: List[Any]) -> InferenceResponse:
+        """ Cleans up the local folder, returns the response aggregating the outputs. """
+
+        from .result_cache import save_result
+
+        self.closed = True
+        with timed(self.timings, "cleanup", self.func.__name__):
+            cleanup(self.r)
+        result = InferenceResponse(
+            request_id=self.r.request_id, output_folder=self.r.output_folder,
+            response=outputs, timings=self.timings,
+        )
+        save_result(self.r, result)
+        return result
@@ -0,0 +1,35 @@
+from contextlib import contextmanager
+import time
+from typing import Dict, Iterator, List, Optional
+
+from .metrics import STAGE_DURATION, STAGE_ERRORS
+
+
+@contextmanager
+def timed(
+    timings: Dict[str, float], stage: str, func_name: Optional[str] = None
+) -> Iterator[None]:
+    """
+    Records the wall time of the block, in seconds, as timings[stage].
+    If func_name is given, the duration and the errors of the stage are also
+    recorded in the stage metrics of the function.
+    """
+
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        if func_name is not None:
+            STAGE_ERRORS.inc(stage=stage, function=func_name)
+        raise
+    finally:
+        timings[stage] = time.perf_counter() - start
+        if func_name is not None:
+            STAGE_DURATION.observe(timings[stage], stage=stage, function=func_name)
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """ Nearest rank percentile of the sorted values. """
+
+    rank = max(1, round(pct / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
@@ -0,0 +1,264 @@
+import base64
+import hashlib
+import os
+import threading
+from typing import Any, List, Optional, Tuple
+import uuid
+
+from loguru import logger
+
+from skyfi_modelship.config import load_config
+
+from .parallel import run_parallel
+from .storage import CHUNK_SIZE, ObjectInfo, StorageBackend
+
+
+def crc32c_hasher() -> Optional[Any]:
+    """ Returns a crc32c hasher, None if google-crc32c is not installed. """
+
+    try:
+        import google_crc32c
+    except ImportError:
+        return None
+    return google_crc32c.Checksum()
+
+
+class RangeWriter:
+    """
+    File-like object writing a byte range of the destination file at its offset.
+    Tracks how many bytes were written, so a failed range can be resumed.
+    """
+
+    def __init__(self, fd: int, start: int, end: int):
+        self.fd = fd
+        self.start = start
+        self.end = end
+        self.written = 0
+
+    @property
+    def offset(self) -> int:
+        return self.start + self.written
+
+    def write(self, data: bytes) -> int:
+        if self.offset + len(data) > self.end:
+            raise ValueError(f"Range overflow at {self.offset} writing {len(data)} bytes")
+        view = memoryview(data)
+        while view:
+            count = os.pwrite(self.fd, view, self.offset)
+            self.written += count
+            view = view[count:]
+        return len(data)
+
+
+class StreamingChecksum:
+    """
+    Computes the checksum of the destination file while the ranges complete.
+    The ranges complete out of order, so every completed range that extends the
+    verified prefix is hashed right away, while it is still in the page cache.
+    """
+
+    def __init__(self, fd: int, ranges: List[Tuple[int, int]], info: ObjectInfo):
+        self.fd = fd
+        self.ranges = ranges
+        self.info = info
+        self.crc32c = crc32c_hasher() if info.crc32c else None
+        self.md5 = hashlib.md5() if info.md5_hash and self.crc32c is None else None
+        self._done = set()
+        self._next = 0
+        self._hashing = False
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.crc32c is not None or self.md5 is not None
+
+    def range_done(self, idx: int) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            self._done.add(idx)
+            if self._hashing:
+                # the thread hashing the prefix will pick this range up
+                return
+            self._hashing = True
+
+        while True:
+            with self._lock:
+                if self._next not in self._done:
+                    self._hashing = False
+                    return
+                start, end = self.ranges[self._next]
+                self._next += 1
+            self._hash(start, end)
+
+    def _hash(self, start: int, end: int) -> None:
+        for offset in range(start, end, CHUNK_SIZE):
+            chunk = os.pread(self.fd, min(CHUNK_SIZE, end - offset), offset)
+            if self.crc32c is not None:
+                self.crc32c.update(chunk)
+            if self.md5 is not None:
+                self.md5.update(chunk)
+
+    def verify(self, url: str) -> None:
+        if not self.enabled:
+            logger.warning("No checksum available, skipping verification: {url}", url=url)
+            return
+        if self._next != len(self.ranges):
+            raise ValueError(f"Checksum incomplete for {url}")
+        if self.crc32c is not None:
+            expected, actual = self.info.crc32c, base64.b64encode(self.crc32c.digest()).decode()
+        else:
+            expected, actual = self.info.md5_hash, base64.b64encode(self.md5.digest()).decode()
+        if expected != actual:
+            raise ValueError(f"Checksum mismatch for {url}: expected {expected}, got {actual}")
+
+
+def slice_ranges(size: int, slice_size: int) -> List[Tuple[int, int]]:
+    """ Splits [0, size) in [start, end) ranges of at most slice_size bytes. """
+
+    return [(start, min(start + slice_size, size)) for start in range(0, size, slice_size)]
+
+
+def probed_download(backend: StorageBackend, url: str, destination: str) -> None:
+    """
+    Downloads the first SKYFI_DOWNLOAD_SLICE_SIZE bytes of the object at url, which is
+    the whole object for most inputs, without a stat request. The larger objects are
+    completed by sliced_download, in parallel slices if they reach the
+    SKYFI_DOWNLOAD_SLICE_THRESHOLD, in a single range otherwise.
+    """
+
+    config = load_config()
+    head_size = min(config.download_slice_size, config.download_slice_threshold)
+    fd = os.open(destination, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        writer = RangeWriter(fd, 0, head_size)
+        head = backend.download_head(url, head_size, writer)
+    except BaseException:
+        os.close(fd)
+        os.remove(destination)
+        raise
+    os.close(fd)
+
+    if writer.written < head_size:
+        if head.crc32c or head.md5_hash:
+            verify_file(destination, head, url)
+        return
+
+    info = backend.stat(url)
+    written = writer.written if info.generation == head.generation else 0
+    slice_size = config.download_slice_size if info.size >= config.download_slice_threshold \
+        else max(info.size, 1)
+    sliced_download(backend, url, info, destination, head=written, slice_size=slice_size)
+
+
+def verify_file(path: str, info: ObjectInfo, url: str) -> None:
+    """ Verifies the checksum of the local file at path against the object info. """
+
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        checksum = StreamingChecksum(fd, [(0, os.fstat(fd).st_size)], info)
+        checksum.range_done(0)
+        checksum.verify(url)
+    finally:
+        os.close(fd)
+
+
+def sliced_download(
+    backend: StorageBackend, url: str, info: ObjectInfo, destination: str,
+    head: int = 0, slice_size: Optional[int] = None,
+) -> None:
+    """
+    Downloads the object at url in parallel byte ranges into a preallocated destination.
+    The checksum is verified while the ranges complete and a failed range is resumed
+    from its last written byte, up to SKYFI_DOWNLOAD_SLICE_ATTEMPTS times.
+
+    head: bytes already in destination, downloaded by probed_download
+    slice_size: (Optional) bytes per range, SKYFI_DOWNLOAD_SLICE_SIZE by default
+    """
+
+    config = load_config()
+    ranges = slice_ranges(info.size, slice_size or config.download_slice_size)
+    logger.info("Downloading file in {count} slices... {url} to {destination}",
+                count=len(ranges), url=url, destination=destination)
+
+    flags = os.O_RDWR | os.O_CREAT | (0 if head else os.O_TRUNC)
+    fd = os.open(destination, flags, 0o644)
+    try:
+        # preallocate the file, so the slices are written in place
+        if hasattr(os, "posix_fallocate") and info.size:
+            os.posix_fallocate(fd, 0, info.size)
+        else:
+            os.ftruncate(fd, info.size)
+
+        checksum = StreamingChecksum(fd, ranges, info)
+
+        def download_slice(idx: int) -> None:
+            start, end = ranges[idx]
+            writer = RangeWriter(fd, start, end)
+            # the part of the range already downloaded by probed_download
+            writer.written = max(0, min(head, end) - start)
+            for attempt in range(1, config.download_slice_attempts + 1):
+                if writer.offset == end:
+                    break
+                try:
+                    backend.download_range(url, writer.offset, end, writer, info.generation)
+                    if writer.offset != end:
+                        raise EOFError(f"Short read, got {writer.offset - start} bytes")
+                    break
+                except Exception as ex:
+                    if attempt == config.download_slice_attempts:
+                        raise
+                    logger.warning(
+                        "Resuming slice {idx} of {url} at byte {offset}: {ex}",
+                        idx=idx, url=url, offset=writer.offset, ex=ex,
+                    )
+            checksum.range_done(idx)
+
+        run_parallel(
+            [(f"{url}[{start}:{end}]", lambda idx=idx: download_slice(idx))
+             for idx, (start, end) in enumerate(ranges)],
+            config.download_slice_workers,
+        )
+        checksum.verify(url)
+    except BaseException:
+        os.close(fd)
+        os.remove(destination)
+        raise
+    os.close(fd)
+
+
+# maximum number of objects composed by a single GCS compose request
+MAX_COMPOSE_PARTS = 32
+
+
+def chunked_upload(backend: StorageBackend, path: str, url: str) -> None:
+    """
+    Uploads the local file at path to url in parts of SKYFI_UPLOAD_CHUNK_SIZE bytes,
+    on SKYFI_UPLOAD_CHUNK_WORKERS threads. The parts are composed into the object at
+    url by the backend and deleted afterwards.
+    """
+
+    config = load_config()
+    size = os.path.getsize(path)
+    # grow the parts, so that a single compose request is enough
+    part_size = max(config.upload_chunk_size, -(-size // MAX_COMPOSE_PARTS))
+    ranges = slice_ranges(size, part_size)
+    token = uuid.uuid4().hex
+    part_urls = [f"{url}.{token}.part{idx:02d}" for idx in range(len(ranges))]
+    logger.info("Uploading file in {count} parts... {path} to {url}",
+                count=len(ranges), path=path, url=url)
+
+    try:
+        run_parallel(
+            [(part_url, lambda part_url=part_url, start=start, end=end:
+              backend.upload_part(path, start, end, part_url))
+             for part_url, (start, end) in zip(part_urls, ranges)],
+            config.upload_chunk_workers,
+        )
+        backend.compose(part_urls, url)
+    finally:
+        for part_url in part_urls:
+            try:
+                backend.delete(part_url)
+            except Exception as ex:
+                logger.warning("Error deleting upload part {url}: {ex}", url=part_url, ex=ex)
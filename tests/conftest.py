@@ -2,9 +2,46 @@ import pytest
 
 import skyfi_modelship as skyfi
 
+from .fakes import FakeChannel
+
 
 @pytest.fixture
 def tiff_image():
     return skyfi.GeoTIFF(
         path="./tests/data/tmp.tif",
     )
+
+
+@pytest.fixture
+def file_backend():
+    """ Registers the file:// backend, which isn't registered by default. """
+
+    from skyfi_modelship.util.storage import LocalBackend, register_backend
+
+    previous = register_backend("file", LocalBackend())
+    yield
+    register_backend("file", previous)
+
+
+@pytest.fixture
+def fake_channel():
+    return FakeChannel()
+
+
+@pytest.fixture
+def http_request():
+    """ Builds a starlette Request posting the body, for calling FastAPI handlers directly. """
+
+    from starlette.requests import Request
+
+    def make_request(body: bytes, method: str = "POST", path: str = "/", headers=None):
+        async def receive():
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        headers = [(key.lower().encode(), value.encode())
+                   for key, value in (headers or {}).items()]
+        scope = {"type": "http", "method": method, "path": path, "headers": headers,
+                 "query_string": b""}
+        return Request(scope, receive)
+
+    return make_request
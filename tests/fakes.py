@@ -0,0 +1,16 @@
+class FakeChannel:
+    """ Records the calls a RabbitMQHandler makes on a pika channel. """
+
+    def __init__(self):
+        self.published = []
+        self.acked = []
+        self.rejected = []
+
+    def basic_publish(self, exchange, routing_key, body, properties=None):
+        self.published.append((exchange, routing_key, body, properties))
+
+    def basic_ack(self, delivery_tag):
+        self.acked.append(delivery_tag)
+
+    def basic_reject(self, delivery_tag, requeue):
+        self.rejected.append((delivery_tag, requeue))
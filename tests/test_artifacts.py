@@ -0,0 +1,85 @@
+import hashlib
+import mmap
+import os
+
+import pytest
+
+import skyfi_modelship as skyfi
+from skyfi_modelship.util.artifacts import ArtifactCache
+from skyfi_modelship.util.storage import MemoryBackend, register_backend
+
+WEIGHTS = b"model weights" * 100
+WEIGHTS_SHA256 = hashlib.sha256(WEIGHTS).hexdigest()
+
+
+class CountingBackend(MemoryBackend):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.downloads = 0
+        self.stats = 0
+
+    def stat(self, url):
+        self.stats += 1
+        return super().stat(url)
+
+    def download(self, url, destination):
+        self.downloads += 1
+        super().download(url, destination)
+
+
+@pytest.fixture
+def backend():
+    backend = CountingBackend()
+    previous = register_backend("memory", backend)
+    backend.put("memory://models/weights.bin", WEIGHTS)
+    yield backend
+    register_backend("memory", previous)
+
+
+def test_artifact_downloaded_once(backend, tmp_path):
+    url = "memory://models/weights.bin"
+    path = ArtifactCache(str(tmp_path)).fetch(url, sha256=WEIGHTS_SHA256)
+
+    # a restarted process finds the verified copy without contacting the storage
+    stats = backend.stats
+    assert ArtifactCache(str(tmp_path)).fetch(url, sha256=WEIGHTS_SHA256) == path
+    assert backend.downloads == 1
+    assert backend.stats == stats
+    assert path.endswith("_weights.bin")
+    assert not os.access(path, os.W_OK) or os.geteuid() == 0
+    with open(path, "rb") as f:
+        assert f.read() == WEIGHTS
+
+
+def test_artifact_keyed_by_generation(backend, tmp_path):
+    url = "memory://models/weights.bin"
+    cache = ArtifactCache(str(tmp_path))
+    first = cache.fetch(url)
+    assert cache.fetch(url) == first
+
+    backend.put(url, b"new weights")
+    second = cache.fetch(url)
+    assert second != first
+    assert backend.downloads == 2
+
+
+def test_artifact_checksum_mismatch(backend, tmp_path):
+    cache = ArtifactCache(str(tmp_path))
+    with pytest.raises(ValueError, match="Checksum mismatch"):
+        cache.fetch("memory://models/weights.bin", sha256="0" * 64)
+    assert os.listdir(cache.objects_dir) == []
+    assert os.listdir(cache.tmp_dir) == []
+
+
+def test_app_artifact_mmap(backend, tmp_path, mocker):
+    mocker.patch("skyfi_modelship.util.artifacts.get_artifact_cache",
+                 return_value=ArtifactCache(str(tmp_path)))
+
+    weights = skyfi.SkyfiApp().artifact(
+        "memory://models/weights.bin", sha256=WEIGHTS_SHA256, mmap=True
+    )
+
+    assert isinstance(weights, mmap.mmap)
+    assert weights[:13] == b"model weights"
+    with pytest.raises(TypeError):
+        weights[0] = 0
@@ -0,0 +1,171 @@
+import asyncio
+import threading
+import time
+from unittest.mock import patch
+import uuid
+
+import orjson
+import pika
+
+import skyfi_modelship as skyfi
+from skyfi_modelship.config import SkyfiConfig, load_config
+from skyfi_modelship.handler.fastapi_handler import FastApiHandler
+from skyfi_modelship.handler.rabbitmq_handler import RabbitMQHandler
+from skyfi_modelship.loadtest import LocalBroker
+from skyfi_modelship.util.aio import is_async
+from skyfi_modelship.util.batching import min_concurrency
+from skyfi_modelship.util.execution import run_request
+
+CONCURRENT = 4
+in_flight = 0
+peak = 0
+
+
+async def overlapping_inference(num: skyfi.float) -> skyfi.FloatOutput:
+    # waits for CONCURRENT requests in flight, only possible if their awaits overlap
+    global in_flight, peak
+    in_flight += 1
+    peak = max(peak, in_flight)
+    deadline = time.monotonic() + 5
+    while peak < CONCURRENT and time.monotonic() < deadline:
+        await asyncio.sleep(0.01)
+    in_flight -= 1
+    return skyfi.FloatOutput(value=num * 2, name="output_num")
+
+
+def reset():
+    global in_flight, peak
+    in_flight = peak = 0
+
+
+def body(**kwargs) -> bytes:
+    return orjson.dumps({"request_id": str(uuid.uuid4())} | kwargs)
+
+
+def make_handler(**config) -> FastApiHandler:
+    with patch("skyfi_modelship.handler.fastapi_handler.load_config",
+               return_value=SkyfiConfig(**config)):
+        return FastApiHandler()
+
+
+def test_fastapi_awaits_async_inference(http_request):
+    reset()
+    # a single executor worker, the async requests don't need one
+    handler = make_handler(fastapi_workers=1, fastapi_queue_size=CONCURRENT)
+    post = handler.handle(overlapping_inference)
+
+    async def scenario():
+        return await asyncio.gather(*[
+            post(http_request(body(num=idx))) for idx in range(CONCURRENT)
+        ])
+
+    responses = asyncio.run(scenario())
+
+    assert peak == CONCURRENT
+    assert [response.response.value for response in responses] == [0, 2, 4, 6]
+    assert {"parse", "validation", "download", "inference", "upload", "cleanup"} == \
+        set(responses[0].timings)
+
+
+def test_fastapi_async_job(http_request):
+    reset()
+    handler = make_handler()
+    submit = handler.submit_job(overlapping_inference)
+
+    async def scenario():
+        accepted = await asyncio.gather(*[
+            submit(http_request(body(num=idx))) for idx in range(CONCURRENT)
+        ])
+        await asyncio.gather(*handler.job_tasks)
+        return [await handler.get_job(job.request_id) for job in accepted]
+
+    jobs = asyncio.run(scenario())
+
+    assert [job.status for job in jobs] == ["succeeded"] * CONCURRENT
+    assert jobs[1].response.response.value == 2
+
+
+async def hanging_inference(num: skyfi.float) -> skyfi.FloatOutput:
+    await asyncio.sleep(60)
+
+
+def test_fastapi_cancelled_async_job(http_request):
+    handler = make_handler()
+    submit = handler.submit_job(hanging_inference)
+
+    async def scenario():
+        accepted = await submit(http_request(body(num=1)))
+        await asyncio.sleep(0.05)
+        for task in asyncio.all_tasks():
+            if task is not asyncio.current_task() and task not in handler.job_tasks:
+                task.cancel()
+        await asyncio.wait_for(asyncio.gather(*handler.job_tasks), timeout=5)
+        return await handler.get_job(accepted.request_id)
+
+    job = asyncio.run(scenario())
+
+    assert job.status == "failed"
+    assert job.error.startswith("CancelledError")
+    # the admission slot is released
+    assert handler.pending == 0
+
+
+def test_sync_caller_runs_async_inference():
+    reset()
+    threads = [
+        threading.Thread(target=run_request, args=(overlapping_inference, {
+            "request_id": str(uuid.uuid4()), "num": idx,
+        }))
+        for idx in range(CONCURRENT)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=10)
+
+    # the worker threads share the event loop of the process
+    assert peak == CONCURRENT
+
+
+def test_rabbitmq_keeps_async_requests_in_flight(monkeypatch):
+    reset()
+    monkeypatch.setenv("SKYFI_RABBITMQ_REQ_QUEUE", "requests")
+    monkeypatch.setenv("SKYFI_RABBITMQ_RESP_QUEUE", "responses")
+    monkeypatch.setenv("SKYFI_METRICS_PORT", "0")
+    monkeypatch.setenv("SKYFI_ASYNC_CONCURRENCY", str(CONCURRENT))
+    load_config.cache_clear()
+    broker = LocalBroker()
+    try:
+        assert min_concurrency(overlapping_inference) == CONCURRENT
+        handler = RabbitMQHandler(min_workers=min_concurrency(overlapping_inference),
+                                  connection_factory=broker.connect)
+        listener = threading.Thread(target=handler.listen, args=(overlapping_inference,))
+        listener.start()
+        for idx in range(CONCURRENT):
+            broker.publish("requests", body(num=idx), pika.BasicProperties())
+        responses = [orjson.loads(broker.get("responses", timeout=10)[0])
+                     for _ in range(CONCURRENT)]
+    finally:
+        broker.close()
+        load_config.cache_clear()
+    listener.join(timeout=5)
+
+    assert peak == CONCURRENT
+    assert sorted(response["response"]["value"] for response in responses) == [0, 2, 4, 6]
+
+
+class AsyncModel:
+    async def __call__(self, num: skyfi.float) -> skyfi.FloatOutput:
+        return skyfi.FloatOutput(value=num * 2, name="output_num")
+
+
+class SyncModel:
+    def __call__(self, num: skyfi.float) -> skyfi.FloatOutput:
+        return skyfi.FloatOutput(value=num * 2, name="output_num")
+
+
+def test_is_async_callable_objects():
+    assert is_async(overlapping_inference)
+    assert is_async(AsyncModel())
+    assert not is_async(SyncModel())
+    assert not is_async(reset)
@@ -0,0 +1,98 @@
+from concurrent.futures import ThreadPoolExecutor
+import pickle
+from typing import List, TypedDict
+from unittest.mock import patch
+import uuid
+
+import pytest
+
+import skyfi_modelship as skyfi
+from skyfi_modelship.config import SkyfiConfig
+from skyfi_modelship.handler.fastapi_handler import FastApiHandler
+from skyfi_modelship.util.batching import BatchFunction
+from skyfi_modelship.util.execution import run_request
+
+
+class Item(TypedDict):
+    num: skyfi.float
+
+
+def batch_triple(items: List[Item]) -> List[skyfi.FloatOutput]:
+    return [skyfi.FloatOutput(value=item["num"] * 3, name="output_num") for item in items]
+
+
+def make_batch_function(batches: List[int]):
+    app = skyfi.SkyfiApp()
+
+    @app.batch_inference(max_batch_size=4, max_wait=1.0)
+    def batch_double(items: List[Item]) -> List[skyfi.FloatOutput]:
+        batches.append(len(items))
+        if any(item["num"] < 0 for item in items):
+            raise ValueError("negative input")
+        return [skyfi.FloatOutput(value=item["num"] * 2, name="output_num") for item in items]
+
+    return app.inference_func
+
+
+def run_concurrently(func, nums):
+    with ThreadPoolExecutor(max_workers=len(nums)) as executor:
+        futures = [
+            executor.submit(run_request, func, {"request_id": str(uuid.uuid4()), "num": num})
+            for num in nums
+        ]
+    return futures
+
+
+def test_requests_are_batched():
+    batches = []
+    func = make_batch_function(batches)
+
+    futures = run_concurrently(func, [1, 2, 3, 4])
+
+    assert batches == [4]
+    assert [future.result().response.value for future in futures] == [2, 4, 6, 8]
+
+
+def test_batch_error_isolation():
+    batches = []
+    func = make_batch_function(batches)
+
+    futures = run_concurrently(func, [1, -1, 3, 4])
+
+    # the failed batch is retried one request at a time
+    assert batches == [4, 1, 1, 1, 1]
+    assert futures[0].result().response.value == 2
+    with pytest.raises(ValueError, match="negative input"):
+        futures[1].result()
+    assert futures[3].result().response.value == 8
+
+
+def test_batch_signature():
+    func = make_batch_function([])
+    assert func.__name__ == "batch_double"
+    assert list(func.__signature__.parameters) == ["num"]
+    assert func.__signature__.return_annotation is skyfi.FloatOutput
+
+    with pytest.raises(ValueError, match="List\\[TypedDict\\]"):
+        skyfi.SkyfiApp().batch_inference()(lambda num: num)
+
+
+def test_batch_function_pickles():
+    func = BatchFunction(batch_triple, max_batch_size=2, max_wait=0.0)
+    assert func(num=1.0).value == 3
+
+    copy = pickle.loads(pickle.dumps(func))
+
+    assert copy(num=2.0).value == 6
+    assert copy.batcher is not func.batcher
+
+
+def test_process_executor_is_rejected():
+    with patch("skyfi_modelship.handler.fastapi_handler.load_config",
+               return_value=SkyfiConfig(fastapi_executor="process")):
+        handler = FastApiHandler()
+    try:
+        with pytest.raises(ValueError, match="process executor"):
+            handler.create_app(make_batch_function([]))
+    finally:
+        handler.executor.shutdown()
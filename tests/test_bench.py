@@ -0,0 +1,65 @@
+import json
+import subprocess
+import sys
+
+from skyfi_modelship import bench
+from skyfi_modelship.bench.runner import Benchmark, compare, run_benchmark
+from skyfi_modelship.bench.scenarios import BENCHMARKS
+from skyfi_modelship.util import storage
+from skyfi_modelship.util.timing import percentile
+
+
+def test_percentile():
+    values = [float(v) for v in range(1, 101)]
+    assert percentile(values, 50) == 50
+    assert percentile(values, 99) == 99
+    assert percentile([3.0], 99) == 3
+
+
+def test_run_benchmark():
+    results = []
+    result = run_benchmark(
+        Benchmark(name="noop", setup=lambda: lambda: 1, teardown=results.append), iterations=5
+    )
+    assert result.iterations == 5
+    assert results == [1] * 6
+    assert result.p50_ms <= result.p99_ms
+    assert compare([result], {"noop": {"p50_ms": result.p50_ms / 10}}, threshold=0.1)
+    assert not compare([result], {"noop": {"p50_ms": result.p50_ms}}, threshold=0.1)
+
+
+def test_scenarios_are_cleaned_up():
+    benchmark = next(b for b in BENCHMARKS if b.name == "handler.fastapi.scalar")
+
+    run_benchmark(benchmark, iterations=1)
+
+    # memory:// isn't registered by default
+    assert not storage.is_remote("memory://bench/output")
+
+
+def main(args) -> int:
+    # the CLI configures the logging of the process, run it in a process of its own
+    # exits with 1 on a regression
+    return subprocess.run(
+        [sys.executable, "-m", "skyfi_modelship.bench", *args], check=False
+    ).returncode
+
+
+def test_bench_cli(tmp_path):
+    output = tmp_path / "results.json"
+    args = ["-k", "convert_request.scalar", "--iterations", "3"]
+    assert main(args + ["--output", str(output)]) == 0
+
+    results = json.loads(output.read_text())["results"]
+    assert list(results) == ["convert_request.scalar"]
+    assert results["convert_request.scalar"]["iterations"] == 3
+
+    results["convert_request.scalar"]["p50_ms"] = 1e-9
+    output.write_text(json.dumps({"results": results}))
+    assert main(args + ["--baseline", str(output)]) == 1
+
+
+def test_star_import():
+    # from skyfi_modelship.bench import * needs the names, not the objects
+    assert all(isinstance(name, str) and hasattr(bench, name) for name in bench.__all__)
+    assert "run_benchmark" in bench.__all__
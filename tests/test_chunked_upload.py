@@ -0,0 +1,82 @@
+import os
+
+import pytest
+
+from skyfi_modelship.config import SkyfiConfig
+from skyfi_modelship.util import storage
+from skyfi_modelship.util.storage import MemoryBackend, register_backend
+
+
+class ComposeTrackingBackend(MemoryBackend):
+    def __init__(self):
+        super().__init__()
+        self.composed = []
+
+    def compose(self, part_urls, url):
+        self.composed.append((list(part_urls), url))
+        super().compose(part_urls, url)
+
+
+@pytest.fixture
+def config(mocker):
+    config = SkyfiConfig(upload_chunk_threshold=1000, upload_chunk_size=300)
+    mocker.patch("skyfi_modelship.util.storage.load_config", return_value=config)
+    mocker.patch("skyfi_modelship.util.transfer.load_config", return_value=config)
+    return config
+
+
+@pytest.fixture
+def backend():
+    backend = ComposeTrackingBackend()
+    previous = register_backend("memory", backend)
+    yield backend
+    register_backend("memory", previous)
+
+
+def test_large_output_is_uploaded_in_parts(config, backend, tmp_path):
+    data = os.urandom(2000)
+    (tmp_path / "output.tif").write_bytes(data)
+
+    dst = storage.upload(str(tmp_path / "output.tif"), "memory://bucket/out",
+                         "inference", name="output", ref_name="in_tiff")
+
+    assert dst == "memory://bucket/out/output_inference_output_for_in_tiff.tif"
+    assert backend.get(dst) == data
+    [(part_urls, url)] = backend.composed
+    assert url == dst
+    assert len(part_urls) == 7
+    assert set(backend.objects) == {dst}, "the parts are deleted"
+
+
+def test_small_output_is_uploaded_whole(config, backend, tmp_path):
+    (tmp_path / "output.tif").write_bytes(b"small")
+
+    dst = storage.upload(str(tmp_path / "output.tif"), "memory://bucket/out",
+                         "inference", name=None, ref_name=None)
+
+    assert backend.get(dst) == b"small"
+    assert backend.composed == []
+
+
+def test_parts_are_capped_for_a_single_compose(config, backend, tmp_path):
+    data = os.urandom(20000)
+    (tmp_path / "output.tif").write_bytes(data)
+
+    dst = storage.upload(str(tmp_path / "output.tif"), "memory://bucket/out",
+                         "inference", name=None, ref_name=None)
+
+    assert backend.get(dst) == data
+    [(part_urls, _)] = backend.composed
+    assert len(part_urls) <= 32
+
+
+def test_local_backend_chunked_upload(config, file_backend, tmp_path):
+    data = os.urandom(2000)
+    (tmp_path / "output.tif").write_bytes(data)
+
+    dst = storage.upload(str(tmp_path / "output.tif"), f"file://{tmp_path}/out",
+                         "inference", name=None, ref_name=None)
+
+    assert dst == f"file://{tmp_path}/out/output_inference.tif"
+    assert (tmp_path / "out" / "output_inference.tif").read_bytes() == data
+    assert os.listdir(tmp_path / "out") == ["output_inference.tif"]
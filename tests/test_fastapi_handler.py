@@ -0,0 +1,85 @@
+import asyncio
+import threading
+from unittest.mock import patch
+import uuid
+
+from fastapi import HTTPException
+from fastapi.exceptions import RequestValidationError
+import orjson
+import pytest
+
+import skyfi_modelship as skyfi
+from skyfi_modelship.config import SkyfiConfig
+from skyfi_modelship.handler.fastapi_handler import FastApiHandler
+from skyfi_modelship.util.metrics import REQUESTS
+
+release = threading.Event()
+started = threading.Event()
+
+
+def blocking_inference(num: skyfi.float) -> skyfi.FloatOutput:
+    started.set()
+    release.wait(timeout=10)
+    return skyfi.FloatOutput(value=num, name="output_num")
+
+
+def body(**kwargs) -> bytes:
+    return orjson.dumps({"request_id": str(uuid.uuid4())} | kwargs)
+
+
+def make_handler(**config) -> FastApiHandler:
+    with patch("skyfi_modelship.handler.fastapi_handler.load_config",
+               return_value=SkyfiConfig(**config)):
+        return FastApiHandler()
+
+
+def test_event_loop_not_blocked(http_request):
+    release.clear()
+    started.clear()
+    handler = make_handler(fastapi_workers=1, fastapi_queue_size=0)
+
+    async def scenario():
+        post = handler.handle(blocking_inference)
+        running = asyncio.ensure_future(post(http_request(body(num=1))))
+        await asyncio.get_running_loop().run_in_executor(None, started.wait, 10)
+
+        # the loop keeps serving while the inference runs
+        health = await handler.health()
+        assert health == {"status": "ok", "pending": 1, "capacity": 1}
+
+        # and throttles the requests beyond the capacity
+        with pytest.raises(HTTPException) as ex:
+            await post(http_request(body(num=2)))
+        assert ex.value.status_code == 429
+        assert ex.value.headers == {"Retry-After": "1"}
+
+        release.set()
+        return await running
+
+    throttled = REQUESTS.value(function="blocking_inference", status="throttled")
+    response = asyncio.run(scenario())
+
+    assert response.response.value == 1
+    assert handler.pending == 0
+    assert REQUESTS.value(function="blocking_inference", status="throttled") == throttled + 1
+
+
+def test_validation_error(http_request):
+    handler = make_handler().handle(blocking_inference)
+
+    with pytest.raises(RequestValidationError):
+        asyncio.run(handler(http_request(body(num="not a number"))))
+
+
+def test_unknown_executor():
+    with pytest.raises(ValueError, match="Unknown executor"):
+        make_handler(fastapi_executor="fiber")
+
+
+def test_process_workers_fork_at_startup():
+    handler = make_handler(fastapi_executor="process", fastapi_workers=2)
+    try:
+        # forked before serving, not from the running server on the first request
+        assert len(handler.executor._processes) == 2
+    finally:
+        handler.executor.shutdown()
@@ -0,0 +1,101 @@
+import uuid
+
+import orjson
+import pytest
+from fastapi.encoders import jsonable_encoder
+from pydantic import ValidationError
+
+import skyfi_modelship as skyfi
+from skyfi_modelship.config import SkyfiConfig
+from skyfi_modelship.util.execution import exec_func
+from skyfi_modelship.util.inference_request import convert_request
+
+DOCUMENT = (
+    b'{"type": "FeatureCollection", "features": [{"type": "Feature", '
+    b'"geometry": {"type": "Point", "coordinates": [1.0, 2.0]}, "properties": {"a": 1}}]}'
+)
+
+
+@pytest.fixture
+def lazy(mocker):
+    mocker.patch("skyfi_modelship.skyfi_types.load_config",
+                 return_value=SkyfiConfig(geojson_lazy=True))
+
+
+def inference(in_geojson: skyfi.GeoJSON) -> skyfi.GeoJSONOutput:
+    return skyfi.GeoJSONOutput(name="output", value=in_geojson, ref_name="in_geojson")
+
+
+def run(data, mocker, func=inference):
+    uploaded = {}
+
+    def upload(path, folder, func_name, name, ref_name):
+        uploaded[name] = open(path, "rb").read()
+        return f"{folder}/{name}.json"
+
+    mocker.patch("skyfi_modelship.util.model_transformer.upload", side_effect=upload)
+    data = {"request_id": str(uuid.uuid4()), "output_folder": "gs://bucket/out"} | data
+    response = exec_func(func, convert_request(data, func))
+    return response, uploaded
+
+
+def test_geojson_from_string():
+    geo = skyfi.GeoJSON(DOCUMENT.decode())
+    assert not geo.is_lazy
+    assert geo.features[0].geometry.coordinates.longitude == 1.0
+
+
+def test_lazy_geojson_passes_original_bytes_through(lazy, mocker):
+    response, uploaded = run({"in_geojson": DOCUMENT.decode()}, mocker)
+
+    assert response.response.value.is_lazy
+    assert uploaded["output"] == DOCUMENT
+    # the response still carries the whole collection
+    value = orjson.loads(orjson.dumps(jsonable_encoder(response)))["response"]["value"]
+    assert value == orjson.loads(DOCUMENT)
+
+
+def test_lazy_geojson_validates_features_on_access(lazy):
+    geo = skyfi.GeoJSON(DOCUMENT)
+    assert geo.is_lazy
+
+    assert geo.features[0].properties == {"a": 1}
+    assert not geo.is_lazy
+    assert orjson.loads(geo.dump_json()) == orjson.loads(geo.model_dump_json())
+
+
+def test_lazy_geojson_checks_envelope(lazy):
+    with pytest.raises(ValidationError):
+        skyfi.GeoJSON(b'{"type": "Feature", "features": []}')
+
+    invalid_feature = skyfi.GeoJSON(b'{"type": "FeatureCollection", "features": [{"a": 1}]}')
+    assert invalid_feature.is_lazy
+    with pytest.raises(ValidationError):
+        assert len(invalid_feature.features) == 1
+
+
+def test_lazy_geojson_from_dict(lazy, mocker):
+    response, uploaded = run({"in_geojson": orjson.loads(DOCUMENT)}, mocker)
+
+    assert response.response.value.is_lazy
+    assert orjson.loads(uploaded["output"]) == orjson.loads(DOCUMENT)
+
+
+def test_lazy_geojson_from_features(lazy, mocker):
+    features = skyfi.GeoJSON(DOCUMENT.decode()).features
+
+    def features_inference() -> skyfi.GeoJSONOutput:
+        geo = skyfi.GeoJSON(type="FeatureCollection", features=features)
+        assert not geo.is_lazy
+        return skyfi.GeoJSONOutput(name="output", value=geo)
+
+    _, uploaded = run({}, mocker, features_inference)
+
+    assert orjson.loads(uploaded["output"]) == orjson.loads(DOCUMENT)
+
+
+def test_modified_lazy_geojson_is_serialized(lazy):
+    geo = skyfi.GeoJSON(DOCUMENT)
+    geo.bbox = (0.0, 0.0, 3.0, 3.0)
+
+    assert orjson.loads(geo.dump_json())["bbox"] == [0.0, 0.0, 3.0, 3.0]
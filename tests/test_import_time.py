@@ -0,0 +1,44 @@
+import subprocess
+import sys
+from typing import Dict
+
+import pytest
+
+# cumulative import time budget of the package, in microseconds, ~0.3s when recorded
+IMPORT_BUDGET_US = 1_000_000
+
+# imported only by the handler or the storage backend actually used
+LAZY_MODULES = [
+    "fastapi", "uvicorn", "starlette", "pika", "simple_parsing",
+    "google.cloud.storage", "shapely", "numpy",
+]
+
+
+def import_times(module: str) -> Dict[str, int]:
+    """ Returns the cumulative import time of every module imported by module. """
+
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+@pytest.fixture(scope="module")
+def package_import_times():
+    return import_times("skyfi_modelship")
+
+
+@pytest.mark.parametrize("module", LAZY_MODULES)
+def test_heavy_module_is_lazy(package_import_times, module):
+    assert module not in package_import_times
+
+
+def test_import_time_budget(package_import_times):
+    assert package_import_times["skyfi_modelship"] < IMPORT_BUDGET_US
@@ -0,0 +1,198 @@
+import asyncio
+import os
+import uuid
+
+from fastapi import HTTPException
+import orjson
+import pytest
+
+import skyfi_modelship as skyfi
+from skyfi_modelship.config import load_config
+from skyfi_modelship.handler.fastapi_handler import FastApiHandler
+from skyfi_modelship.util.inline import PART_SCHEME, InlineSpool, remove_spooled, spool_dir
+from skyfi_modelship.util.multipart import MultipartParser, Part, encode_multipart, \
+    parse_multipart
+
+BINARY = bytes(range(256)) + b"\r\n--not-a-boundary\r\n" + bytes(range(256))
+seen_paths = []
+
+
+def invert_inference(image: skyfi.GeoTIFF) -> skyfi.GeoTIFFOutput:
+    seen_paths.append(image.path)
+    with open(image.path, "rb") as f:
+        data = f.read()
+    path = os.path.join(os.path.dirname(image.path), "inverted.tif")
+    with open(path, "wb") as f:
+        f.write(bytes(255 - b for b in data))
+    return skyfi.GeoTIFFOutput(value=skyfi.GeoTIFF(path=path), name="inverted")
+
+
+@pytest.fixture
+def config(monkeypatch):
+    def set_config(**values):
+        for key, value in values.items():
+            monkeypatch.setenv(f"SKYFI_{key.upper()}", str(value))
+        load_config.cache_clear()
+
+    yield set_config
+    monkeypatch.undo()
+    load_config.cache_clear()
+
+
+def inline_post(http_request, parts):
+    request_id = str(uuid.uuid4())
+    # the request part may come after the file parts
+    body, content_type = encode_multipart(
+        parts + [Part(name="request", data=orjson.dumps({"request_id": request_id}),
+                      content_type="application/json")]
+    )
+    # the request of a form is multipart/form-data
+    content_type = content_type.replace("multipart/mixed", "multipart/form-data")
+    post = FastApiHandler().handle_inline(invert_inference)
+    response = asyncio.run(post(http_request(body, headers={"content-type": content_type})))
+    return request_id, response
+
+
+def test_multipart_round_trip():
+    parts = [Part(name="request", data=b"{}", content_type="application/json"),
+             Part(name="image", data=BINARY, filename="image.tif")]
+    body, content_type = encode_multipart(parts)
+
+    assert parse_multipart(body, content_type) == parts
+
+
+def test_multipart_parsed_incrementally():
+    parts = [Part(name="request", data=b"{}", content_type="application/json"),
+             Part(name="image", data=BINARY * 3, filename="image.tif")]
+    body, content_type = encode_multipart(parts)
+    parsed = []
+
+    def open_part(name, filename, content_type):
+        part = Part(name=name, data=b"", filename=filename, content_type=content_type)
+        parsed.append(part)
+
+        class Writer:
+            def write(self, data):
+                assert data
+                part.data += data
+
+            def close(self):
+                pass
+
+        return Writer()
+
+    parser = MultipartParser(content_type, open_part)
+    # a byte at a time, the delimiters are split across the chunks
+    for idx in range(len(body)):
+        parser.feed(body[idx:idx + 1])
+    parser.close()
+
+    assert parsed == parts
+
+
+def test_multipart_dispositions():
+    body, _ = encode_multipart([Part(name="response", data=b"{}"),
+                                Part(name="response.path", data=BINARY, filename="out.tif")])
+
+    assert b'Content-Disposition: inline; name="response"\r\n' in body
+    assert b'Content-Disposition: attachment; name="response.path"; filename="out.tif"' in body
+    assert b"form-data" not in body
+
+
+def test_multipart_malformed():
+    body, content_type = encode_multipart([Part(name="image", data=BINARY)])
+
+    with pytest.raises(ValueError):
+        parse_multipart(body[:-10], content_type)
+    with pytest.raises(ValueError):
+        parse_multipart(body, "application/json")
+
+
+def test_inline_input_and_output(http_request):
+    seen_paths.clear()
+    request_id, response = inline_post(
+        http_request, [Part(name="image", data=BINARY, filename="image.tif")]
+    )
+
+    response_part, output_part = parse_multipart(
+        response.body, response.headers["content-type"]
+    )
+    result = orjson.loads(response_part.data)
+    assert result["request_id"] == request_id
+    assert result["response"]["value"]["path"] == f"{PART_SCHEME}response.path"
+    assert output_part.name == "response.path"
+    assert output_part.filename == "inverted.tif"
+    assert output_part.data == bytes(255 - b for b in BINARY)
+    # the input was spooled to the spool folder, which is removed once answered
+    folder = os.path.dirname(os.path.dirname(seen_paths[0]))
+    assert os.path.dirname(folder) == os.path.join(spool_dir(), "skyfi_modelship")
+    assert not os.path.exists(folder)
+
+
+def test_inline_large_input_spooled_to_disk(http_request, config):
+    config(inline_spool_max_bytes=len(BINARY) // 2)
+    seen_paths.clear()
+    _, response = inline_post(
+        http_request, [Part(name="image", data=BINARY, filename="image.tif")]
+    )
+
+    _, output_part = parse_multipart(response.body, response.headers["content-type"])
+    assert output_part.data == bytes(255 - b for b in BINARY)
+    assert not seen_paths[0].startswith(spool_dir())
+    assert not os.path.exists(seen_paths[0])
+
+
+def test_inline_request_too_large(http_request, config):
+    config(inline_max_request_bytes=len(BINARY))
+
+    with pytest.raises(HTTPException) as info:
+        inline_post(http_request, [Part(name="image", data=BINARY)])
+
+    assert info.value.status_code == 413
+
+
+def test_inline_unknown_part(http_request):
+    with pytest.raises(HTTPException) as info:
+        inline_post(http_request, [Part(name="mask", data=BINARY)])
+
+    assert info.value.status_code == 400
+    assert "mask" in info.value.detail
+
+
+@pytest.mark.parametrize("filename", ["..", ".", "", "images/"])
+def test_inline_invalid_file_name(http_request, filename):
+    with pytest.raises(HTTPException) as info:
+        inline_post(http_request, [Part(name="image", data=BINARY, filename=filename)])
+
+    assert info.value.status_code == 400
+    assert "file name" in info.value.detail
+
+
+def spooled_request_data(parts):
+    spool_id = uuid.uuid4()
+    spool = InlineSpool(invert_inference, spool_id)
+    try:
+        for name, filename in parts:
+            part = spool.open_part(name, filename, "application/octet-stream")
+            part.write(orjson.dumps({"request_id": str(spool_id)}) if name == "request" else b"")
+            part.close()
+        return spool.request_data()
+    finally:
+        remove_spooled(spool_id)
+
+
+def test_inline_aux_parts_independent_of_order():
+    main_first = spooled_request_data([
+        ("request", None), ("image", "a.tif"), ("image.metadata_xml_path", "a.xml"),
+        ("image", "b.tif"), ("image.metadata_xml_path", "b.xml"),
+    ])
+    aux_first = spooled_request_data([
+        ("image.metadata_xml_path", "a.xml"), ("image.metadata_xml_path", "b.xml"),
+        ("request", None), ("image", "a.tif"), ("image", "b.tif"),
+    ])
+
+    for data in (main_first, aux_first):
+        assert [os.path.basename(entry["path"]) for entry in data["image"]] == \
+            ["a.tif", "b.tif"]
+        assert [os.path.basename(entry["metadata_xml_path"]) for entry in data["image"]] == \
+            ["a.xml", "b.xml"]
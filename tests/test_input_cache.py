@@ -0,0 +1,96 @@
+import os
+import threading
+import time
+
+import pytest
+
+from skyfi_modelship.util import storage
+from skyfi_modelship.util.cache import InputCache
+from skyfi_modelship.util.storage import MemoryBackend, register_backend
+
+
+class CountingBackend(MemoryBackend):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.downloads = 0
+
+    def download(self, url, destination):
+        self.downloads += 1
+        super().download(url, destination)
+
+
+@pytest.fixture
+def backend():
+    backend = CountingBackend()
+    previous = register_backend("memory", backend)
+    yield backend
+    register_backend("memory", previous)
+
+
+@pytest.fixture
+def cache(tmp_path, mocker):
+    cache = InputCache(str(tmp_path / "cache"), max_bytes=1024)
+    mocker.patch("skyfi_modelship.util.storage.get_input_cache", return_value=cache)
+    return cache
+
+
+def test_cached_input_is_copied(backend, cache, tmp_path):
+    backend.put("memory://bucket/scene.tif", b"scene")
+
+    first = storage.download("memory://bucket/scene.tif", str(tmp_path / "request_1"))
+    # a model writing to its input in place
+    with open(first, "r+b") as f:
+        f.write(b"SCENE")
+    second = storage.download("memory://bucket/scene.tif", str(tmp_path / "request_2"))
+
+    assert backend.downloads == 1
+    assert open(second, "rb").read() == b"scene"
+    assert os.stat(first).st_ino != os.stat(second).st_ino
+
+
+def test_new_generation_is_downloaded(backend, cache, tmp_path):
+    backend.put("memory://bucket/scene.tif", b"scene")
+    storage.download("memory://bucket/scene.tif", str(tmp_path / "request_1"))
+
+    backend.put("memory://bucket/scene.tif", b"updated scene")
+    path = storage.download("memory://bucket/scene.tif", str(tmp_path / "request_2"))
+
+    assert backend.downloads == 2
+    assert open(path, "rb").read() == b"updated scene"
+
+
+def test_least_recently_used_is_evicted(backend, cache, tmp_path):
+    for name in ("a", "b", "c"):
+        backend.put(f"memory://bucket/{name}.tif", bytes(400))
+
+    storage.download("memory://bucket/a.tif", str(tmp_path / "request"))
+    time.sleep(0.01)
+    storage.download("memory://bucket/b.tif", str(tmp_path / "request"))
+    time.sleep(0.01)
+    # a is used again, b becomes the least recently used
+    storage.download("memory://bucket/a.tif", str(tmp_path / "request"))
+    time.sleep(0.01)
+    storage.download("memory://bucket/c.tif", str(tmp_path / "request"))
+
+    cached = {key for _, _, key in cache.entries()}
+    a_key = cache.key("memory://bucket/a.tif", "1")
+    b_key = cache.key("memory://bucket/b.tif", "1")
+    c_key = cache.key("memory://bucket/c.tif", "1")
+    assert cached == {a_key, c_key}
+    assert b_key not in cached
+    # the evicted file stays available to the request that copied it
+    assert open(tmp_path / "request" / "b.tif", "rb").read() == bytes(400)
+
+
+def test_concurrent_fetch_downloads_once(backend, cache, tmp_path):
+    backend.latency = 0.05
+    backend.put("memory://bucket/scene.tif", b"scene")
+
+    def fetch(idx):
+        storage.download("memory://bucket/scene.tif", str(tmp_path / f"request_{idx}"))
+
+    threads = [threading.Thread(target=fetch, args=(idx,)) for idx in range(4)]
+    [thread.start() for thread in threads]
+    [thread.join() for thread in threads]
+
+    assert backend.downloads == 1
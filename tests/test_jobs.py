@@ -0,0 +1,96 @@
+import asyncio
+from concurrent.futures import Future
+from unittest.mock import patch
+import uuid
+
+from fastapi import HTTPException
+from fastapi.exceptions import RequestValidationError
+import orjson
+import pytest
+
+import skyfi_modelship as skyfi
+from skyfi_modelship.config import SkyfiConfig
+from skyfi_modelship.handler.fastapi_handler import FastApiHandler
+from skyfi_modelship.util.jobs import Job, JobStore, JobStoreFull
+
+
+def double_inference(num: skyfi.float) -> skyfi.FloatOutput:
+    if num < 0:
+        raise ValueError("negative input")
+    return skyfi.FloatOutput(value=num * 2, name="output_num")
+
+
+def finished_job(response=None, error=None) -> Job:
+    job = Job(uuid.uuid4(), {}, Future())
+    job.finish(response=response, error=error)
+    return job
+
+
+def test_job_store_evicts_finished_jobs():
+    store = JobStore(max_jobs=2, ttl=3600)
+    old, running = finished_job(error="boom"), Job(uuid.uuid4(), {}, Future())
+    store.add(old)
+    store.add(running)
+
+    # the oldest finished job makes room, unfinished jobs are kept
+    store.reserve(uuid.uuid4())
+    assert store.get(old.request_id) is None
+    assert store.get(running.request_id) is running
+
+    store.add(Job(uuid.uuid4(), {}, Future()))
+    with pytest.raises(JobStoreFull):
+        store.reserve(uuid.uuid4())
+    with pytest.raises(KeyError):
+        store.reserve(running.request_id)
+
+
+def test_job_store_ttl():
+    store = JobStore(max_jobs=10, ttl=0)
+    job = finished_job(error="boom")
+    store.add(job)
+    assert store.get(job.request_id) is None
+
+
+def test_submit_and_poll_job(http_request):
+    with patch("skyfi_modelship.handler.fastapi_handler.load_config",
+               return_value=SkyfiConfig()):
+        handler = FastApiHandler()
+    submit = handler.submit_job(double_inference)
+
+    async def scenario():
+        request_id = uuid.uuid4()
+        body = orjson.dumps({"request_id": str(request_id), "num": 21})
+        accepted = await submit(http_request(body))
+        assert accepted.request_id == request_id
+        assert accepted.status in ("queued", "running")
+
+        with pytest.raises(HTTPException) as ex:
+            await submit(http_request(body))
+        assert ex.value.status_code == 409
+
+        failing_id = uuid.uuid4()
+        await submit(http_request(orjson.dumps({"request_id": str(failing_id), "num": -1})))
+
+        await asyncio.gather(*handler.job_tasks)
+        return await handler.get_job(request_id), await handler.get_job(failing_id)
+
+    done, failed = asyncio.run(scenario())
+
+    assert done.status == "succeeded"
+    assert done.response.response.value == 42
+    assert {"parse", "validation", "download", "inference", "upload"} <= set(done.timings)
+    assert failed.status == "failed"
+    assert failed.error == "ValueError: negative input"
+    assert handler.pending == 0
+
+    with pytest.raises(HTTPException) as ex:
+        asyncio.run(handler.get_job(uuid.uuid4()))
+    assert ex.value.status_code == 404
+
+
+def test_submit_invalid_job(http_request):
+    handler = FastApiHandler().submit_job(double_inference)
+    body = orjson.dumps({"request_id": str(uuid.uuid4()), "num": "not a number"})
+
+    with pytest.raises(RequestValidationError):
+        asyncio.run(handler(http_request(body)))
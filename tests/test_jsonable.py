@@ -0,0 +1,38 @@
+from datetime import timedelta
+from decimal import Decimal
+import uuid
+
+from fastapi.encoders import jsonable_encoder
+import pytest
+
+import skyfi_modelship as skyfi
+from skyfi_modelship.util.execution import InferenceResponse, to_jsonable
+
+
+class Detection:
+    """ A plain object, not known to pydantic. """
+
+    def __init__(self, score: Decimal):
+        self.score = score
+        self.boxes = [(1, 2), (3, 4)]
+
+
+@pytest.mark.parametrize("value", [
+    Decimal("1.5"),
+    Decimal("3"),
+    timedelta(seconds=1.5),
+    {"scores": {Decimal("0.5"), Decimal("2")}},
+    Detection(Decimal("0.25")),
+    skyfi.FloatOutput(value=1.5, name="output_num"),
+    InferenceResponse(
+        request_id=uuid.uuid4(), output_folder=None, timings={"inference": 0.1},
+        response={"detections": [Detection(Decimal("0.75"))], "count": Decimal("1")},
+    ),
+])
+def test_encodes_like_jsonable_encoder(value):
+    assert to_jsonable(value) == jsonable_encoder(value)
+
+
+def test_unencodable_value():
+    with pytest.raises(ValueError):
+        to_jsonable(object())
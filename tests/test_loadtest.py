@@ -0,0 +1,133 @@
+import json
+import os
+import subprocess
+import sys
+import threading
+
+import pytest
+
+import skyfi_modelship as skyfi
+from skyfi_modelship import loadtest
+from skyfi_modelship.config import load_config
+from skyfi_modelship.handler.rabbitmq_handler import RabbitMQHandler
+from skyfi_modelship.loadtest import LocalBroker, LocalBrokerClient, run_closed_loop, \
+    run_open_loop
+from skyfi_modelship.loadtest.__main__ import local_queues
+
+
+def echo_inference(num: skyfi.float) -> skyfi.FloatOutput:
+    return skyfi.FloatOutput(value=num, name="output_num")
+
+
+@pytest.fixture
+def queues(monkeypatch):
+    monkeypatch.setenv("SKYFI_RABBITMQ_REQ_QUEUE", "requests")
+    monkeypatch.setenv("SKYFI_RABBITMQ_RESP_QUEUE", "responses")
+    monkeypatch.setenv("SKYFI_METRICS_PORT", "0")
+    load_config.cache_clear()
+    yield load_config()
+    load_config.cache_clear()
+
+
+@pytest.fixture
+def local_model(queues):
+    broker = LocalBroker()
+    listener = threading.Thread(
+        target=RabbitMQHandler(connection_factory=broker.connect).listen, args=(echo_inference,)
+    )
+    listener.start()
+    client = LocalBrokerClient(broker, queues.rabbitmq_req_queue, queues.rabbitmq_resp_queue)
+    yield broker, client
+    client.close()
+    broker.close()
+    listener.join(timeout=5)
+    assert not listener.is_alive()
+
+
+def test_closed_loop(local_model):
+    broker, client = local_model
+    report = run_closed_loop(client, [{"num": 1}, {"num": 2}], concurrency=2, requests=20,
+                             timeout=5)
+
+    assert report.sent == 20
+    assert report.completed == 20
+    assert report.errors == 0
+    assert report.p50_ms <= report.p99_ms <= report.max_ms
+    assert not broker.queues["requests"]
+
+
+def test_open_loop_counts_errors(local_model):
+    _, client = local_model
+    # rejected without requeue, so the request times out
+    report = run_open_loop(client, [{"num": 1}, {"num": "nan?"}], rate=200, requests=10,
+                           timeout=0.5)
+
+    assert report.sent == 10
+    assert report.completed == 5
+    assert report.error_rate == 0.5
+    assert report.error_types == {"TimeoutError": 5}
+
+
+def test_star_import():
+    # from skyfi_modelship.loadtest import * needs the names, not the objects
+    assert all(isinstance(name, str) and hasattr(loadtest, name) for name in loadtest.__all__)
+    assert "run_closed_loop" in loadtest.__all__
+
+
+def test_local_broker_requeues_rejected_messages():
+    broker = LocalBroker()
+    channel = broker.connect().channel()
+    deliveries = []
+    channel.basic_consume(
+        "requests", lambda ch, method, properties, body: deliveries.append(method.delivery_tag)
+    )
+    broker.publish("requests", b"first")
+    broker.publish("requests", b"second")
+    channel.consuming = True
+
+    channel._next_event()()
+    channel.basic_reject(delivery_tag=deliveries[0], requeue=True)
+    assert [body for body, _ in broker.queues["requests"]] == [b"first", b"second"]
+
+    channel._next_event()()
+    channel.basic_reject(delivery_tag=deliveries[1], requeue=False)
+    assert [body for body, _ in broker.queues["requests"]] == [b"second"]
+
+
+def test_local_queues_are_restored(monkeypatch):
+    monkeypatch.delenv("SKYFI_RABBITMQ_REQ_QUEUE", raising=False)
+    monkeypatch.setenv("SKYFI_RABBITMQ_RESP_QUEUE", "responses")
+
+    with local_queues():
+        assert load_config().rabbitmq_req_queue == "skyfi-loadtest-requests"
+        assert load_config().rabbitmq_resp_queue == "responses"
+
+    assert "SKYFI_RABBITMQ_REQ_QUEUE" not in os.environ
+    assert load_config().rabbitmq_req_queue is None
+    load_config.cache_clear()
+
+
+def test_cli_local_target(tmp_path, queues):
+    model = tmp_path / "model.py"
+    model.write_text(
+        "import skyfi_modelship as skyfi\n"
+        "app = skyfi.SkyfiApp()\n"
+        "@app.inference\n"
+        "def f(num: skyfi.float) -> skyfi.FloatOutput:\n"
+        "    return skyfi.FloatOutput(value=num, name='o')\n"
+        "app.start()\n"
+    )
+    payloads = tmp_path / "requests.jsonl"
+    payloads.write_text('{"num": 1}\n{"num": 2}\n')
+    output = tmp_path / "report.json"
+
+    # the CLI configures the logging of the process, run it in a process of its own
+    result = subprocess.run(
+        [sys.executable, "-m", "skyfi_modelship.loadtest", str(payloads), "--target", "local",
+         "--app", str(model), "--requests", "10", "--timeout", "5", "--output", str(output)],
+        capture_output=True, text=True, check=True,
+    )
+
+    report = json.loads(output.read_text())
+    assert report["completed"] == 10
+    assert "throughput_rps" in result.stdout
@@ -0,0 +1,109 @@
+import asyncio
+import urllib.request
+import uuid
+
+import orjson
+import pika
+from pika.spec import Basic
+
+import skyfi_modelship as skyfi
+from skyfi_modelship.config import load_config
+from skyfi_modelship.handler.fastapi_handler import FastApiHandler
+from skyfi_modelship.handler.rabbitmq_handler import RabbitMQHandler
+from skyfi_modelship.util.metrics import (
+    REQUESTS, STAGE_DURATION, STAGE_ERRORS, Counter, Histogram, start_metrics_server,
+)
+
+
+def test_histogram_render():
+    histogram = Histogram("test_seconds", "Test.", ("stage",), buckets=(0.1, 1.0))
+    histogram.observe(0.05, stage="a")
+    histogram.observe(0.1, stage="a")
+    histogram.observe(5, stage="a")
+
+    assert histogram.render() == [
+        "# HELP test_seconds Test.",
+        "# TYPE test_seconds histogram",
+        'test_seconds_bucket{stage="a",le="0.1"} 2',
+        'test_seconds_bucket{stage="a",le="1"} 2',
+        'test_seconds_bucket{stage="a",le="+Inf"} 3',
+        'test_seconds_sum{stage="a"} 5.15',
+        'test_seconds_count{stage="a"} 3',
+    ]
+
+
+def test_counter_escapes_labels():
+    counter = Counter("test_total", "Test.", ("function",))
+    counter.inc(function='my "func"')
+    assert counter.render()[-1] == 'test_total{function="my \\"func\\""} 1'
+
+
+def metrics_inference(num: skyfi.float) -> skyfi.FloatOutput:
+    return skyfi.FloatOutput(value=num * 2, name="output_num")
+
+
+def failing_inference(num: skyfi.float) -> skyfi.FloatOutput:
+    raise RuntimeError("model failure")
+
+
+def test_fastapi_stage_timings(http_request):
+    handler = FastApiHandler().handle(metrics_inference)
+    body = orjson.dumps({"request_id": str(uuid.uuid4()), "num": 21})
+    before = STAGE_DURATION.count(stage="inference", function="metrics_inference")
+
+    response = asyncio.run(handler(http_request(body)))
+
+    assert response.response.value == 42
+    assert {"parse", "validation", "download", "inference", "upload", "cleanup"} == \
+        set(response.timings)
+    assert STAGE_DURATION.count(stage="inference", function="metrics_inference") == before + 1
+
+    metrics = asyncio.run(FastApiHandler().metrics()).body.decode()
+    assert 'skyfi_stage_duration_seconds_count{stage="parse",function="metrics_inference"}' \
+        in metrics
+    assert 'skyfi_requests_total{function="metrics_inference",status="success"}' in metrics
+
+
+def test_rabbitmq_stage_errors(fake_channel):
+    handler = RabbitMQHandler().handle(failing_inference)
+    body = orjson.dumps({"request_id": str(uuid.uuid4()), "num": 21})
+    errors = STAGE_ERRORS.value(stage="inference", function="failing_inference")
+    rejected = REQUESTS.value(function="failing_inference", status="rejected")
+
+    handler(fake_channel, Basic.Deliver(delivery_tag=1), pika.BasicProperties(), body)
+
+    # a model error is not retried, without a dead-letter queue the message is rejected
+    assert fake_channel.rejected == [(1, False)]
+    assert STAGE_ERRORS.value(stage="inference", function="failing_inference") == errors + 1
+    assert REQUESTS.value(function="failing_inference", status="rejected") == rejected + 1
+
+
+def test_metrics_side_port():
+    server = start_metrics_server("127.0.0.1", 0)
+    try:
+        port = server.server_address[1]
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics") as response:
+            assert response.headers["Content-Type"].startswith("text/plain")
+            assert b"# TYPE skyfi_stage_duration_seconds histogram" in response.read()
+    finally:
+        server.shutdown()
+
+
+def test_prefork_fastapi_worker_serves_metrics_on_its_port(mocker, monkeypatch):
+    monkeypatch.setenv("SKYFI_METRICS_PORT", "9100")
+    load_config.cache_clear()
+    start = mocker.patch("skyfi_modelship.handler.fastapi_handler.start_metrics_server")
+    server = mocker.patch("skyfi_modelship.handler.fastapi_handler.uvicorn.Server")
+    try:
+        handler = FastApiHandler(worker_index=2)
+        handler.listen(metrics_inference, sock=mocker.Mock())
+    finally:
+        load_config.cache_clear()
+
+    start.assert_called_once_with("0.0.0.0", 9102)
+    server.return_value.run.assert_called_once()
+    # the shared socket reaches a random worker, it doesn't serve /metrics
+    paths = {route.path for route in handler.create_app(metrics_inference).routes}
+    assert "/metrics" not in paths
+    assert "/metrics" in {route.path for route in FastApiHandler().create_app(
+        metrics_inference).routes}
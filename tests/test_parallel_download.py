@@ -0,0 +1,82 @@
+import threading
+import time
+import uuid
+
+import pytest
+
+import skyfi_modelship as skyfi
+from skyfi_modelship.config import SkyfiConfig
+from skyfi_modelship.util.inference_request import convert_request
+from skyfi_modelship.util.parallel import TransferError, run_parallel
+
+
+def inference(
+    in_tiff: skyfi.GeoTIFF, in_envi: skyfi.ENVI, in_pkg: skyfi.Package
+) -> skyfi.FloatOutput:
+    return skyfi.FloatOutput(value=42, name="output_num")
+
+
+def request_data():
+    return {
+        "request_id": str(uuid.UUID("00000000-0000-0000-0000-000000000001")),
+        "in_tiff": {"path": "gs://bucket/image.tif", "metadata_xml_path": "gs://bucket/image.xml"},
+        "in_envi": {"path": "gs://bucket/image.img", "header_path": "gs://bucket/image.hdr"},
+        "in_pkg": {"path": "gs://bucket/package.zip"},
+    }
+
+
+def test_convert_request_downloads_concurrently(mocker):
+    barrier = threading.Barrier(5, timeout=5)
+
+    def download(path, folder):
+        # all five files must be in flight at the same time to pass the barrier
+        barrier.wait()
+        return f"{folder}/{path.rsplit('/', 1)[-1]}"
+
+    mocker.patch("skyfi_modelship.util.model_transformer.download", side_effect=download)
+    mocker.patch("skyfi_modelship.util.inference_request.load_config",
+                 return_value=SkyfiConfig(download_workers=5))
+    r = convert_request(request_data(), inference)
+
+    assert r.kwargs.in_tiff.path.endswith("request_in_tiff/image.tif")
+    assert r.kwargs.in_tiff.metadata_xml_path.endswith("request_in_tiff/image.xml")
+    assert r.kwargs.in_envi.path.endswith("request_in_envi/image.img")
+    assert r.kwargs.in_envi.header_path.endswith("request_in_envi/image.hdr")
+    assert r.kwargs.in_pkg.path.endswith("request_in_pkg/package.zip")
+
+
+def test_convert_request_reports_failed_field(mocker):
+    def download(path, folder):
+        if path.endswith(".hdr"):
+            raise ValueError(f"Error downloading file: {path}")
+        return f"{folder}/{path.rsplit('/', 1)[-1]}"
+
+    mocker.patch("skyfi_modelship.util.model_transformer.download", side_effect=download)
+    with pytest.raises(TransferError) as exc_info:
+        convert_request(request_data(), inference)
+
+    assert list(exc_info.value.errors) == ["request_in_envi.header_path"]
+
+
+def test_run_parallel_stops_at_first_failure():
+    started = []
+
+    def fail():
+        raise ValueError("boom")
+
+    def slow(idx):
+        started.append(idx)
+        time.sleep(0.05)
+        return idx
+
+    tasks = [("failing", fail)] + [(f"slow_{i}", lambda i=i: slow(i)) for i in range(20)]
+    with pytest.raises(TransferError) as exc_info:
+        run_parallel(tasks, max_workers=2)
+
+    assert list(exc_info.value.errors) == ["failing"]
+    assert len(started) < 20, "pending transfers are cancelled"
+
+
+def test_run_parallel_keeps_task_order():
+    tasks = [(str(i), lambda i=i: i) for i in range(10)]
+    assert run_parallel(tasks, max_workers=4) == list(range(10))
@@ -0,0 +1,84 @@
+import threading
+import uuid
+
+from pydantic import create_model
+
+import skyfi_modelship as skyfi
+from skyfi_modelship.config import SkyfiConfig
+from skyfi_modelship.util.execution import exec_func
+from skyfi_modelship.util.inference_request import InferenceRequest
+
+
+def fake_upload(path, folder, func_name, name, ref_name):
+    filename = path.rsplit("/", 1)[-1]
+    return f"{folder}/{func_name}_{name}_for_{ref_name}_{filename}"
+
+
+def make_request(**kwargs):
+    return InferenceRequest(
+        request_id=uuid.UUID("00000000-0000-0000-0000-000000000001"),
+        output_folder="gs://remote-path/skyfi",
+        kwargs=create_model("FunctionArguments")(),
+        **kwargs,
+    )
+
+
+def test_exec_func_uploads_concurrently(mocker):
+    barrier = threading.Barrier(4, timeout=5)
+
+    def upload(*args, **kwargs):
+        # all four files must be in flight at the same time to pass the barrier
+        barrier.wait()
+        return fake_upload(*args, **kwargs)
+
+    mocker.patch("skyfi_modelship.util.model_transformer.upload", side_effect=upload)
+    mocker.patch("skyfi_modelship.util.execution.load_config",
+                 return_value=SkyfiConfig(upload_workers=4))
+
+    def inference():
+        return [
+            skyfi.GeoTIFFOutput(
+                name=f"tiff_{idx}", ref_name="in_tiff",
+                value=skyfi.GeoTIFF(path=f"/tmp/out_{idx}.tif", metadata_xml_path="/tmp/out.xml"),
+            )
+            for idx in range(2)
+        ]
+
+    response = exec_func(inference, make_request())
+
+    outputs = response.response
+    assert outputs[0].value.path == "gs://remote-path/skyfi/inference_tiff_0_for_in_tiff_out_0.tif"
+    assert outputs[0].value.metadata_xml_path == \
+        "gs://remote-path/skyfi/inference_tiff_0_for_in_tiff_out.xml"
+    assert outputs[1].value.path == "gs://remote-path/skyfi/inference_tiff_1_for_in_tiff_out_1.tif"
+    assert outputs[1].value.metadata_xml_path == \
+        "gs://remote-path/skyfi/inference_tiff_1_for_in_tiff_out.xml"
+
+
+def test_exec_func_shared_file_rewrites_are_deterministic(mocker):
+    mocker.patch("skyfi_modelship.util.model_transformer.upload", side_effect=fake_upload)
+    shared = skyfi.File(path="/tmp/shared.txt")
+
+    def inference():
+        return (
+            skyfi.FileOutput(name="first", ref_name="in", value=shared),
+            skyfi.FileOutput(name="second", ref_name="in", value=shared),
+        )
+
+    for _ in range(5):
+        shared.path = "/tmp/shared.txt"
+        response = exec_func(inference, make_request())
+        # both uploads read the local path, the last output in field order wins
+        assert response.response[0].value.path == \
+            "gs://remote-path/skyfi/inference_second_for_in_shared.txt"
+
+
+def test_exec_func_records_timings(mocker):
+    mocker.patch("skyfi_modelship.util.model_transformer.upload", side_effect=fake_upload)
+
+    def inference():
+        return skyfi.FloatOutput(value=42, name="output_num")
+
+    response = exec_func(inference, make_request(timings={"validation": 0.5}))
+    assert set(response.timings) == {"validation", "inference", "upload", "cleanup"}
+    assert response.timings["validation"] == 0.5
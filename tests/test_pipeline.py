@@ -0,0 +1,70 @@
+import threading
+from unittest.mock import patch
+import uuid
+
+import pytest
+
+import skyfi_modelship as skyfi
+from skyfi_modelship.util import pipeline as pipeline_module
+from skyfi_modelship.util.inference_request import convert_request
+from skyfi_modelship.util.metrics import INFERENCE_BUSY_SECONDS, INFERENCE_SLOTS_BUSY
+from skyfi_modelship.util.pipeline import InputError, Pipeline
+
+second_downloaded = threading.Event()
+second_inferring = threading.Event()
+
+
+def pipelined_inference(num: skyfi.float) -> skyfi.FloatOutput:
+    if num == 1:
+        second_inferring.set()
+    else:
+        # the inputs of the next request download during the inference
+        assert second_downloaded.wait(timeout=5)
+    return skyfi.FloatOutput(value=num, name="output_num")
+
+
+def request(num: float):
+    data = {"request_id": str(uuid.uuid4()), "num": num}
+    return convert_request(data, pipelined_inference, fetch_inputs=False)
+
+
+def test_stages_overlap():
+    second_downloaded.clear()
+    second_inferring.clear()
+    upload_response = pipeline_module.upload_response
+
+    def download_inputs(r, func):
+        if r.kwargs.num == 1:
+            second_downloaded.set()
+
+    def delayed_upload(func, r, response, timings):
+        if r.kwargs.num == 0:
+            # the outputs upload during the inference of the next request
+            assert second_inferring.wait(timeout=5)
+        return upload_response(func, r, response, timings)
+
+    pipeline = Pipeline(download_depth=1, inference_slots=1, upload_depth=1)
+    busy = INFERENCE_BUSY_SECONDS.value(function="pipelined_inference")
+    with patch.object(pipeline_module, "download_inputs", download_inputs), \
+            patch.object(pipeline_module, "upload_response", delayed_upload):
+        futures = [pipeline.submit(pipelined_inference, request(num)) for num in (0, 1, 2)]
+        responses = [future.result(timeout=10) for future in futures]
+    pipeline.shutdown()
+
+    assert [response.response.value for response in responses] == [0, 1, 2]
+    assert {"inference", "upload", "cleanup"} <= set(responses[0].timings)
+    assert INFERENCE_BUSY_SECONDS.value(function="pipelined_inference") > busy
+    assert INFERENCE_SLOTS_BUSY.value(function="pipelined_inference") == 0
+
+
+def test_download_error():
+    def failing_download(r, func):
+        raise ValueError("Error downloading file")
+
+    pipeline = Pipeline(download_depth=1, inference_slots=1, upload_depth=1, max_disk_bytes=1)
+    with patch.object(pipeline_module, "download_inputs", failing_download):
+        future = pipeline.submit(pipelined_inference, request(1))
+        with pytest.raises(InputError, match="Error downloading file"):
+            future.result(timeout=10)
+    pipeline.shutdown()
+    assert pipeline.disk_bytes == 0
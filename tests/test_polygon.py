@@ -0,0 +1,54 @@
+import pytest
+import shapely
+import shapely.wkt
+from pydantic import ValidationError
+
+import skyfi_modelship as skyfi
+from skyfi_modelship.util.inference_request import convert_request
+
+WKT = "POLYGON ((30 10, 40 40, 20 40, 10 20, 30 10))"
+
+
+def test_polygon_keeps_parsed_geometry(mocker):
+    poly = skyfi.Polygon(wkt=WKT)
+    loads = mocker.spy(shapely.wkt, "loads")
+
+    assert poly.geometry.equals(shapely.wkt.loads(WKT))
+    assert poly.prepared.contains(shapely.Point(30, 30))
+    assert not poly.prepared.intersects(shapely.Point(0, 0))
+    assert loads.call_count == 1, "only the comparison parses the wkt again"
+
+
+def test_polygon_accepts_wkb():
+    geometry = shapely.wkt.loads(WKT)
+
+    from_hex = skyfi.Polygon(wkt=shapely.to_wkb(geometry, hex=True))
+    from_bytes = skyfi.Polygon(wkt=shapely.to_wkb(geometry))
+
+    assert from_hex.geometry.equals(geometry)
+    assert from_bytes.geometry.equals(geometry)
+    assert from_bytes.wkt == from_hex.wkt.lower()
+
+
+def test_polygon_invalid():
+    with pytest.raises(ValidationError):
+        skyfi.Polygon(wkt="POLYGON ((30 10, 40")
+    with pytest.raises(ValidationError):
+        skyfi.Polygon(wkt="ABCDEF")
+
+
+def test_polygon_request():
+    def inference(poly: skyfi.Polygon) -> skyfi.PolygonOutput:
+        pass
+
+    r = convert_request({"request_id": "00000000-0000-0000-0000-000000000001",
+                         "poly": {"wkt": WKT}}, inference)
+    assert r.kwargs.poly.geometry.area == shapely.wkt.loads(WKT).area
+
+
+def test_polygon_repr_is_abbreviated():
+    square = shapely.Point(0, 0).buffer(10, quad_segs=1000)
+    poly = skyfi.Polygon(wkt=square.wkt)
+
+    assert len(repr(poly)) < 200
+    assert len(poly.wkt) > 10000
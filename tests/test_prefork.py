@@ -0,0 +1,46 @@
+import os
+import threading
+import time
+
+from skyfi_modelship.util.prefork import Supervisor, bind_socket
+
+
+def wait_for(condition, timeout: float = 10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_supervisor_restarts_crashed_workers(tmp_path):
+    def target(index: int):
+        (tmp_path / f"start-{index}-{os.getpid()}").touch()
+        crashed = tmp_path / f"crashed-{index}"
+        if not crashed.exists():
+            crashed.touch()
+            raise RuntimeError("worker crash")
+        time.sleep(30)
+
+    supervisor = Supervisor(target, workers=2, restart_delay=0)
+    thread = threading.Thread(target=supervisor.run)
+    thread.start()
+    try:
+        # 2 workers, each started twice
+        wait_for(lambda: len(list(tmp_path.glob("start-*"))) == 4)
+        assert supervisor.restarts == 2
+    finally:
+        wait_for(lambda: len(supervisor.children) == 2)
+        supervisor.stop()
+        thread.join(timeout=10)
+
+    assert not thread.is_alive()
+    assert supervisor.children == {}
+
+
+def test_bind_socket():
+    sock = bind_socket("127.0.0.1", 0)
+    try:
+        assert sock.get_inheritable()
+        assert sock.getsockname()[1] > 0
+    finally:
+        sock.close()
@@ -0,0 +1,108 @@
+from concurrent.futures import ThreadPoolExecutor
+import queue
+import threading
+import time
+import uuid
+
+import orjson
+import pika
+from pika.spec import Basic
+import pytest
+
+import skyfi_modelship as skyfi
+from skyfi_modelship.handler.rabbitmq_handler import RabbitMQHandler, ThreadsafeChannel
+
+from .fakes import FakeChannel
+
+barrier = threading.Barrier(2, timeout=5)
+
+
+def concurrent_inference(num: skyfi.float) -> skyfi.FloatOutput:
+    # both messages must be running at the same time to pass the barrier
+    barrier.wait()
+    return skyfi.FloatOutput(value=num, name="output_num")
+
+
+class FakeConnection:
+    """ Queues the threadsafe callbacks, run by the test thread like the pika I/O loop. """
+
+    def __init__(self):
+        self.callbacks = queue.Queue()
+
+    def add_callback_threadsafe(self, callback):
+        self.callbacks.put(callback)
+
+    def process_data_events(self, count: int):
+        for _ in range(count):
+            self.callbacks.get(timeout=5)()
+
+
+class IOThreadChannel(FakeChannel):
+    """ FakeChannel recording the thread of the calls. """
+
+    def __init__(self):
+        super().__init__()
+        self.connection = FakeConnection()
+        self.threads = set()
+
+    def basic_publish(self, **kwargs):
+        self.threads.add(threading.current_thread())
+        super().basic_publish(**kwargs)
+
+    def basic_ack(self, delivery_tag):
+        self.threads.add(threading.current_thread())
+        super().basic_ack(delivery_tag)
+
+
+def test_concurrent_consumer():
+    channel = IOThreadChannel()
+    executor = ThreadPoolExecutor(max_workers=2)
+    on_message = RabbitMQHandler().dispatch(
+        concurrent_inference, executor, ThreadsafeChannel(channel)
+    )
+
+    for tag in (1, 2):
+        body = orjson.dumps({"request_id": str(uuid.uuid4()), "num": tag})
+        on_message(channel, Basic.Deliver(delivery_tag=tag), pika.BasicProperties(), body)
+
+    # a publish and an ack per message
+    channel.connection.process_data_events(4)
+    executor.shutdown(wait=True)
+
+    assert sorted(channel.acked) == [1, 2]
+    assert len(channel.published) == 2
+    assert channel.threads == {threading.current_thread()}
+
+
+def test_failed_handler_rejects_message(mocker):
+    channel = IOThreadChannel()
+    executor = ThreadPoolExecutor(max_workers=1)
+    handler = RabbitMQHandler()
+    # e.g. the dead-letter queue can't be published to
+    mocker.patch.object(handler, "fail", side_effect=ConnectionError("publish failed"))
+    on_message = handler.dispatch(concurrent_inference, executor, ThreadsafeChannel(channel))
+
+    on_message(channel, Basic.Deliver(delivery_tag=1), pika.BasicProperties(), b"{not json")
+    on_message(channel, Basic.Deliver(delivery_tag=2, redelivered=True),
+               pika.BasicProperties(), b"{not json")
+    channel.connection.process_data_events(2)
+    executor.shutdown(wait=True)
+
+    # requeued once, then dropped
+    assert channel.rejected == [(1, True), (2, False)]
+
+
+def test_threadsafe_channel_close():
+    channel = IOThreadChannel()
+    threadsafe_channel = ThreadsafeChannel(channel)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        future = executor.submit(threadsafe_channel.basic_ack, delivery_tag=1)
+        while channel.connection.callbacks.empty():
+            time.sleep(0.001)
+        threadsafe_channel.close()
+        with pytest.raises(Exception):
+            future.result(timeout=5)
+
+    with pytest.raises(ConnectionError):
+        threadsafe_channel.basic_ack(delivery_tag=2)
+    assert channel.acked == []
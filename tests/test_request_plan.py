@@ -0,0 +1,65 @@
+from typing import Any, Dict, List, Optional, Tuple
+
+import skyfi_modelship as skyfi
+from skyfi_modelship.util.inference_request import convert_request
+from skyfi_modelship.util.request_plan import can_contain_file, compile_plan, get_plan
+
+
+def test_can_contain_file():
+    assert can_contain_file(skyfi.GeoTIFF)
+    assert can_contain_file(Optional[skyfi.ENVI])
+    assert can_contain_file(List[skyfi.Package])
+    assert can_contain_file(Tuple[skyfi.int, skyfi.File])
+    assert can_contain_file(Dict[str, List[skyfi.PNG]])
+    assert can_contain_file(Any)
+    assert can_contain_file(list)
+
+    assert not can_contain_file(skyfi.float)
+    assert not can_contain_file(skyfi.list[skyfi.float])
+    assert not can_contain_file(Optional[List[skyfi.str]])
+    assert not can_contain_file(skyfi.Polygon)
+    assert not can_contain_file(skyfi.GeoJSON)
+
+
+def test_plan_file_fields():
+    def inference(
+        values: skyfi.list[skyfi.float],
+        threshold: skyfi.float,
+        image: skyfi.GeoTIFF,
+        packages: Optional[List[skyfi.Package]],
+        poly: skyfi.Polygon,
+    ) -> skyfi.FloatOutput:
+        pass
+
+    assert compile_plan(inference).file_fields == ["image", "packages"]
+
+
+def test_plan_is_compiled_on_registration():
+    app = skyfi.SkyfiApp()
+
+    @app.inference
+    def inference(values: skyfi.list[skyfi.float]) -> skyfi.FloatOutput:
+        pass
+
+    plan = get_plan(inference)
+    assert get_plan(inference) is plan
+
+    r = convert_request({"request_id": "00000000-0000-0000-0000-000000000001",
+                         "values": [1, 2.5]}, inference)
+    assert type(r.kwargs) is plan.model
+    assert r.kwargs.values == [1.0, 2.5]
+
+
+def test_large_list_is_not_walked(mocker):
+    walked = []
+    mocker.patch(
+        "skyfi_modelship.util.model_transformer.walk_fields",
+        side_effect=lambda key, obj, fn, **kwargs: walked.append(obj),
+    )
+
+    def inference(values: skyfi.list[skyfi.float]) -> skyfi.FloatOutput:
+        pass
+
+    convert_request({"request_id": "00000000-0000-0000-0000-000000000001",
+                     "values": [0.5] * 10000}, inference)
+    assert walked == [{}]
@@ -0,0 +1,210 @@
+import asyncio
+import os
+from typing import Iterator
+import uuid
+
+import orjson
+import pika
+from pika.spec import Basic
+import pytest
+
+import skyfi_modelship as skyfi
+from skyfi_modelship.handler.fastapi_handler import FastApiHandler
+from skyfi_modelship.handler.rabbitmq_handler import RabbitMQHandler
+from skyfi_modelship.util.execution import run_request
+from skyfi_modelship.util.result_cache import DiskResultStore, MemoryResultStore, \
+    ResultCache, StorageResultStore
+from skyfi_modelship.util.storage import MemoryBackend, register_backend
+
+calls = []
+
+
+def count_inference(image: skyfi.GeoTIFF, num: skyfi.float) -> skyfi.FloatOutput:
+    calls.append(num)
+    return skyfi.FloatOutput(value=num * 2, name="output_num")
+
+
+class CountingBackend(MemoryBackend):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.downloads = 0
+
+    def download(self, url, destination):
+        self.downloads += 1
+        super().download(url, destination)
+
+    def download_head(self, url, end, file_obj):
+        self.downloads += 1
+        return super().download_head(url, end, file_obj)
+
+
+@pytest.fixture
+def backend():
+    backend = CountingBackend()
+    backend.put("memory://bucket/scene.tif", b"scene")
+    previous = register_backend("memory", backend)
+    calls.clear()
+    yield backend
+    register_backend("memory", previous)
+
+
+def use_cache(mocker, cache: ResultCache) -> ResultCache:
+    mocker.patch("skyfi_modelship.util.result_cache.get_result_cache", return_value=cache)
+    return cache
+
+
+def request(request_id: str, num: float = 1.0) -> dict:
+    return {"request_id": request_id, "image": {"path": "memory://bucket/scene.tif"},
+            "num": num}
+
+
+def test_redelivery_is_deduplicated(backend, mocker):
+    use_cache(mocker, ResultCache(MemoryResultStore(max_entries=8)))
+    request_id = str(uuid.uuid4())
+
+    first = run_request(count_inference, request(request_id))
+    second = run_request(count_inference, request(request_id))
+
+    assert calls == [1.0]
+    assert backend.downloads == 1
+    # a hit returns the same type as the inference function
+    assert second.response == first.response
+    assert type(second.response) is skyfi.FloatOutput
+    assert "result_cache" in second.timings
+
+
+def count_outputs(num: skyfi.float) -> Iterator[skyfi.FloatOutput]:
+    calls.append(num)
+    yield skyfi.FloatOutput(value=num, name="first")
+    yield skyfi.FloatOutput(value=num * 2, name="second")
+
+
+def test_streamed_outputs_hit(backend, mocker):
+    use_cache(mocker, ResultCache(MemoryResultStore(max_entries=8)))
+    data = {"request_id": str(uuid.uuid4()), "num": 1.0}
+
+    first = run_request(count_outputs, data)
+    second = run_request(count_outputs, data)
+
+    assert calls == [1.0]
+    assert second.response == first.response
+    assert all(type(output) is skyfi.FloatOutput for output in second.response)
+
+
+def test_fastapi_streamed_outputs_hit(backend, mocker, http_request):
+    use_cache(mocker, ResultCache(MemoryResultStore(max_entries=8)))
+    post = FastApiHandler().handle(count_outputs)
+    body = orjson.dumps({"request_id": str(uuid.uuid4()), "num": 1.0})
+
+    async def stream():
+        response = await post(http_request(body))
+        return [orjson.loads(line) async for line in response.body_iterator]
+
+    first = asyncio.run(stream())
+    second = asyncio.run(stream())
+
+    assert calls == [1.0]
+    assert second[:-1] == first[:-1]
+
+
+def test_request_scope_keys_by_request_id(backend, mocker):
+    use_cache(mocker, ResultCache(MemoryResultStore(max_entries=8), scope="request"))
+
+    run_request(count_inference, request(str(uuid.uuid4())))
+    run_request(count_inference, request(str(uuid.uuid4())))
+    run_request(count_inference, request(str(uuid.uuid4()), num=2.0))
+
+    assert calls == [1.0, 1.0, 2.0]
+
+
+def test_content_scope_shares_results(backend, mocker):
+    use_cache(mocker, ResultCache(MemoryResultStore(max_entries=8), scope="content"))
+
+    run_request(count_inference, request(str(uuid.uuid4())))
+    request_id = str(uuid.uuid4())
+    response = run_request(count_inference, request(request_id))
+
+    assert calls == [1.0]
+    assert str(response.request_id) == request_id
+
+
+def test_new_input_generation_misses(backend, mocker):
+    use_cache(mocker, ResultCache(MemoryResultStore(max_entries=8), scope="content"))
+
+    run_request(count_inference, request(str(uuid.uuid4())))
+    backend.put("memory://bucket/scene.tif", b"updated scene")
+    run_request(count_inference, request(str(uuid.uuid4())))
+
+    assert calls == [1.0, 1.0]
+
+
+@pytest.mark.parametrize("make_store", [
+    lambda tmp_path: DiskResultStore(str(tmp_path / "results"), max_bytes=1024),
+    lambda tmp_path: StorageResultStore("memory://bucket/results"),
+])
+def test_shared_stores(backend, mocker, tmp_path, make_store):
+    store = make_store(tmp_path)
+    use_cache(mocker, ResultCache(store))
+    request_id = str(uuid.uuid4())
+
+    run_request(count_inference, request(request_id))
+    # e.g. another process or node, sharing the store
+    use_cache(mocker, ResultCache(make_store(tmp_path)))
+    run_request(count_inference, request(request_id))
+
+    assert calls == [1.0]
+
+
+def test_result_key_is_not_taken_from_the_request(backend, mocker, tmp_path):
+    store = DiskResultStore(str(tmp_path / "results"), max_bytes=1024)
+    use_cache(mocker, ResultCache(store))
+    data = request(str(uuid.uuid4())) | {"result_key": "./../../attacker",
+                                         "image": {"path": str(tmp_path / "missing.tif")}}
+
+    # the lookup fails on the missing input, the result is not saved
+    run_request(count_inference, data)
+
+    assert not list(tmp_path.rglob("attacker*"))
+    assert os.listdir(store.directory) == []
+
+
+@pytest.mark.parametrize("make_store", [
+    lambda tmp_path: DiskResultStore(str(tmp_path / "results"), max_bytes=1024),
+    lambda tmp_path: StorageResultStore("memory://bucket/results"),
+])
+def test_stores_reject_invalid_keys(backend, tmp_path, make_store):
+    store = make_store(tmp_path)
+
+    for key in ["../attacker", "a" * 63, "A" * 64, ""]:
+        with pytest.raises(ValueError):
+            store.put(key, b"{}")
+        with pytest.raises(ValueError):
+            store.get(key)
+
+
+def test_memory_store_evicts_least_recently_used():
+    store = MemoryResultStore(max_entries=2)
+    store.put("a", b"1")
+    store.put("b", b"2")
+    store.get("a")
+    store.put("c", b"3")
+
+    assert store.get("b") is None
+    assert store.get("a") == b"1"
+    assert store.get("c") == b"3"
+
+
+def test_rabbitmq_redelivery_skips_inference(backend, mocker, fake_channel):
+    use_cache(mocker, ResultCache(MemoryResultStore(max_entries=8)))
+    handler = RabbitMQHandler().handle(count_inference)
+    body = orjson.dumps(request(str(uuid.uuid4())))
+
+    handler(fake_channel, Basic.Deliver(delivery_tag=1), pika.BasicProperties(), body)
+    handler(fake_channel, Basic.Deliver(delivery_tag=2, redelivered=True),
+            pika.BasicProperties(), body)
+
+    assert calls == [1.0]
+    assert backend.downloads == 1
+    assert fake_channel.acked == [1, 2]
+    first, second = (orjson.loads(published[2]) for published in fake_channel.published)
+    assert first["response"] == second["response"]
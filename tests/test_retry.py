@@ -0,0 +1,191 @@
+import threading
+import uuid
+
+import orjson
+import pika
+from pika.spec import Basic
+import pytest
+
+import skyfi_modelship as skyfi
+from skyfi_modelship.config import SkyfiConfig, load_config
+from skyfi_modelship.handler.rabbitmq_handler import RabbitMQHandler, dead_letter_target
+from skyfi_modelship.loadtest import LocalBroker
+from skyfi_modelship.util.retry import ATTEMPTS_HEADER, ERROR_HEADER, TransientError, \
+    is_transient, retry_delay, retry_queue
+from skyfi_modelship.util.storage import MemoryBackend, register_backend
+
+attempts = []
+
+
+def flaky_inference(num: skyfi.float) -> skyfi.FloatOutput:
+    attempts.append(num)
+    if len(attempts) < 3:
+        raise TransientError("service busy")
+    return skyfi.FloatOutput(value=num, name="output_num")
+
+
+def failing_inference(num: skyfi.float) -> skyfi.FloatOutput:
+    raise RuntimeError("model failure")
+
+
+@pytest.fixture
+def config(monkeypatch):
+    monkeypatch.setenv("SKYFI_RABBITMQ_REQ_QUEUE", "requests")
+    monkeypatch.setenv("SKYFI_RABBITMQ_RESP_QUEUE", "responses")
+    monkeypatch.setenv("SKYFI_RABBITMQ_DL_QUEUE", "dead-letters")
+    monkeypatch.setenv("SKYFI_RABBITMQ_MAX_ATTEMPTS", "3")
+    monkeypatch.setenv("SKYFI_RABBITMQ_RETRY_DELAY", "0.01")
+    monkeypatch.setenv("SKYFI_METRICS_PORT", "0")
+    load_config.cache_clear()
+    attempts.clear()
+    yield load_config()
+    load_config.cache_clear()
+
+
+def deliver(handler, channel, headers=None, tag=1):
+    body = orjson.dumps({"request_id": str(uuid.uuid4()), "num": 1})
+    handler(channel, Basic.Deliver(delivery_tag=tag), pika.BasicProperties(
+        correlation_id="corr", message_id="message", priority=3, timestamp=1700000000,
+        app_id="client", headers=headers), body)
+
+
+def test_transient_error_is_retried_with_backoff(config, fake_channel):
+    handler = RabbitMQHandler().handle(flaky_inference)
+
+    deliver(handler, fake_channel, headers={ATTEMPTS_HEADER: 1})
+
+    (exchange, routing_key, _, properties), = fake_channel.published
+    assert (exchange, routing_key) == ("", "requests.retry.20ms")
+    assert properties.headers[ATTEMPTS_HEADER] == 2
+    # the other properties of the message are kept
+    assert (properties.correlation_id, properties.message_id, properties.priority,
+            properties.timestamp, properties.app_id) == ("corr", "message", 3, 1700000000, "client")
+    assert fake_channel.acked == [1]
+
+
+def test_transient_error_is_dead_lettered_after_max_attempts(config, fake_channel):
+    handler = RabbitMQHandler().handle(flaky_inference)
+
+    deliver(handler, fake_channel, headers={ATTEMPTS_HEADER: 2})
+
+    (_, routing_key, _, properties), = fake_channel.published
+    assert routing_key == "dead-letters"
+    assert properties.headers[ATTEMPTS_HEADER] == 3
+    assert properties.headers[ERROR_HEADER] == "TransientError: service busy"
+    assert properties.message_id == "message"
+
+
+def test_model_error_is_dead_lettered_right_away(config, fake_channel):
+    handler = RabbitMQHandler().handle(failing_inference)
+
+    deliver(handler, fake_channel)
+
+    (_, routing_key, _, properties), = fake_channel.published
+    assert routing_key == "dead-letters"
+    assert properties.headers[ATTEMPTS_HEADER] == 1
+    assert fake_channel.acked == [1]
+    assert fake_channel.rejected == []
+
+
+class UnreachableBackend(MemoryBackend):
+    def stat(self, url):
+        raise ConnectionResetError("reset by peer")
+
+    def download_head(self, url, end, file_obj):
+        raise ConnectionResetError("reset by peer")
+
+
+def image_inference(image: skyfi.GeoTIFF) -> skyfi.FloatOutput:
+    return skyfi.FloatOutput(value=1.0, name="output_num")
+
+
+def test_pipeline_download_error_is_retried(config, monkeypatch, fake_channel):
+    monkeypatch.setenv("SKYFI_PIPELINE_ENABLED", "true")
+    load_config.cache_clear()
+    previous = register_backend("memory", UnreachableBackend())
+    handler = RabbitMQHandler()
+    try:
+        body = orjson.dumps({"request_id": str(uuid.uuid4()),
+                             "image": {"path": "memory://bucket/image.tif"}})
+        handler.handle(image_inference)(fake_channel, Basic.Deliver(delivery_tag=1),
+                                        pika.BasicProperties(), body)
+    finally:
+        handler.pipeline.shutdown()
+        register_backend("memory", previous)
+
+    (_, routing_key, _, properties), = fake_channel.published
+    assert routing_key == "requests.retry.10ms"
+    assert properties.headers[ATTEMPTS_HEADER] == 1
+    assert fake_channel.acked == [1]
+
+
+def test_malformed_message_is_dead_lettered(config, fake_channel):
+    handler = RabbitMQHandler().handle(flaky_inference)
+
+    handler(fake_channel, Basic.Deliver(delivery_tag=1), pika.BasicProperties(), b"{not json")
+
+    (_, routing_key, body, properties), = fake_channel.published
+    assert (routing_key, body) == ("dead-letters", b"{not json")
+    assert properties.headers[ERROR_HEADER].startswith("JSONDecodeError")
+    assert fake_channel.acked == [1]
+    assert attempts == []
+
+
+@pytest.mark.parametrize("settings, target", [
+    ({}, None),
+    ({"DL_QUEUE": "dead-letters"}, ("", "dead-letters")),
+    ({"DL_EXCHANGE": "errors", "DL_QUEUE": "dead-letters"}, ("errors", "dead-letters")),
+    ({"DL_EXCHANGE": "errors", "DL_ROUTING_KEY": "failed"}, ("errors", "failed")),
+])
+def test_dead_letter_target(settings, target):
+    config = SkyfiConfig(rabbitmq_req_queue="requests",
+                         **{f"rabbitmq_{key.lower()}": value for key, value in settings.items()})
+
+    assert dead_letter_target(config) == target
+
+
+def test_dead_letter_exchange_needs_a_routing_key():
+    config = SkyfiConfig(rabbitmq_req_queue="requests", rabbitmq_dl_exchange="errors")
+
+    with pytest.raises(ValueError, match="ROUTING_KEY"):
+        dead_letter_target(config)
+
+
+def test_is_transient():
+    try:
+        try:
+            raise ConnectionResetError("reset by peer")
+        except ConnectionResetError as ex:
+            raise ValueError(f"Error downloading file: {ex}")
+    except ValueError as ex:
+        wrapped = ex
+
+    assert is_transient(wrapped)
+    assert is_transient(TimeoutError())
+    assert not is_transient(ValueError("bad input"))
+    assert not is_transient(RuntimeError("model failure"))
+
+
+def test_backoff_is_exponential(config):
+    assert [retry_delay(config, attempt) for attempt in (1, 2, 3)] == [0.01, 0.02, 0.04]
+    assert retry_queue(config, 1) == "requests.retry.10ms"
+
+
+def test_retried_through_local_broker(config):
+    broker = LocalBroker()
+    listener = threading.Thread(
+        target=RabbitMQHandler(connection_factory=broker.connect).listen,
+        args=(flaky_inference,),
+    )
+    listener.start()
+    try:
+        broker.publish("requests", orjson.dumps({"request_id": str(uuid.uuid4()), "num": 1}),
+                       pika.BasicProperties(correlation_id="corr"))
+        body, properties = broker.get("responses", timeout=5)
+    finally:
+        broker.close()
+        listener.join(timeout=5)
+
+    assert orjson.loads(body)["response"]["value"] == 1
+    assert properties.correlation_id == "corr"
+    assert len(attempts) == 3
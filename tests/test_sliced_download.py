@@ -0,0 +1,110 @@
+import os
+
+import pytest
+
+from skyfi_modelship.config import SkyfiConfig
+from skyfi_modelship.util import storage
+from skyfi_modelship.util.storage import MemoryBackend, ObjectInfo, register_backend
+from skyfi_modelship.util.transfer import sliced_download
+
+
+class FlakyBackend(MemoryBackend):
+    """ Drops the connection half way through the first request of every range. """
+
+    def __init__(self):
+        super().__init__()
+        self.requests = []
+        self.stats = 0
+
+    def stat(self, url):
+        self.stats += 1
+        return super().stat(url)
+
+    def download_range(self, url, start, end, file_obj, generation=None):
+        first_attempt = all(req[1] != end for req in self.requests)
+        self.requests.append((start, end))
+        if first_attempt:
+            half = start + (end - start) // 2
+            file_obj.write(self.get(url)[start:half])
+            raise ConnectionError("connection reset")
+        super().download_range(url, start, end, file_obj, generation)
+
+
+@pytest.fixture
+def config(mocker):
+    config = SkyfiConfig(
+        download_slice_threshold=1000, download_slice_size=300, download_slice_workers=3
+    )
+    mocker.patch("skyfi_modelship.util.storage.load_config", return_value=config)
+    mocker.patch("skyfi_modelship.util.transfer.load_config", return_value=config)
+    return config
+
+
+@pytest.fixture
+def backend():
+    backend = FlakyBackend()
+    previous = register_backend("memory", backend)
+    yield backend
+    register_backend("memory", previous)
+
+
+def test_large_object_is_downloaded_in_slices(config, backend, tmp_path):
+    data = os.urandom(2000)
+    backend.put("memory://bucket/scene.tif", data)
+
+    path = storage.download("memory://bucket/scene.tif", str(tmp_path))
+
+    assert open(path, "rb").read() == data
+    # the first slice is the probing read, the size is only known after it
+    ranges = {end: start for start, end in backend.requests}
+    assert sorted(ranges) == [600, 900, 1200, 1500, 1800, 2000]
+    # the failed ranges are resumed from the last written byte
+    assert (750, 900) in backend.requests
+    assert (1900, 2000) in backend.requests
+    assert backend.stats == 1
+
+
+def test_medium_object_is_completed_in_a_range(config, backend, tmp_path):
+    data = os.urandom(500)
+    backend.put("memory://bucket/scene.tif", data)
+
+    path = storage.download("memory://bucket/scene.tif", str(tmp_path))
+
+    assert open(path, "rb").read() == data
+    assert backend.requests == [(300, 500), (400, 500)]
+
+
+def test_small_object_is_downloaded_whole(config, backend, tmp_path):
+    backend.put("memory://bucket/scene.tif", b"small")
+
+    path = storage.download("memory://bucket/scene.tif", str(tmp_path))
+
+    assert open(path, "rb").read() == b"small"
+    assert backend.requests == []
+    assert backend.stats == 0
+
+
+def test_overwritten_object_is_downloaded_again(config, backend, tmp_path):
+    backend.put("memory://bucket/scene.tif", os.urandom(2000))
+    data = os.urandom(2000)
+    stat = backend.stat
+    # the object is overwritten between the probing read and the stat
+    backend.stat = lambda url: (backend.put(url, data), stat(url))[1]
+
+    path = storage.download("memory://bucket/scene.tif", str(tmp_path))
+
+    assert open(path, "rb").read() == data
+    assert 300 in {end for _, end in backend.requests}
+
+
+def test_checksum_mismatch_is_detected(config, tmp_path):
+    backend = MemoryBackend()
+    backend.put("memory://bucket/scene.tif", os.urandom(2000))
+    info = backend.stat("memory://bucket/scene.tif")
+    info = ObjectInfo(size=info.size, generation=info.generation, md5_hash=info.md5_hash,
+                      crc32c="AAAAAA==")
+    destination = str(tmp_path / "scene.tif")
+
+    with pytest.raises(ValueError, match="Checksum mismatch"):
+        sliced_download(backend, "memory://bucket/scene.tif", info, destination)
+    assert not os.path.exists(destination)
@@ -0,0 +1,96 @@
+import os
+import uuid
+
+import pytest
+
+import skyfi_modelship as skyfi
+from skyfi_modelship.util import storage
+from skyfi_modelship.util.execution import exec_func
+from skyfi_modelship.util.inference_request import convert_request
+from skyfi_modelship.util.storage import GCSBackend, MemoryBackend, register_backend
+
+
+@pytest.fixture
+def memory_backend():
+    backend = MemoryBackend()
+    previous = register_backend("memory", backend)
+    yield backend
+    register_backend("memory", previous)
+
+
+def test_memory_backend_pipeline(memory_backend):
+    memory_backend.put("memory://bucket/input.txt", b"skyfi")
+
+    def inference(io_file: skyfi.File) -> skyfi.FileOutput:
+        with open(io_file.path, "rb") as f:
+            assert f.read() == b"skyfi"
+        return skyfi.FileOutput(value=io_file, name="output_file", ref_name="io_file")
+
+    data = {
+        "request_id": str(uuid.uuid4()),
+        "output_folder": "memory://bucket/out",
+        "io_file": {"path": "memory://bucket/input.txt"},
+    }
+    response = exec_func(inference, convert_request(data, inference))
+
+    output_path = response.response.value.path
+    assert output_path == "memory://bucket/out/input_inference_output_file_for_io_file.txt"
+    assert memory_backend.get(output_path) == b"skyfi"
+
+
+def test_file_backend_pipeline(file_backend, tmp_path):
+    (tmp_path / "input.txt").write_bytes(b"skyfi")
+
+    def inference(io_file: skyfi.File) -> skyfi.FileOutput:
+        assert io_file.path != f"{tmp_path}/input.txt", "input is copied to the request folder"
+        return skyfi.FileOutput(value=io_file, name="output_file", ref_name="io_file")
+
+    data = {
+        "request_id": str(uuid.uuid4()),
+        "output_folder": f"file://{tmp_path}/out",
+        "io_file": {"path": f"file://{tmp_path}/input.txt"},
+    }
+    response = exec_func(inference, convert_request(data, inference))
+
+    output_path = response.response.value.path
+    assert output_path == f"file://{tmp_path}/out/input_inference_output_file_for_io_file.txt"
+    assert (tmp_path / "out" / "input_inference_output_file_for_io_file.txt").read_bytes() == \
+        b"skyfi"
+
+
+def test_unknown_scheme_is_local():
+    assert storage.is_remote("gs://bucket/file.tif")
+    assert not storage.is_remote("/tmp/file.tif")
+    assert not storage.is_remote("s3://bucket/file.tif")
+    with pytest.raises(ValueError):
+        storage.get_backend("s3://bucket/file.tif")
+
+
+def test_local_output_folders_are_not_written(tmp_path):
+    (tmp_path / "output.txt").write_bytes(b"skyfi")
+
+    def inference() -> skyfi.FileOutput:
+        return skyfi.FileOutput(value=skyfi.File(path=str(tmp_path / "output.txt")),
+                                name="output_file")
+
+    data = {"request_id": str(uuid.uuid4()), "output_folder": f"file://{tmp_path}/victim"}
+    for url in ["file:///tmp/file.tif", "memory://bucket/file.tif"]:
+        assert not storage.is_remote(url)
+    exec_func(inference, convert_request(data, inference))
+
+    assert not (tmp_path / "victim").exists()
+
+
+def test_gcs_client_is_reused(mocker):
+    client_cls = mocker.patch("google.cloud.storage.Client")
+    mocker.patch("google.cloud.storage.Blob")
+    backend = GCSBackend()
+
+    backend.download("gs://bucket/a.tif", "/tmp/a.tif")
+    backend.upload("/tmp/a.tif", "gs://bucket/b.tif")
+    assert client_cls.call_count == 1
+
+    # a forked process gets its own client
+    mocker.patch("skyfi_modelship.util.storage.os.getpid", return_value=os.getpid() + 1)
+    backend.download("gs://bucket/a.tif", "/tmp/a.tif")
+    assert client_cls.call_count == 2
@@ -0,0 +1,179 @@
+import asyncio
+import os
+import threading
+import time
+import uuid
+
+import orjson
+import pika
+from pika.spec import Basic
+import pytest
+
+import skyfi_modelship as skyfi
+from skyfi_modelship.handler.fastapi_handler import FastApiHandler
+from skyfi_modelship.handler.rabbitmq_handler import RabbitMQHandler
+from skyfi_modelship.util import storage
+from skyfi_modelship.util.execution import run_request
+from skyfi_modelship.util.storage import MemoryBackend, local_folder, register_backend
+
+OUTPUT_FOLDER = "memory://bucket/output"
+TILES = 3
+tile_folder = None
+
+
+@pytest.fixture
+def backend(tmp_path):
+    global tile_folder
+    tile_folder = tmp_path
+    backend = MemoryBackend()
+    previous = register_backend("memory", backend)
+    yield backend
+    register_backend("memory", previous)
+
+
+def uploaded(idx: int) -> str:
+    return f"{OUTPUT_FOLDER}/tile_{idx}_tile_inference.tif"
+
+
+def tile(idx: int) -> skyfi.GeoTIFFOutput:
+    path = tile_folder / f"tile_{idx}.tif"
+    path.write_bytes(b"tile %d" % idx)
+    return skyfi.GeoTIFFOutput(value=skyfi.GeoTIFF(path=str(path)), name=f"tile_{idx}")
+
+
+def tile_inference(count: skyfi.int):
+    backend = storage.get_backend(OUTPUT_FOLDER)
+    for idx in range(count):
+        if idx:
+            # the previous tile is uploaded while the inference goes on
+            deadline = time.monotonic() + 5
+            while uploaded(idx - 1) not in backend.objects and time.monotonic() < deadline:
+                time.sleep(0.01)
+            assert uploaded(idx - 1) in backend.objects
+        yield tile(idx)
+
+
+def failing_tile_inference(count: skyfi.int):
+    yield tile(0)
+    raise RuntimeError("model failure")
+
+
+endless_stopped = threading.Event()
+
+
+def endless_tile_inference(count: skyfi.int):
+    endless_stopped.clear()
+    try:
+        idx = 0
+        while True:
+            yield tile(idx % count)
+            idx += 1
+            time.sleep(0.01)
+    finally:
+        endless_stopped.set()
+
+
+async def async_tile_inference(count: skyfi.int):
+    for idx in range(count):
+        await asyncio.sleep(0)
+        yield tile(idx)
+
+
+def request(**kwargs) -> dict:
+    return {"request_id": str(uuid.uuid4()), "output_folder": OUTPUT_FOLDER} | kwargs
+
+
+def test_outputs_upload_while_inference_runs(backend):
+    response = run_request(tile_inference, request(count=TILES))
+
+    assert [output.value.path for output in response.response] == \
+        [uploaded(idx) for idx in range(TILES)]
+    assert backend.get(uploaded(2)) == b"tile 2"
+    assert {"inference", "upload", "cleanup"} <= set(response.timings)
+
+
+def test_async_generator(backend):
+    response = run_request(async_tile_inference, request(count=TILES))
+
+    assert [output.name for output in response.response] == ["tile_0", "tile_1", "tile_2"]
+
+
+def test_generator_error_is_raised(backend):
+    with pytest.raises(RuntimeError, match="model failure"):
+        run_request(failing_tile_inference, request(count=TILES))
+
+
+def stream(http_request, func, **kwargs) -> list:
+    post = FastApiHandler().handle(func)
+
+    async def scenario():
+        response = await post(http_request(orjson.dumps(request(**kwargs))))
+        assert response.media_type == "application/x-ndjson"
+        return [orjson.loads(line) async for line in response.body_iterator]
+
+    return asyncio.run(scenario())
+
+
+def test_fastapi_streams_ndjson(backend, http_request):
+    lines = stream(http_request, tile_inference, count=TILES)
+
+    assert [line["output"]["value"]["path"] for line in lines[:-1]] == \
+        [uploaded(idx) for idx in range(TILES)]
+    assert set(lines[-1]) == {"request_id", "output_folder", "timings"}
+
+
+def test_fastapi_stream_error_line(backend, http_request):
+    lines = stream(http_request, failing_tile_inference, count=TILES)
+
+    assert lines[0]["output"]["name"] == "tile_0"
+    assert lines[1] == {"error": "RuntimeError: model failure"}
+
+
+def test_fastapi_stream_never_iterated_releases_slot(backend, http_request):
+    handler = FastApiHandler()
+    post = handler.handle(tile_inference)
+
+    async def scenario():
+        # the client went away before the first line, the body is never iterated
+        response = await post(http_request(orjson.dumps(request(count=TILES))))
+        assert handler.pending == 1
+        await response.background()
+
+    asyncio.run(scenario())
+    assert handler.pending == 0
+
+
+def test_fastapi_stream_disconnect_stops_model(backend, http_request):
+    handler = FastApiHandler()
+    post = handler.handle(endless_tile_inference)
+    data = request(count=TILES)
+    folder = local_folder(data["request_id"])
+    os.makedirs(folder)
+
+    async def scenario():
+        response = await post(http_request(orjson.dumps(data)))
+        lines = response.body_iterator
+        assert "output" in orjson.loads(await lines.__anext__())
+        # the client went away mid-stream
+        await lines.aclose()
+        await response.background()
+
+    asyncio.run(scenario())
+    assert handler.pending == 0
+    assert endless_stopped.wait(5)
+    deadline = time.monotonic() + 5
+    while os.path.exists(folder) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert not os.path.exists(folder)
+
+
+def test_rabbitmq_aggregates_outputs(backend, fake_channel):
+    handler = RabbitMQHandler().handle(tile_inference)
+
+    handler(fake_channel, Basic.Deliver(delivery_tag=1), pika.BasicProperties(),
+            orjson.dumps(request(count=TILES)))
+
+    (_, _, body, _), = fake_channel.published
+    assert [output["value"]["path"] for output in orjson.loads(body)["response"]] == \
+        [uploaded(idx) for idx in range(TILES)]
+    assert fake_channel.acked == [1]